@@ -1,6 +1,7 @@
 import catalog.config
 from flask import Flask
 from .models import Base, Category, Item
+from .queries import countQueries, checkQueryBudget
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -10,6 +11,10 @@ app = Flask(__name__)
 app.config.from_object('catalog.config')
 
 engine = create_engine(config.DATABASE_URI)
+
+# count the queries run by each request, against the view's budget
+countQueries(engine)
+app.after_request(checkQueryBudget)
     
 #Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
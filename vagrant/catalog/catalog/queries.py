@@ -0,0 +1,55 @@
+"""
+Per request SQL query counting and query budgets
+"""
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a view runs more queries than its budget."""
+
+
+def countQueries(engine):
+    """Count the statements engine runs during each request in g.query_count."""
+    event.listen(engine, 'before_cursor_execute', _countQuery)
+
+
+def _countQuery(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = getattr(g, 'query_count', 0) + 1
+
+
+def queryBudget(limit):
+    """Decorator giving a view the most queries it should run per request.
+
+    The budget covers the view's worst path, including the queries its
+    template triggers, so it must not depend on how many rows are shown.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.query_budget = limit
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def checkQueryBudget(response):
+    """after_request handler comparing a request's queries to its budget.
+
+    When testing, or with QUERY_BUDGET_STRICT set, a view that goes over
+    its budget raises QueryBudgetExceeded, otherwise a warning is logged.
+    """
+    count = getattr(g, 'query_count', 0)
+    budget = getattr(g, 'query_budget', None)
+    if current_app.debug or current_app.testing:
+        response.headers['X-Query-Count'] = str(count)
+    if budget is not None and count > budget:
+        message = '%s ran %d queries, over its budget of %d' % (
+            request.endpoint, count, budget)
+        if current_app.testing or current_app.config.get('QUERY_BUDGET_STRICT'):
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
@@ -2,10 +2,12 @@
 from catalog import app, db_session
 from catalog.models import Category, Item, User
 from catalog.forms import CategoryForm, ItemForm
+from catalog.queries import queryBudget
 
 from flask import render_template, request, redirect, url_for, jsonify, flash
 from flask import session, abort, send_from_directory, make_response
 import random, string
+from sqlalchemy.orm import joinedload
 
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.client import FlowExchangeError
@@ -20,6 +22,7 @@ import os
 # Show catalog
 @app.route('/')
 @app.route('/catalog/')
+@queryBudget(1)
 def catalog():
     categories = db_session.query(Category).all()
     return render_template('catalog.html',categories=categories)
@@ -28,18 +31,22 @@ def catalog():
 # Show category
 @app.route('/category/<name>/')
 @app.route('/category/<name>/items')
+@queryBudget(1)
 def category(name):
-    category = db_session.query(Category).filter_by(name = name).one()
+    # load the items with the category, so listing them is one query
+    # however many items there are
+    category = db_session.query(Category).options(
+        joinedload(Category.items)).filter_by(name = name).one()
     
     if category is None:
         abort(404)
     
-    #items = db_session.query(Item).filter_by(category_id = category.id)
     return render_template('category.html', category=category, items=category.items)
 
 
 # New category    
 @app.route('/category/new/', methods=['GET', 'POST'])
+@queryBudget(1)
 def newCategory():
     if 'user_id' not in session:
         return redirect('/login')
@@ -55,6 +62,7 @@ def newCategory():
 
 # Edit category
 @app.route('/category/<name>/edit/', methods = ['GET', 'POST'])
+@queryBudget(3)
 def editCategory(name):
     if 'user_id' not in session:
         return redirect('/login')
@@ -79,11 +87,14 @@ def editCategory(name):
 
 # Delete category
 @app.route('/category/<name>/delete/', methods = ['GET','POST'])
+@queryBudget(3)
 def deleteCategory(name):
     if 'user_id' not in session:
         return redirect('/login')
     
-    category = db_session.query(Category).filter_by(name = name).one()
+    # the items are deleted with the category, so load them with it
+    category = db_session.query(Category).options(
+        joinedload(Category.items)).filter_by(name = name).one()
     
     if category is None:
         abort(404)
@@ -103,6 +114,7 @@ def deleteCategory(name):
 
 # Show item
 @app.route('/item/<name>')
+@queryBudget(1)
 def item(name):
     item = db_session.query(Item).filter_by(name=name).one()
     
@@ -120,6 +132,7 @@ def uploads(filename):
 # New item    
 #TODO: route that includes category
 @app.route('/item/new/', methods=['GET', 'POST'])
+@queryBudget(3)
 def newItem():
     if 'user_id' not in session:
         return redirect('/login')
@@ -151,11 +164,14 @@ def newItem():
 
 # Edit item
 @app.route('/item/<name>/edit/', methods = ['GET', 'POST'])
+@queryBudget(4)
 def editItem(name):
     if 'user_id' not in session:
         return redirect('/login')
     
-    item = db_session.query(Item).filter_by(name = name).one()
+    # the form reads the item's category, so load it with the item
+    item = db_session.query(Item).options(
+        joinedload(Item.category)).filter_by(name = name).one()
     
     if item is None:
         abort(404)
@@ -188,6 +204,7 @@ def editItem(name):
 
 # Delete item
 @app.route('/item/<name>/delete/', methods = ['GET','POST'])
+@queryBudget(2)
 def deleteItem(name):
     if 'user_id' not in session:
         return redirect('/login')
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Test cases for the catalog views' query budgets
+#
+# Runs every view that has a query budget through Flask's test client with
+# app.testing set, so a view that runs more queries than its budget raises
+# QueryBudgetExceeded.  Uses a scratch SQLite database, not catalog.db.
+
+import os
+import tempfile
+
+from sqlalchemy import create_engine
+
+from catalog import app, db_session
+from catalog.models import Base, Category, Item, User
+from catalog.queries import countQueries, queryBudget, QueryBudgetExceeded
+
+
+# A view over its budget, to check strict mode catches it.
+@app.route('/test/over-budget')
+@queryBudget(1)
+def overBudget():
+    db_session.query(Category).all()
+    db_session.query(Item).all()
+    return 'Over budget'
+
+
+def setUp():
+    """Point the app at a new scratch database, returning its file name."""
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine('sqlite:///' + path)
+    countQueries(engine)
+    db_session.close()
+    db_session.bind = engine
+    Base.metadata.create_all(engine)
+
+    app.testing = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    user = User(name='Tester', email='tester@example.com')
+    db_session.add(user)
+    db_session.commit()
+    category = Category('appetizers', user.id)
+    db_session.add(category)
+    db_session.commit()
+    for name in ['eggrolls', 'wings']:
+        db_session.add(Item(name=name, description='Tasty %s' % name,
+                            category_id=category.id, user_id=user.id))
+    db_session.commit()
+    return path
+
+
+def fetch(client, method, path, data=None):
+    """Make a request with the test client, returning the response.
+
+    The session is emptied first, as in a new process, so the request's
+    queries aren't answered from objects loaded by earlier requests.
+    """
+    db_session.close()
+    return client.open(path, method=method, data=data)
+
+
+def loggedInClient():
+    """Returns a test client logged in as the test user."""
+    client = app.test_client()
+    user = db_session.query(User).filter_by(email='tester@example.com').one()
+    with client.session_transaction() as s:
+        s['user_id'] = user.id
+    return client
+
+
+def check(response, status, what):
+    if response.status_code != status:
+        raise ValueError("%s should return %d, not %d." %
+                         (what, status, response.status_code))
+
+
+def testOverBudget():
+    try:
+        fetch(app.test_client(), 'GET', '/test/over-budget')
+    except QueryBudgetExceeded:
+        print "1. A view over its query budget fails when testing."
+        return
+    raise ValueError("A view over its budget should raise QueryBudgetExceeded.")
+
+
+def testReadViews():
+    client = app.test_client()
+    check(fetch(client, 'GET', '/'), 200, "The catalog")
+    check(fetch(client, 'GET', '/category/appetizers/'), 200, "A category")
+    check(fetch(client, 'GET', '/item/eggrolls'), 200, "An item")
+    print "2. The catalog, category and item pages are within budget."
+
+
+def testEditForms():
+    client = loggedInClient()
+    check(fetch(client, 'GET', '/category/new/'), 200, "The new category form")
+    check(fetch(client, 'GET', '/category/appetizers/edit/'), 200,
+          "The edit category form")
+    check(fetch(client, 'GET', '/category/appetizers/delete/'), 200,
+          "The delete category page")
+    check(fetch(client, 'GET', '/item/new/'), 200, "The new item form")
+    check(fetch(client, 'GET', '/item/eggrolls/edit/'), 200,
+          "The edit item form")
+    check(fetch(client, 'GET', '/item/eggrolls/delete/'), 200,
+          "The delete item page")
+    print "3. The forms to add, edit and delete are within budget."
+
+
+def testCategoryChanges():
+    client = loggedInClient()
+    check(fetch(client, 'POST', '/category/new/', {'name': 'soups'}), 302,
+          "Adding a category")
+    check(fetch(client, 'POST', '/category/soups/edit/',
+                {'name': 'starters'}), 302, "Editing a category")
+    if db_session.query(Category).filter_by(name='starters').count() != 1:
+        raise ValueError("The edited category should be renamed.")
+    print "4. Adding and editing a category are within budget."
+
+
+def testItemChanges():
+    client = loggedInClient()
+    starters = db_session.query(Category).filter_by(name='starters').one()
+    check(fetch(client, 'POST', '/item/new/',
+                {'name': 'soup', 'description': 'Hot soup',
+                 'category': str(starters.id)}), 302, "Adding an item")
+    appetizers = db_session.query(Category).filter_by(name='appetizers').one()
+    check(fetch(client, 'POST', '/item/soup/edit/',
+                {'name': 'broth', 'description': 'Hot broth',
+                 'category': str(appetizers.id)}), 302, "Editing an item")
+    item = db_session.query(Item).filter_by(name='broth').one()
+    if item.category_id != appetizers.id:
+        raise ValueError("The edited item should move to its new category.")
+    check(fetch(client, 'POST', '/item/wings/delete/'), 302,
+          "Deleting an item")
+    print "5. Adding, editing and deleting an item are within budget."
+
+
+def testDeleteCategory():
+    client = loggedInClient()
+    check(fetch(client, 'POST', '/category/appetizers/delete/'), 302,
+          "Deleting a category with items")
+    if db_session.query(Item).count() != 0:
+        raise ValueError("A category's items should be deleted with it.")
+    print "6. Deleting a category and its items is within budget."
+
+
+if __name__ == '__main__':
+    path = setUp()
+    try:
+        testOverBudget()
+        testReadViews()
+        testEditForms()
+        testCategoryChanges()
+        testItemChanges()
+        testDeleteCategory()
+    finally:
+        db_session.close()
+        os.remove(path)
+    print "Success!  All tests pass!"
@@ -6,12 +6,28 @@
 import forumdb
 
 # Other modules used to run a web server.
-import cgi
-from wsgiref.simple_server import make_server
+import argparse
+import hashlib
+import json
+import os
+import signal
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
 from wsgiref import util
+try:
+    import Queue as queue
+    from cgi import escape
+    from urllib import quote
+    from urlparse import parse_qs
+except ImportError:
+    # Python 3, for forum_async.py.
+    import queue
+    from html import escape
+    from urllib.parse import quote, parse_qs
 
-# HTML template for the forum page
-HTML_WRAP = '''\
+# HTML template for the top of the forum page, up to the posts
+HTML_HEAD = '''\
 <!DOCTYPE html>
 <html>
   <head>
@@ -24,44 +40,299 @@ HTML_WRAP = '''\
 		 margin: 10px 20%%; }
       hr.postbound { width: 50%%; }
       em.date { color: #999 }
+      div.nav { text-align: center; }
     </style>
   </head>
   <body>
     <h1>DB Forum</h1>
+    <form method=get action="/search">
+      <div><input name="q" value="%s"> <button type="submit">Search</button></div>
+    </form>
     <form method=post action="/post">
       <div><textarea id="content" name="content"></textarea></div>
       <div><button id="go" type="submit">Post message</button></div>
     </form>
     <!-- post content will go here -->
-%s
+'''
+
+# HTML for the bottom of the forum page, after the posts
+HTML_TAIL = '''
   </body>
 </html>
 '''
 
+# Script put before HTML_TAIL by forum_async.py, which serves /events, to
+# show new posts as they are made
+LIVE_SCRIPT = '''
+    <script>
+      if (window.EventSource && !location.search) {
+        new EventSource('/events').addEventListener('post', function (e) {
+          document.querySelector('form[action="/post"]').insertAdjacentHTML('afterend', e.data);
+        });
+      }
+    </script>'''
+
 # HTML template for an individual comment
 POST = '''\
     <div class=post><em class=date>%(time)s</em><br>%(content)s</div>
 '''
 
+# HTML template for the links to newer and older pages of posts
+NAV = '''\
+    <div class=nav>%s</div>
+'''
+
+# HTML template for a link to another page of posts
+NAV_LINK = '''<a href="/?%s=%s">%s</a>'''
+
+# HTML template for the link to the next page of search results
+SEARCH_LINK = '''<a href="/search?q=%s&amp;after=%s">More results</a>'''
+
+# HTML shown when a search finds nothing
+NO_RESULTS = '''\
+    <div class=nav>No posts found.</div>
+'''
+
+# Number of posts shown on a page
+PAGE_SIZE = 20
+
+# Number of posts whose HTML is kept by PostHtml()
+FRAGMENT_CACHE_SIZE = 10000
+
+## Encode text for a WSGI response body.
+def Encode(text):
+    '''Returns text as UTF-8 bytes; a Python 2 str is already bytes.'''
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+# The parts of the page that are the same on every page, as bytes
+HEAD = Encode(HTML_HEAD % '')
+TAIL = Encode(HTML_TAIL)
+
+## Rendered posts, by id
+_fragments = {}
+
+## Render a post
+def PostHtml(post):
+    '''Returns the HTML of a post, escaped and encoded as UTF-8.
+
+    A post never changes once it is made, so its HTML is made the first
+    time it is shown and kept by id, for up to FRAGMENT_CACHE_SIZE posts.
+    Every page and search result showing the post then sends the same
+    bytes.
+    '''
+    html = _fragments.get(post.id)
+    if html is None:
+        html = Encode(POST % {'time': post.time,
+                              'content': escape(post.content)})
+        if len(_fragments) >= FRAGMENT_CACHE_SIZE:
+            _fragments.clear()
+        _fragments[post.id] = html
+    return html
+
+## Cache of rendered pages
+class PageCache(object):
+    '''Rendered pages of the forum, keyed by query string.
+
+    The whole cache is dropped when a post is added in this process, and
+    when the newest post in the database changes, which is checked at most
+    every check_seconds so posts added by other processes show up too.
+    '''
+
+    def __init__(self, max_pages=100, check_seconds=1.0):
+        self.max_pages = max_pages
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.generation = 0
+        self.latest = None
+        self.checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def Get(self, key):
+        '''Returns a tuple (page, generation), page is None on a miss.
+
+        generation is passed back to Put(), so a page rendered from posts
+        that have changed since is not stored.
+        '''
+        now = time.time()
+        if now - self.checked > self.check_seconds:
+            latest = forumdb.LatestPost()
+            with self.lock:
+                self.checked = now
+                if latest != self.latest:
+                    self.latest = latest
+                    self._Clear()
+        with self.lock:
+            return self.pages.get(key), self.generation
+
+    def Put(self, key, page, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            if len(self.pages) >= self.max_pages:
+                self.pages.clear()
+            self.pages[key] = page
+
+    def Invalidate(self, content=None):
+        '''Drop every page, called by forumdb.AddPost().'''
+        with self.lock:
+            self._Clear()
+
+    def _Clear(self):
+        self.pages.clear()
+        self.generation += 1
+
+    def Record(self, hit, seconds, not_modified):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+            if not_modified:
+                self.not_modified += 1
+
+    def Stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'pages': len(self.pages),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': float(self.hits) / requests if requests else 0.0,
+                'mean_hit_ms': (1000 * self.hit_seconds / self.hits
+                                if self.hits else 0.0),
+                'mean_miss_ms': (1000 * self.miss_seconds / self.misses
+                                 if self.misses else 0.0),
+            }
+
+PAGES = PageCache()
+forumdb.ADD_POST_HOOKS.append(PAGES.Invalidate)
+
 ## Request handler for main page
 def View(env, resp):
     '''View is the 'main page' of the forum.
 
-    It displays the submission form and the previously posted messages.
+    It displays the submission form and a page of the previously posted
+    messages, with links to the newer and older pages.  Rendered pages are
+    cached, and sent with an ETag so a client that has the page already
+    gets a 304 Not Modified instead.  A page is sent as the list of its
+    parts, so the whole page is never copied into one string.
+    '''
+    return CachedPage(env, resp, env.get('QUERY_STRING', ''), RenderPage)
+
+## Serve a page from the cache, rendering it on a miss
+def CachedPage(env, resp, key, render):
+    '''Send the page cached under key, or render(key) if there is none.
+
+    render returns the page as a list of byte strings.  The page is sent
+    with an ETag, and a 304 Not Modified is sent instead if the client
+    already has it.
+    '''
+    start = time.time()
+    page, generation = PAGES.Get(key)
+    hit = page is not None
+    if not hit:
+        chunks = tuple(render(key))
+        digest = hashlib.sha1()
+        for chunk in chunks:
+            digest.update(chunk)
+        page = (chunks, '"%s"' % digest.hexdigest(),
+                str(sum(len(chunk) for chunk in chunks)))
+        PAGES.Put(key, page, generation)
+    chunks, etag, length = page
+    headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+    matches = env.get('HTTP_IF_NONE_MATCH', '')
+    not_modified = (matches.strip() == '*' or
+                    etag in [tag.strip() for tag in matches.split(',')])
+    if not_modified:
+        resp('304 Not Modified', headers)
+        chunks = ()
+    else:
+        resp('200 OK', [('Content-type', 'text/html'),
+                        ('Content-Length', length)] + headers)
+    PAGES.Record(hit, time.time() - start, not_modified)
+    return chunks
+
+## Render a page of the forum
+def RenderPage(query_string):
+    '''Returns the page of posts a query string asks for, in parts.'''
+    # get the page of posts from database
+    query = parse_qs(query_string)
+    before = query.get('before', [None])[0]
+    after = query.get('after', [None])[0]
+    try:
+        posts, older, newer = forumdb.GetPosts(before, after, PAGE_SIZE)
+    except ValueError:
+        # A bad cursor in the URL, show the newest posts instead.
+        posts, older, newer = forumdb.GetPosts(limit=PAGE_SIZE)
+    links = []
+    if newer:
+        links.append(NAV_LINK % ('after', quote(newer), 'Newer posts'))
+    if older:
+        links.append(NAV_LINK % ('before', quote(older), 'Older posts'))
+    chunks = [HEAD]
+    chunks.extend(PostHtml(p) for p in posts)
+    if links:
+        chunks.append(Encode(NAV % ' | '.join(links)))
+    chunks.append(TAIL)
+    return chunks
+
+## Request handler for searching posts
+def Search(env, resp):
+    '''Search shows the posts matching the words in the q parameter.
+
+    Results are ranked with the best match first, a page at a time, and
+    cached like the pages of the main view.
     '''
-    # get posts from database
-    posts = forumdb.GetAllPosts()
-    # send results
-    headers = [('Content-type', 'text/html')]
+    return CachedPage(env, resp, 'search?' + env.get('QUERY_STRING', ''),
+                      RenderSearch)
+
+## Render a page of search results
+def RenderSearch(key):
+    '''Returns the search results a cache key asks for, in parts.'''
+    query = parse_qs(key.split('?', 1)[1])
+    words = query.get('q', [''])[0].strip()
+    after = query.get('after', [None])[0]
+    if not words:
+        return [HEAD, Encode(NO_RESULTS), TAIL]
+    try:
+        posts, more = forumdb.SearchPosts(words, PAGE_SIZE, after)
+    except ValueError:
+        # A bad cursor in the URL, show the first page instead.
+        posts, more = forumdb.SearchPosts(words, PAGE_SIZE)
+    chunks = [Encode(HTML_HEAD % escape(words, True))]
+    chunks.extend(PostHtml(p) for p in posts)
+    if not posts:
+        chunks.append(Encode(NO_RESULTS))
+    if more:
+        chunks.append(Encode(NAV % (SEARCH_LINK % (quote(Encode(words)),
+                                                   quote(more)))))
+    chunks.append(TAIL)
+    return chunks
+
+## Request handler for the page cache statistics
+def Stats(env, resp):
+    '''Stats reports the page cache's hit ratio and latency as JSON.'''
+    headers = [('Content-type', 'application/json')]
     resp('200 OK', headers)
-    return [HTML_WRAP % ''.join(POST % p for p in posts)]
+    return [Encode(json.dumps(PAGES.Stats(), indent=2, sort_keys=True))]
 
 ## Request handler for posting - inserts to database
 def Post(env, resp):
     '''Post handles a submission of the forum's form.
   
     The message the user posted is saved in the database, then it sends a 302
-    Redirect back to the main page so the user can see their new post.
+    Redirect back to the main page so the user can see their new post.  If
+    the post can't be saved, it sends a 500 error instead.
     '''
     # Get post content
     input = env['wsgi.input']
@@ -69,22 +340,38 @@ def Post(env, resp):
     # If length is zero, post is empty - don't save it.
     if length > 0:
         postdata = input.read(length)
-        fields = cgi.parse_qs(postdata)
+        # Python 2's parse_qs turns each %-escaped byte of a unicode string
+        # into a character of its own, so there the raw bytes are unquoted
+        # and the value decoded afterwards.
+        if str is not bytes:
+            postdata = postdata.decode('utf-8')
+        fields = parse_qs(postdata)
         content = fields['content'][0]
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
         # If the post is just whitespace, don't save it.
         content = content.strip()
         if content:
-            # Save it in the database
-            forumdb.AddPost(content)
+            # Save it in the database, in a batch with any other posts
+            # made at the same moment, and wait so the redirected page
+            # shows it.
+            try:
+                forumdb.QueuePost(content).wait()
+            except Exception:
+                resp('500 Internal Server Error',
+                     [('Content-type', 'text/plain')])
+                return [b'Your post could not be saved.']
     # 302 redirect back to the main page
     headers = [('Location', '/'),
                ('Content-type', 'text/plain')]
     resp('302 REDIRECT', headers) 
-    return ['Redirecting']
+    return [b'Redirecting']
 
 ## Dispatch table - maps URL prefixes to request handlers
 DISPATCH = {'': View,
             'post': Post,
+            'search': Search,
+            'stats': Stats,
 	    }
 
 ## Dispatcher forwards requests according to the DISPATCH table.
@@ -97,11 +384,112 @@ def Dispatcher(env, resp):
         status = '404 Not Found'
         headers = [('Content-type', 'text/plain')]
         resp(status, headers)    
-        return ['Not Found: ' + page]
+        return [Encode('Not Found: %s' % page)]
 
 
-# Run this bad server only on localhost!
-httpd = make_server('', 8000, Dispatcher)
-print "Serving HTTP on port 8000..."
-httpd.serve_forever()
+## A server that hands requests to a fixed pool of threads.
+class ThreadPoolWSGIServer(WSGIServer):
+    '''WSGIServer handling requests on a number of worker threads.
+
+    The listening thread only accepts connections, so one slow client
+    holds up a single worker rather than the whole server.
+    '''
 
+    def __init__(self, address, handler, threads):
+        WSGIServer.__init__(self, address, handler)
+        self.threads = threads
+        self.requests = queue.Queue(threads * 4)
+
+    def serve_forever(self, *args, **kwargs):
+        # The threads are started here rather than in __init__, so that a
+        # forked worker process starts its own.
+        for x in range(self.threads):
+            worker = threading.Thread(target=self.Work)
+            worker.daemon = True
+            worker.start()
+        WSGIServer.serve_forever(self, *args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def Work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+## Make a server for the forum app.
+def MakeServer(host, port, threads):
+    '''Returns a WSGI server, threaded when threads is more than 1.'''
+    if threads <= 1:
+        return make_server(host, port, Dispatcher)
+    # Every worker thread may need a database connection at once.
+    forumdb.POOL_MAX_SIZE = max(forumdb.POOL_MAX_SIZE, threads)
+    httpd = ThreadPoolWSGIServer((host, port), WSGIRequestHandler, threads)
+    httpd.set_app(Dispatcher)
+    return httpd
+
+## Run the server in several forked worker processes.
+def ServeForked(httpd, workers):
+    '''Fork workers that all accept connections on httpd's socket.
+
+    The parent waits for the workers, and stops them all when it is
+    interrupted or terminated.
+    '''
+    children = []
+    for x in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            forumdb.AfterFork()
+            httpd.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def Stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, Stop)
+    signal.signal(signal.SIGINT, Stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the DB Forum server.")
+    parser.add_argument('--host', default='',
+                        help="address to listen on, all addresses by default")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="port to listen on")
+    parser.add_argument('--mode', choices=['single', 'threaded', 'prefork'],
+                        default='single',
+                        help="serve one request at a time, on a pool of "
+                             "threads, or in forked worker processes")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="threads for threaded mode, processes for "
+                             "prefork mode")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="threads per process in prefork mode")
+    args = parser.parse_args()
+
+    if args.mode == 'threaded':
+        httpd = MakeServer(args.host, args.port, args.workers)
+    else:
+        httpd = MakeServer(args.host, args.port, args.threads)
+    print("Serving HTTP on port %d (%s, %d workers)..." % (
+        args.port, args.mode, 1 if args.mode == 'single' else args.workers))
+    if args.mode == 'prefork':
+        ServeForked(httpd, args.workers)
+    else:
+        httpd.serve_forever()
+
+# Run this bad server only on localhost!
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
-
 CREATE TABLE posts ( content TEXT,
                      time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                     id SERIAL );
+                     id SERIAL PRIMARY KEY );
+
+-- The forum page lists the newest posts first, a page at a time.  Pages
+-- are found by (time, id), so a page deep in the timeline is an index
+-- range scan rather than an OFFSET over every newer post.
+CREATE INDEX posts_time_id_idx ON posts (time, id);
 
+-- Posts are searched by the words in their content.  The GIN index maps
+-- each word to the posts containing it, so a search only reads the posts
+-- that match.  forumdb.SearchPosts() must use the same expression,
+-- to_tsvector('english', content), for the index to be used.
+CREATE INDEX posts_search_idx ON posts
+    USING GIN (to_tsvector('english', content));
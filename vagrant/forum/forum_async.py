@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#
+# DB Forum - asyncio server with live updates
+#
+# Serves the same DISPATCH routes as forum.py, running the WSGI handlers on
+# a thread pool, and adds /events, a Server-Sent Events stream that sends
+# each new post to every open page as soon as it is posted.  New posts are
+# found with PostgreSQL LISTEN/NOTIFY, so posts made through any server
+# process reach every subscriber.  An idle subscriber is one coroutine and
+# one socket, so one process holds thousands of them.  Needs Python 3.5+,
+# which the VM has as python3.6.
+#
+
+import argparse
+import asyncio
+import io
+import resource
+import sys
+from urllib.parse import unquote
+
+import psycopg2
+
+import forum
+import forumdb
+
+# Path of the Server-Sent Events stream
+EVENTS_PATH = '/events'
+
+# Seconds between comments sent to idle subscribers, so dead connections
+# are noticed and proxies don't time them out.
+KEEPALIVE_SECONDS = 15
+
+# Messages queued for a subscriber before it is dropped as too slow.
+SUBSCRIBER_QUEUE = 64
+
+# Most open files to ask for, for subscribers' sockets.
+MAX_OPEN_FILES = 65536
+
+# Seconds to wait before listening for posts again after losing the
+# database connection, doubling after each failed attempt up to the most.
+RELISTEN_SECONDS = 1
+RELISTEN_MAX_SECONDS = 60
+
+
+## Subscribers to new posts
+class Subscriber(object):
+    '''A client of the events stream and its queue of messages.'''
+
+    __slots__ = ('queue',)
+
+    def __init__(self):
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+
+
+class Broadcaster(object):
+    '''Sends each message to every subscriber.'''
+
+    def __init__(self):
+        self.subscribers = set()
+
+    def Subscribe(self):
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def Unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def Publish(self, message):
+        '''Queue message, encoded once, for every subscriber.'''
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too far behind: drop everything queued and tell the
+                # client's coroutine to hang up.  The browser reconnects.
+                self.Unsubscribe(subscriber)
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+
+BROADCAST = Broadcaster()
+
+
+## Render a post as a Server-Sent Event
+def EventMessage(post):
+    '''Returns the event sent for a post, its HTML as UTF-8.'''
+    data = b''.join(b'data: ' + line + b'\n'
+                    for line in forum.PostHtml(post).splitlines())
+    return b'event: post\n' + data + b'\n'
+
+
+## Follow new posts in the database
+def ListenForPosts(loop, delay=RELISTEN_SECONDS):
+    '''Publish every post added to the database, from any process.
+
+    When the connection is lost, or can't be made, listens again after
+    delay seconds.  Posts made while not listening aren't published, but
+    show up when the page is next loaded.
+    '''
+    def Relisten(error, delay):
+        sys.stderr.write('Not listening for posts, retrying in %d seconds: '
+                         '%s\n' % (delay, str(error).strip()))
+        loop.call_later(delay, ListenForPosts, loop,
+                        min(2 * delay, RELISTEN_MAX_SECONDS))
+
+    try:
+        conn = forumdb.Listen()
+    except psycopg2.OperationalError as e:
+        Relisten(e, delay)
+        return None
+    fd = conn.fileno()
+
+    def OnNotify():
+        try:
+            conn.poll()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            loop.remove_reader(fd)
+            conn.close()
+            Relisten(e, RELISTEN_SECONDS)
+            return
+        ids = []
+        while conn.notifies:
+            ids.append(int(conn.notifies.pop(0).payload))
+        if ids:
+            loop.create_task(Announce(loop, ids))
+
+    loop.add_reader(fd, OnNotify)
+    return conn
+
+
+async def Announce(loop, ids):
+    posts = await loop.run_in_executor(None, forumdb.GetPostsById, ids)
+    for post in posts:
+        BROADCAST.Publish(EventMessage(post))
+
+
+## Request handler for the events stream
+async def Events(writer):
+    '''Events streams each new post to the client until it disconnects.'''
+    writer.write(b'HTTP/1.0 200 OK\r\n'
+                 b'Content-Type: text/event-stream\r\n'
+                 b'Cache-Control: no-cache\r\n'
+                 b'\r\n'
+                 b': connected\n\n')
+    subscriber = BROADCAST.Subscribe()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(),
+                                                 KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                message = b': keepalive\n\n'
+            if message is None:
+                break
+            writer.write(message)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        BROADCAST.Unsubscribe(subscriber)
+
+
+## Run a request through the forum's WSGI app
+def RunWsgi(method, path, query, headers, body, server):
+    '''Call forum.Dispatcher, returning (status, headers, body chunks).
+
+    Runs on the executor's threads, as the handlers block on the database.
+    '''
+    env = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path),
+        'QUERY_STRING': query,
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/1.0',
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for (name, value) in headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            env[key] = value
+    started = []
+
+    def StartResponse(status, response_headers, exc_info=None):
+        started[:] = [status, response_headers]
+
+    result = forum.Dispatcher(env, StartResponse)
+    try:
+        chunks = list(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started[0], started[1], chunks
+
+
+## Handle one HTTP connection
+async def Handle(reader, writer):
+    loop = asyncio.get_event_loop()
+    try:
+        request_line = await reader.readline()
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            return
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        path, _, query = target.partition('?')
+
+        if method == 'GET' and path == EVENTS_PATH:
+            await Events(writer)
+            return
+        length = int(headers.get('content-length') or 0)
+        body = await reader.readexactly(length) if length > 0 else b''
+        server = writer.get_extra_info('sockname')[:2]
+        status, response_headers, chunks = await loop.run_in_executor(
+            None, RunWsgi, method, path, query, headers, body, server)
+        head = ['HTTP/1.0 %s' % status]
+        head.extend('%s: %s' % header for header in response_headers)
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        for chunk in chunks:
+            writer.write(chunk)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the DB Forum on asyncio, with live post updates.")
+    parser.add_argument('--host', default='',
+                        help="address to listen on, all addresses by default")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="port to listen on")
+    args = parser.parse_args()
+
+    # Every subscriber holds a socket open, so allow as many as we may.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = MAX_OPEN_FILES
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(hard, wanted)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        except (ValueError, OSError) as e:
+            sys.stderr.write('Could not raise the open files limit: %s\n'
+                             % e)
+
+    # Pages served from here follow the events stream.
+    forum.TAIL = forum.Encode(forum.LIVE_SCRIPT + forum.HTML_TAIL)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        asyncio.start_server(Handle, args.host or None, args.port,
+                             backlog=1024))
+    ListenForPosts(loop)
+    print("Serving HTTP on port %d with live updates on %s..."
+          % (args.port, EVENTS_PATH))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+
+
+# Run this server only on localhost!
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+#
+# forum_bench.py -- benchmark the forum's request pipeline in-process
+#
+# Fills a scratch database with each number of posts in turn and calls
+# forum.Dispatcher directly, with no sockets, timing where each request's
+# time goes and, under Python 3, how much memory it allocates.  Reports
+# JSON so runs can be compared between versions:
+#
+#   python3 forum_bench.py --posts 100 10000 1000000 --output bench.json
+#
+# The stages timed are, excluding the time spent in the stages they call:
+#   dispatch  Dispatcher and the handler, including the ETag hash
+#   cache     looking up the page cache, and checking the newest post
+#   fetch     forumdb.GetPosts() and forumdb.SearchPosts()
+#   render    formatting the page's HTML
+#   encode    encoding HTML to bytes, once per post as posts are cached
+#
+# The database named by --dsn has its posts deleted, so it must not be
+# the forum's own.
+#
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+from wsgiref import util
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, allocations aren't reported.
+    tracemalloc = None
+
+import forum
+import forumdb
+
+
+# The stages timed, in the order they are reported.
+STAGES = ['dispatch', 'cache', 'fetch', 'render', 'encode']
+
+# Words post contents are made from, so searches have matches.
+WORDS = ['forum', 'post', 'database', 'index', 'query', 'cache', 'server',
+         'thread', 'page', 'search', 'python', 'postgres', 'request', 'html']
+
+
+## Time the stages of requests
+class Profiler(object):
+    '''Times the stages of a request, each excluding the stages it calls.
+
+    While tracemalloc is tracing, also records the peak memory each stage
+    allocated, including the stages it calls.
+    '''
+
+    def __init__(self):
+        self.seconds = dict((stage, 0.0) for stage in STAGES)
+        self.peak = dict((stage, 0) for stage in STAGES)
+        self.stack = []
+
+    def Wrap(self, stage, function):
+        '''Returns function wrapped to be timed as stage.'''
+        def Wrapper(*args, **kwargs):
+            tracing = _TracingPeaks()
+            base = 0
+            if tracing:
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            # The time taken by the stages this one calls, and the highest
+            # memory use seen while they ran.
+            self.stack.append([0.0, base])
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                inner_seconds, highest = self.stack.pop()
+                self.seconds[stage] += elapsed - inner_seconds
+                if tracing:
+                    highest = max(highest, tracemalloc.get_traced_memory()[1])
+                    self.peak[stage] += highest - base
+                    # Measure the rest of the calling stage from here.
+                    tracemalloc.reset_peak()
+                if self.stack:
+                    self.stack[-1][0] += elapsed
+                    self.stack[-1][1] = max(self.stack[-1][1], highest)
+        return Wrapper
+
+
+## Check tracemalloc can measure peaks
+def _TracingPeaks():
+    '''Returns True if tracemalloc is tracing and its peak can be reset.'''
+    return (tracemalloc is not None and tracemalloc.is_tracing() and
+            hasattr(tracemalloc, 'reset_peak'))
+
+
+## Time the forum's stages
+def Instrument(profiler):
+    '''Wrap the forum's stages in profiler.
+
+    Returns:
+      A tuple (app, undo), app the wrapped Dispatcher to call and undo a
+      function that takes the wrapping off again.
+    '''
+    patches = [(forumdb, 'GetPosts', 'fetch'),
+               (forumdb, 'SearchPosts', 'fetch'),
+               (forumdb, 'LatestPost', 'cache'),
+               (forum.PAGES, 'Get', 'cache'),
+               (forum, 'RenderPage', 'render'),
+               (forum, 'RenderSearch', 'render'),
+               (forum, 'Encode', 'encode')]
+    saved = []
+    for (owner, name, stage) in patches:
+        original = getattr(owner, name)
+        saved.append((owner, name, original))
+        setattr(owner, name, profiler.Wrap(stage, original))
+    dispatcher = profiler.Wrap('dispatch', forum.Dispatcher)
+
+    def Undo():
+        for (owner, name, original) in saved:
+            if owner is forum.PAGES:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+    return dispatcher, Undo
+
+
+## Fill the database with posts
+def FillPosts(count, batch_size=5000):
+    '''Add posts to the database until it holds count of them.'''
+    with forumdb._Cursor() as c:
+        c.execute("SELECT count(*) FROM posts;")
+        have = c.fetchone()[0]
+    posts = ('Post %d about %s and %s.' % (n, WORDS[n % len(WORDS)],
+                                           WORDS[n * 7 % len(WORDS)])
+             for n in range(have, count))
+    forumdb.AddPosts(posts, batch_size, notify=False)
+
+
+## Make a request without a server
+def Request(app, path):
+    '''Call the WSGI app for path, returning the status and body.'''
+    target, _, query = path.partition('?')
+    env = {'PATH_INFO': target, 'QUERY_STRING': query}
+    util.setup_testing_defaults(env)
+    status = []
+
+    def StartResponse(s, headers, exc_info=None):
+        status.append(s)
+    body = b''.join(app(env, StartResponse))
+    return status[0], body
+
+
+## Percentile of latencies
+def Percentile(values, percent):
+    '''Returns the nearest rank percentile of a sorted list of values.'''
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+## Benchmark requests for a path
+def Benchmark(path, requests, cached):
+    '''Time requests for path, then measure their allocations.
+
+    Returns:
+      A dict of latency percentiles, the mean time per request of each
+      stage, and with tracemalloc the bytes allocated per request.
+    '''
+    profiler = Profiler()
+    app, undo = Instrument(profiler)
+    try:
+        status, body = Request(app, path)
+        if not status.startswith('200'):
+            raise SystemExit('%s returned %s' % (path, status))
+        profiler.__init__()
+        latencies = []
+        for x in range(requests):
+            if not cached:
+                forum.PAGES.Invalidate()
+            start = time.time()
+            Request(app, path)
+            latencies.append(time.time() - start)
+        stages = dict((stage, 1000 * profiler.seconds[stage] / requests)
+                      for stage in STAGES)
+        allocations = None
+        if tracemalloc is not None:
+            allocations = MeasureAllocations(app, profiler, path, requests,
+                                             cached)
+    finally:
+        undo()
+    latencies.sort()
+    result = {
+        'path': path,
+        'requests': requests,
+        'bytes': len(body),
+        'mean_ms': 1000 * sum(latencies) / requests,
+        'p50_ms': 1000 * Percentile(latencies, 50),
+        'p90_ms': 1000 * Percentile(latencies, 90),
+        'p99_ms': 1000 * Percentile(latencies, 99),
+        'stages_ms': stages,
+    }
+    if allocations is not None:
+        result['allocations'] = allocations
+    return result
+
+
+## Measure the memory requests allocate
+def MeasureAllocations(app, profiler, path, requests, cached):
+    '''Make requests with tracemalloc on, a separate pass as it is slow.
+
+    Returns:
+      A dict of the mean bytes allocated and still held after a request,
+      and the mean peak bytes allocated during each stage, including the
+      stages it calls.  The stages are left out before Python 3.9.
+    '''
+    profiler.__init__()
+    retained = 0
+    tracemalloc.start()
+    try:
+        for x in range(requests):
+            if not cached:
+                forum.PAGES.Invalidate()
+            before = tracemalloc.get_traced_memory()[0]
+            Request(app, path)
+            retained += tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    result = {'retained_bytes': retained // requests}
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return result
+    for stage in STAGES:
+        result[stage + '_peak_bytes'] = profiler.peak[stage] // requests
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the forum's WSGI app in-process.")
+    parser.add_argument('--posts', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000],
+                        help="numbers of posts in the database to test with")
+    parser.add_argument('--path', nargs='+',
+                        default=['/', '/search?q=postgres'],
+                        help="paths to request")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests made to each path")
+    parser.add_argument('--cached', action='store_true',
+                        help="let the page cache answer repeat requests")
+    parser.add_argument('--dsn', default='dbname=forum_bench',
+                        help="scratch database to fill with posts")
+    parser.add_argument('--output', help="file to write the JSON report to")
+    args = parser.parse_args(argv)
+
+    forumdb.DSN = args.dsn
+    with forumdb._Cursor() as c:
+        c.execute("TRUNCATE posts RESTART IDENTITY;")
+    runs = []
+    for count in sorted(args.posts):
+        FillPosts(count)
+        for path in args.path:
+            result = Benchmark(path, args.requests, args.cached)
+            result['posts'] = count
+            runs.append(result)
+            sys.stderr.write('%d posts %s: %.2f ms/request\n'
+                             % (count, path, result['mean_ms']))
+    report = {
+        'python': platform.python_version(),
+        'cached': args.cached,
+        'runs': runs,
+    }
+    out = open(args.output, 'w') if args.output else sys.stdout
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
+    if args.output:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# forum_import.py -- load archived posts into the forum database
+#
+# Reads posts from JSON Lines files, one object with a "content" and an
+# optional "time" per line, or from CSV files with a header row naming
+# "content" and optional "time" columns, and adds them with
+# forumdb.AddPosts() a batch at a time:
+#
+#   python forum_import.py posts.jsonl archive.csv --batch-size 5000
+#
+# Posts without a time are given the time they were imported.
+#
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+
+import forumdb
+
+
+## Read posts from a JSON Lines file
+def ReadJsonLines(f):
+    '''Yields a post dictionary for each non-blank line of a file.'''
+    for line in f:
+        if line.strip():
+            post = json.loads(line)
+            yield {'content': post['content'], 'time': post.get('time')}
+
+
+## Read posts from a CSV file
+def ReadCsv(f):
+    '''Yields a post dictionary for each row of a CSV file.'''
+    for row in csv.DictReader(f):
+        yield {'content': row['content'], 'time': row.get('time') or None}
+
+
+## Open a file of posts
+def OpenPosts(path, format=None):
+    '''Returns an iterator over the posts in a file, '-' for stdin.
+
+    Args:
+      path: the file to read.
+      format: 'jsonl' or 'csv', or None to go by the file's extension.
+    '''
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    if format == 'csv' and sys.version_info[0] < 3:
+        # Python 2's csv module reads bytes.
+        f = sys.stdin if path == '-' else open(path, 'rb')
+        return ReadCsv(f)
+    if path == '-':
+        f = io.open(sys.stdin.fileno(), encoding='utf-8', newline='')
+    else:
+        f = io.open(path, encoding='utf-8', newline='')
+    if format == 'csv':
+        return ReadCsv(f)
+    return ReadJsonLines(f)
+
+
+## Add posts to the database, a batch at a time
+def ImportPosts(posts, batch_size, progress_every=100000):
+    '''Add posts to the database, reporting progress on stderr.
+
+    Returns:
+      A tuple (posts added, seconds taken).
+    '''
+    start = time.time()
+    added = 0
+    posts = iter(posts)
+    while True:
+        chunk = list(itertools.islice(posts, progress_every))
+        if not chunk:
+            break
+        added += forumdb.AddPosts(chunk, batch_size, notify=False)
+        elapsed = time.time() - start
+        sys.stderr.write('%d posts, %.0f posts/s\n'
+                         % (added, added / elapsed if elapsed else 0.0))
+    return added, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import posts from JSON Lines or CSV files.")
+    parser.add_argument('files', nargs='+',
+                        help="files to import, '-' for stdin")
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help="file format, by default from the extension")
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help="posts inserted and committed together")
+    args = parser.parse_args()
+
+    posts = itertools.chain.from_iterable(
+        OpenPosts(path, args.format) for path in args.files)
+    added, seconds = ImportPosts(posts, args.batch_size)
+    print(json.dumps({'posts': added, 'seconds': round(seconds, 3),
+                      'posts_per_second': round(added / seconds, 1)
+                      if seconds else 0.0}))
+
+
+if __name__ == '__main__':
+    main()
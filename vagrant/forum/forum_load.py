@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# forum_load.py -- load test the forum server in each serving mode
+#
+# Starts forum.py with each mode and worker count in turn, has a number of
+# client threads fetch the front page as fast as they can, and reports the
+# requests per second and latency of each run as JSON:
+#
+#   python forum_load.py --mode threaded prefork --workers 1 2 4 8
+#
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib2
+
+
+## Percentile of latencies
+def Percentile(values, percent):
+    '''Returns the nearest rank percentile of a sorted list of values.'''
+    rank = int(-(-percent * len(values) // 100))
+    return values[max(rank, 1) - 1]
+
+
+## Wait for a server to start
+def WaitForServer(url, timeout=10.0):
+    '''Wait until the server at url answers, or raise after timeout.'''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib2.urlopen(url).read()
+            return
+        except Exception:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+## Make requests from many client threads
+def Load(url, clients, seconds, uncached=False):
+    '''Fetch url from client threads for a number of seconds.
+
+    With uncached, each request adds a different query parameter to url, so
+    the page cache can't answer it.
+
+    Returns:
+      A dict of the requests made, errors, requests per second and latency
+      percentiles.
+    '''
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+    counter = itertools.count()
+
+    def Client():
+        mine = []
+        failed = 0
+        while time.time() < deadline:
+            target = url
+            if uncached:
+                target += ('&' if '?' in url else '?') + 'n=%d' % next(counter)
+            start = time.time()
+            try:
+                urllib2.urlopen(target).read()
+                mine.append(time.time() - start)
+            except Exception:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=Client) for x in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_s': len(latencies) / elapsed,
+    }
+    if latencies:
+        result.update({
+            'p50_ms': 1000 * Percentile(latencies, 50),
+            'p90_ms': 1000 * Percentile(latencies, 90),
+            'p99_ms': 1000 * Percentile(latencies, 99),
+        })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test forum.py in each serving mode.")
+    parser.add_argument('--mode', nargs='+', default=['threaded', 'prefork'],
+                        choices=['single', 'threaded', 'prefork'],
+                        help="serving modes to test")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="worker counts to test in each mode")
+    parser.add_argument('--clients', type=int, default=16,
+                        help="client threads making requests")
+    parser.add_argument('--seconds', type=float, default=10.0,
+                        help="length of each run")
+    parser.add_argument('--port', type=int, default=8001,
+                        help="port to run the server on")
+    parser.add_argument('--path', default='/',
+                        help="path to request")
+    parser.add_argument('--uncached', action='store_true',
+                        help="vary the query string to miss the page cache")
+    args = parser.parse_args(argv)
+
+    forum = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'forum.py')
+    url = 'http://localhost:%d%s' % (args.port, args.path)
+    runs = []
+    with open(os.devnull, 'w') as devnull:
+        for mode in args.mode:
+            for workers in ([1] if mode == 'single' else args.workers):
+                server = subprocess.Popen(
+                    [sys.executable, forum, '--mode', mode,
+                     '--workers', str(workers), '--port', str(args.port)],
+                    stdout=devnull, stderr=devnull)
+                try:
+                    WaitForServer(url)
+                    result = Load(url, args.clients, args.seconds,
+                                  args.uncached)
+                finally:
+                    server.terminate()
+                    server.wait()
+                result.update({'mode': mode, 'workers': workers})
+                runs.append(result)
+                sys.stderr.write('%(mode)s x %(workers)d: '
+                                 '%(requests_per_s).1f requests/s\n' % result)
+    json.dump({'clients': args.clients, 'seconds': args.seconds,
+               'uncached': args.uncached, 'runs': runs}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
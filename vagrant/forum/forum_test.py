@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#
+# Test cases for forum.py's request handlers.  PostgreSQL isn't used:
+# posts are captured where forumdb would write them, and read from an
+# SQLite table standing in for the posts table.
+
+from __future__ import print_function
+
+import contextlib
+import datetime
+import io
+import re
+import sqlite3
+from wsgiref import util
+try:
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import unquote
+
+import forum
+import forumdb
+
+
+## Call a handler with a form submission
+def Submit(handler, body):
+    '''Returns the status the handler responds with to a POST of body.'''
+    env = {'REQUEST_METHOD': 'POST',
+           'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+           'CONTENT_LENGTH': str(len(body)),
+           'wsgi.input': io.BytesIO(body)}
+    util.setup_testing_defaults(env)
+    status = []
+
+    def StartResponse(s, headers, exc_info=None):
+        status.append(s)
+    b''.join(handler(env, StartResponse))
+    return status[0]
+
+
+## Capture the posts a handler queues
+def CapturePosts(error=None):
+    '''Replace forumdb.QueuePost, returning the list posts are added to.
+
+    Each post is written at once, or fails with error if it is given.
+    '''
+    posted = []
+
+    def QueuePost(content):
+        posted.append(content)
+        pending = forumdb.PendingPost()
+        pending._Done(error)
+        return pending
+    forumdb.QueuePost = QueuePost
+    return posted
+
+## Times are stored as text that sorts in time order.
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+## A cursor on the SQLite posts table
+class FakeCursor(object):
+    '''Runs forumdb's queries, with psycopg2's %s parameters, on SQLite.
+
+    The first column of every row read is a post's time.
+    '''
+
+    def __init__(self, db):
+        self.cursor = db.cursor()
+
+    def execute(self, sql, params=()):
+        params = tuple(p.strftime(TIME_FORMAT)
+                       if isinstance(p, datetime.datetime) else p
+                       for p in params)
+        self.cursor.execute(sql.replace('%s', '?'), params)
+
+    def fetchall(self):
+        return [self._Row(row) for row in self.cursor.fetchall()]
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return row and self._Row(row)
+
+    def _Row(self, row):
+        return ((datetime.datetime.strptime(row[0], TIME_FORMAT),) +
+                tuple(row[1:]))
+
+## Read posts from SQLite
+def UseDatabase(times):
+    '''Read posts from a new SQLite database instead of PostgreSQL.
+
+    The database holds a post made at each of times, numbered from 1.
+
+    Returns:
+      The SQLite connection.
+    '''
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE posts (content TEXT, time TEXT, "
+               "id INTEGER PRIMARY KEY);")
+    for t in times:
+        AddRow(db, t)
+
+    @contextlib.contextmanager
+    def Cursor():
+        yield FakeCursor(db)
+    forumdb._Cursor = Cursor
+    # Nothing cached from another test's posts may be shown.
+    forum._fragments.clear()
+    forum.PAGES.Invalidate()
+    return db
+
+## Add a post to the SQLite posts table
+def AddRow(db, time):
+    '''Add a post made at time, returning its content.'''
+    n = db.execute("SELECT count(*) FROM posts;").fetchone()[0] + 1
+    content = 'Post %02d' % n
+    db.execute("INSERT INTO posts (content, time, id) VALUES (?, ?, ?);",
+               (content, time.strftime(TIME_FORMAT), n))
+    return content
+
+## Times of posts a minute apart
+def Minutes(count):
+    start = datetime.datetime(2016, 1, 1, 12, 0, 0)
+    return [start + datetime.timedelta(minutes=n) for n in range(count)]
+
+## Times of posts with four made at the same moment
+def TiedTimes():
+    '''Returns the times of 12 posts, of which posts 6 to 9 share a time.
+
+    With pages of 5 posts the tied posts span the first two pages.
+    '''
+    times = Minutes(12)
+    return times[:5] + [times[5]] * 4 + times[9:]
+
+## Read every page of posts
+def WalkPages(limit):
+    '''Follow the older cursors from the newest page to the oldest.
+
+    Returns:
+      A list of (post ids, older cursor, newer cursor) for each page.
+    '''
+    pages = []
+    older = None
+    while True:
+        posts, older, newer = forumdb.GetPosts(before=older, limit=limit)
+        pages.append(([p.id for p in posts], older, newer))
+        if older is None:
+            return pages
+
+## Request a page
+def Fetch(path, headers=None):
+    '''Returns (status, headers, body) of a GET of path from the forum.'''
+    target, _, query = path.partition('?')
+    env = {'PATH_INFO': target, 'QUERY_STRING': query}
+    util.setup_testing_defaults(env)
+    env.update(headers or {})
+    started = []
+
+    def StartResponse(status, headers, exc_info=None):
+        started[:] = [status, dict(headers)]
+    body = b''.join(forum.Dispatcher(env, StartResponse))
+    return started[0], started[1], body
+
+
+def TestPost():
+    posted = CapturePosts()
+    status = Submit(forum.Post, b'content=++Hello%2C+world%21++')
+    if not status.startswith('302'):
+        raise ValueError("Post() should redirect, not return %s." % status)
+    if posted != [u'Hello, world!']:
+        raise ValueError("Post() saved %r, not the stripped post." % posted)
+    print("1. A post is saved, stripped of whitespace.")
+
+
+def TestPostBlank():
+    posted = CapturePosts()
+    Submit(forum.Post, b'content=+%0D%0A+')
+    if posted:
+        raise ValueError("Post() saved a post of only whitespace.")
+    print("2. A post of only whitespace isn't saved.")
+
+
+def TestPostNonAscii():
+    posted = CapturePosts()
+    Submit(forum.Post, b'content=caf%C3%A9+%E2%98%95')
+    if posted != [u'caf\xe9 \u2615']:
+        raise ValueError("Post() saved %r, not u'caf\\xe9 \\u2615'." % posted)
+    print("3. A post of non-ASCII text is saved as the text posted.")
+
+
+def TestPostFails():
+    CapturePosts(error=RuntimeError("database is down"))
+    status = Submit(forum.Post, b'content=Hello')
+    if not status.startswith('500'):
+        raise ValueError("Post() should fail with 500 when the post can't "
+                         "be saved, not return %s." % status)
+    print("4. A post that can't be saved gets a 500 error.")
+
+
+def TestETag():
+    UseDatabase(Minutes(3))
+    status, headers, body = Fetch('/')
+    etag = headers.get('ETag')
+    if not status.startswith('200') or not etag:
+        raise ValueError("A page should be sent with an ETag.")
+    status, headers, cached = Fetch('/', {'HTTP_IF_NONE_MATCH': etag})
+    if not status.startswith('304') or cached:
+        raise ValueError("A client with the page's ETag should get an empty "
+                         "304, not %s." % status)
+    status, headers, other = Fetch('/', {'HTTP_IF_NONE_MATCH': '"old"'})
+    if not status.startswith('200') or other != body:
+        raise ValueError("A client with another ETag should get the page.")
+    if headers.get('ETag') != etag:
+        raise ValueError("An unchanged page should keep its ETag.")
+    print("5. A client that has the page gets 304 Not Modified.")
+
+
+def TestInvalidate():
+    db = UseDatabase(Minutes(3))
+    check_seconds = forum.PAGES.check_seconds
+    forum.PAGES.check_seconds = 3600
+    try:
+        Fetch('/')
+        content = AddRow(db, Minutes(4)[-1])
+        if Fetch('/')[2].find(content.encode('ascii')) >= 0:
+            raise ValueError("A cached page should be sent from the cache.")
+        # As forumdb.AddPost() does, after adding the post.
+        for hook in forumdb.ADD_POST_HOOKS:
+            hook(content)
+        if Fetch('/')[2].find(content.encode('ascii')) < 0:
+            raise ValueError("Adding a post should drop the cached pages.")
+        # A post added by another process is noticed by checking the
+        # newest post.
+        forum.PAGES.check_seconds = 0
+        content = AddRow(db, Minutes(5)[-1])
+        if Fetch('/')[2].find(content.encode('ascii')) < 0:
+            raise ValueError("A new post in the database should drop the "
+                             "cached pages.")
+    finally:
+        forum.PAGES.check_seconds = check_seconds
+    print("6. Cached pages are dropped when a post is added.")
+
+
+def TestPutGeneration():
+    UseDatabase(Minutes(3))
+    cache = forum.PageCache()
+    page, generation = cache.Get('key')
+    cache.Invalidate()
+    cache.Put('key', 'stale page', generation)
+    if cache.Get('key')[0] is not None:
+        raise ValueError("A page rendered before the cache was dropped "
+                         "shouldn't be stored.")
+    page, generation = cache.Get('key')
+    cache.Put('key', 'page', generation)
+    if cache.Get('key')[0] != 'page':
+        raise ValueError("A page should be stored in the cache.")
+    print("7. A page rendered from posts since changed isn't cached.")
+
+
+def TestPageCursors():
+    UseDatabase(Minutes(12))
+    pages = WalkPages(5)
+    ids = [i for (page, older, newer) in pages for i in page]
+    if ids != list(range(12, 0, -1)):
+        raise ValueError("Following the older cursors should show every "
+                         "post once, newest first, not %r." % ids)
+    if pages[0][2] is not None:
+        raise ValueError("The newest page shouldn't have a newer cursor.")
+    # Back from the oldest page, the newer cursors give the same pages.
+    newer = pages[-1][2]
+    for (page, older, newer_cursor) in reversed(pages[:-1]):
+        posts, older, newer = forumdb.GetPosts(after=newer, limit=5)
+        if [p.id for p in posts] != page:
+            raise ValueError("A newer cursor should give the page before, "
+                             "%r, not %r." % (page, [p.id for p in posts]))
+    if newer is not None:
+        raise ValueError("Back at the newest page, there should be no "
+                         "newer cursor.")
+    print("8. Page cursors lead to older pages and back again.")
+
+
+def TestPageCursorTies():
+    UseDatabase(TiedTimes())
+    pages = WalkPages(5)
+    ids = [i for (page, older, newer) in pages for i in page]
+    if ids != list(range(12, 0, -1)):
+        raise ValueError("Posts made at the same time should be ordered by "
+                         "id, each shown once, not %r." % ids)
+    posts, older, newer = forumdb.GetPosts(after=pages[1][2], limit=5)
+    if [p.id for p in posts] != pages[0][0]:
+        raise ValueError("A newer cursor inside a tie should give the page "
+                         "before.")
+    print("9. Posts made at the same time are paged in id order.")
+
+
+def TestBadCursor():
+    UseDatabase(Minutes(12))
+    for cursor in ['nonsense', '2016_x', '20160101120000000000']:
+        try:
+            forumdb.GetPosts(before=cursor)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("GetPosts() should reject cursor %r." % cursor)
+    first = Fetch('/')[2]
+    for query in ['before=nonsense', 'after=2016_x']:
+        status, headers, body = Fetch('/?' + query)
+        if not status.startswith('200') or body != first:
+            raise ValueError("A page with a bad cursor, ?%s, should show "
+                             "the newest posts." % query)
+    print("10. A bad page cursor shows the newest posts.")
+
+
+def TestNavLinks():
+    UseDatabase(Minutes(12))
+    page_size = forum.PAGE_SIZE
+    forum.PAGE_SIZE = 5
+    try:
+        first = Fetch('/')[2].decode('utf-8')
+        older = re.search(r'href="/\?before=([^"]+)"', first)
+        if not older or 'Newer posts' in first:
+            raise ValueError("The newest page should link to older posts "
+                             "only.")
+        second = Fetch('/?before=' + unquote(older.group(1)))[2]
+        second = second.decode('utf-8')
+        if 'Post 07' not in second or 'Post 08' in second:
+            raise ValueError("The older posts link should show posts 7 to 3.")
+        newer = re.search(r'href="/\?after=([^"]+)"', second)
+        if not newer:
+            raise ValueError("An older page should link to newer posts.")
+        back = Fetch('/?after=' + unquote(newer.group(1)))[2]
+        if back.decode('utf-8') != first:
+            raise ValueError("The newer posts link should lead back to the "
+                             "newest page.")
+    finally:
+        forum.PAGE_SIZE = page_size
+    print("11. The older and newer links page through the posts.")
+
+
+if __name__ == '__main__':
+    TestPost()
+    TestPostBlank()
+    TestPostNonAscii()
+    TestPostFails()
+    TestETag()
+    TestInvalidate()
+    TestPutGeneration()
+    TestPageCursors()
+    TestPageCursorTies()
+    TestBadCursor()
+    TestNavLinks()
+    print("Success!  All tests pass!")
@@ -2,23 +2,283 @@
 # Database access functions for the web forum.
 # 
 
+import contextlib
+import datetime
+import itertools
+import sys
+import threading
 import time
+import traceback
+try:
+    import Queue as queue
+except ImportError:
+    # Python 3, for forum_async.py.
+    import queue
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+
+## Database connection settings
+DSN = "dbname=forum"
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+
+## Channel a notification is sent on, with the post id, for each new post.
+NOTIFY_CHANNEL = 'forum_posts'
+
+## Functions called with the content of each post added by AddPost().
+ADD_POST_HOOKS = []
+
+## Posts queued by QueuePost() are written in batches of up to BATCH_SIZE,
+## waiting at most BATCH_SECONDS for a batch to fill.
+BATCH_SIZE = 100
+BATCH_SECONDS = 0.02
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+## Pools inherited by a forked worker, kept so they are never closed.
+_inherited_pools = []
+_writer = None
+_writer_lock = threading.Lock()
+
+## A post read from the database.
+class Post(object):
+    '''A post, as returned by the functions that read posts.
+
+    Attributes:
+      time: the datetime the post was made.
+      id: the post's id, which never changes.
+      content: the text of the post, as stored.
+    '''
+
+    __slots__ = ('time', 'id', 'content')
+
+    def __init__(self, time, id, content):
+        self.time = time
+        self.id = id
+        self.content = content
+
+    def __repr__(self):
+        return '<Post %d at %s>' % (self.id, self.time)
+
+## Get the connection pool, creating it on first use.
+def _GetPool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN_SIZE, POOL_MAX_SIZE, DSN)
+            # The pool raises an error rather than wait when every
+            # connection is in use, so threads wait for a slot first.
+            _pool_slots = threading.Semaphore(POOL_MAX_SIZE)
+        return _pool, _pool_slots
+
+## Forget the connection pool in a newly forked worker process.
+def AfterFork():
+    '''Drop a connection pool inherited from the parent process.
+
+    The inherited connections share their sockets with the parent, so the
+    worker opens its own.  The old pool is kept referenced for the life of
+    the worker: were it garbage collected, closing its connections would
+    end the parent's database sessions too.
+    '''
+    global _pool, _pool_slots, _writer
+    with _pool_lock:
+        if _pool is not None:
+            _inherited_pools.append(_pool)
+        _pool = None
+        _pool_slots = None
+    # The writer thread wasn't forked either, and posts queued in the
+    # parent are the parent's to write.
+    with _writer_lock:
+        _writer = None
 
 ## Database connection
-DB = []
+@contextlib.contextmanager
+def _Cursor():
+    '''Context manager giving a cursor on a pooled connection.
+
+    The transaction is committed when the block exits normally and rolled
+    back if it raises.  A connection that has been broken is closed instead
+    of being put back in the pool.
+    '''
+    pool, slots = _GetPool()
+    with slots:
+        conn = pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as c:
+                    yield c
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
 
 ## Get posts from database.
 def GetAllPosts():
     '''Get all the posts from the database, sorted with the newest first.
 
     Returns:
-      A list of dictionaries, where each dictionary has a 'content' key
-      pointing to the post content, and 'time' key pointing to the time
-      it was posted.
+      A list of Post objects.
+    '''
+    with _Cursor() as c:
+        c.execute("SELECT time, id, content FROM posts ORDER BY time DESC;")
+        rows = c.fetchall()
+    return [Post(*row) for row in rows]
+
+## Get a page of posts from database.
+def GetPosts(before=None, after=None, limit=20):
+    '''Get a page of posts, sorted with the newest first.
+
+    Pages are found with the (time, id) index from a cursor, so every page
+    costs the same however many posts come before it.
+
+    Args:
+      before: a cursor from an earlier call; only posts older than it are
+        returned.
+      after: a cursor from an earlier call; only posts newer than it are
+        returned, the page closest to it.
+      limit: the most posts to return.
+
+    Returns:
+      A tuple (posts, older, newer).  posts is a list of Post objects,
+      older is the cursor of the page of older
+      posts and newer the cursor of the page of newer posts, or None when
+      there are no such posts.
+    '''
+    with _Cursor() as c:
+        if after is not None:
+            c.execute("""SELECT time, id, content FROM posts
+                         WHERE (time, id) > (%s, %s)
+                         ORDER BY time, id LIMIT %s;""",
+                      _ParseCursor(after) + (limit + 1,))
+            rows = c.fetchall()
+            more_newer = len(rows) > limit
+            rows = rows[:limit]
+            rows.reverse()
+            more_older = True
+        else:
+            if before is None:
+                c.execute("""SELECT time, id, content FROM posts
+                             ORDER BY time DESC, id DESC LIMIT %s;""",
+                          (limit + 1,))
+            else:
+                c.execute("""SELECT time, id, content FROM posts
+                             WHERE (time, id) < (%s, %s)
+                             ORDER BY time DESC, id DESC LIMIT %s;""",
+                          _ParseCursor(before) + (limit + 1,))
+            rows = c.fetchall()
+            more_older = len(rows) > limit
+            rows = rows[:limit]
+            more_newer = before is not None
+    posts = [Post(*row) for row in rows]
+    older = newer = None
+    if rows and more_older:
+        older = _MakeCursor(rows[-1])
+    if rows and more_newer:
+        newer = _MakeCursor(rows[0])
+    return posts, older, newer
+
+## Get posts by id.
+def GetPostsById(ids):
+    '''Get the posts with the given ids, oldest first.
+
+    Returns:
+      A list of Post objects.
+    '''
+    with _Cursor() as c:
+        c.execute("""SELECT time, id, content FROM posts WHERE id = ANY(%s)
+                     ORDER BY time, id;""", (list(ids),))
+        rows = c.fetchall()
+    return [Post(*row) for row in rows]
+
+## Open a connection that is notified of new posts.
+def Listen():
+    '''Returns a new connection listening on NOTIFY_CHANNEL.
+
+    The connection is not from the pool and is in autocommit mode.  Call
+    its poll() method when its socket is readable, then read the ids of the
+    new posts from the payloads of its notifies list.
+    '''
+    conn = psycopg2.connect(DSN)
+    conn.autocommit = True
+    with conn.cursor() as c:
+        c.execute("LISTEN %s;" % NOTIFY_CHANNEL)
+    return conn
+
+## Search the posts.
+def SearchPosts(query, limit=20, after=None):
+    '''Get the posts matching a search, best matches first.
+
+    Posts are found with the full-text index on their content, so only the
+    matching posts are read and ranked, however many posts there are.
+
+    Args:
+      query: the words to search for; a post must contain all of them.
+      limit: the most posts to return.
+      after: a cursor from an earlier call; only the posts ranked after it
+        are returned.
+
+    Returns:
+      A tuple (posts, more).  posts is a list of Post objects, more
+      is the cursor of the next page of results, or None when there are
+      no more.
     '''
-    posts = [{'content': str(row[1]), 'time': str(row[0])} for row in DB]
-    posts.sort(key=lambda row: row['time'], reverse=True)
-    return posts
+    sql = """SELECT time, id, content, rank FROM (
+                 SELECT time, id, content,
+                        ts_rank(to_tsvector('english', content), query)::float8
+                            AS rank
+                 FROM posts, plainto_tsquery('english', %s) query
+                 WHERE to_tsvector('english', content) @@ query) matches
+             {where}
+             ORDER BY rank DESC, id DESC LIMIT %s;"""
+    with _Cursor() as c:
+        if after is None:
+            c.execute(sql.format(where=''), (query, limit + 1))
+        else:
+            c.execute(sql.format(where='WHERE (rank, id) < (%s, %s)'),
+                      (query,) + _ParseSearchCursor(after) + (limit + 1,))
+        rows = c.fetchall()
+    more = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        more = '%r_%d' % (rows[-1][3], rows[-1][1])
+    posts = [Post(*row[:3]) for row in rows]
+    return posts, more
+
+## Get the cursor of the newest post.
+def LatestPost():
+    '''Returns the cursor of the newest post, or None if there are none.
+
+    The cursor changes whenever a post is added, so it tells whether
+    anything rendered from the posts is out of date.
+    '''
+    with _Cursor() as c:
+        c.execute("""SELECT time, id FROM posts
+                     ORDER BY time DESC, id DESC LIMIT 1;""")
+        row = c.fetchone()
+    return row and _MakeCursor(row)
+
+## Page cursors are the (time, id) of a post, as text.
+def _MakeCursor(row):
+    return '%s_%d' % (row[0].strftime('%Y%m%d%H%M%S%f'), row[1])
+
+def _ParseCursor(cursor):
+    '''Returns the (time, id) in a cursor, or raises ValueError.'''
+    try:
+        t, id = cursor.split('_')
+        return datetime.datetime.strptime(t, '%Y%m%d%H%M%S%f'), int(id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Bad page cursor %r.' % (cursor,))
+
+## Search cursors are the (rank, id) of a result, as text.
+def _ParseSearchCursor(cursor):
+    '''Returns the (rank, id) in a search cursor, or raises ValueError.'''
+    try:
+        rank, id = cursor.split('_')
+        return float(rank), int(id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Bad search cursor %r.' % (cursor,))
 
 ## Add a post to the database.
 def AddPost(content):
@@ -27,5 +287,149 @@ def AddPost(content):
     Args:
       content: The text content of the new post.
     '''
-    t = time.strftime('%c', time.localtime())
-    DB.append((t, content))
+    with _Cursor() as c:
+        c.execute("INSERT INTO posts (content) VALUES (%s) RETURNING id;",
+                  (content,))
+        # Delivered to listeners when the transaction commits.
+        c.execute("SELECT pg_notify(%s, %s);",
+                  (NOTIFY_CHANNEL, str(c.fetchone()[0])))
+    for hook in ADD_POST_HOOKS:
+        hook(content)
+
+## Add many posts to the database.
+def AddPosts(posts, batch_size=1000, notify=True):
+    '''Add posts to the database, batch_size posts per INSERT.
+
+    Each batch is one multi-row INSERT committed on its own, so a large
+    import costs one statement and one commit per batch rather than per
+    post.  If a batch fails, the batches before it stay committed.
+
+    Args:
+      posts: an iterable of post contents, or of dictionaries with the
+        'content' and 'time' of a post.
+      batch_size: the most posts inserted by one statement.
+      notify: send the ids of the posts on NOTIFY_CHANNEL.  An archive
+        import turns this off, so live pages aren't sent every old post.
+
+    Returns:
+      The number of posts added.
+    '''
+    sql = "INSERT INTO posts (content, time) VALUES %s RETURNING id;"
+    if notify:
+        sql = ("WITH added AS (INSERT INTO posts (content, time) VALUES %s "
+               "RETURNING id) SELECT pg_notify('" + NOTIFY_CHANNEL + "', "
+               "id::text) FROM added;")
+    rows = (_PostRow(post) for post in posts)
+    added = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        with _Cursor() as c:
+            psycopg2.extras.execute_values(
+                c, sql, batch,
+                template="(%s, COALESCE(%s, CURRENT_TIMESTAMP))",
+                page_size=len(batch))
+        for hook in ADD_POST_HOOKS:
+            for row in batch:
+                hook(row[0])
+        added += len(batch)
+    return added
+
+def _PostRow(post):
+    '''Returns the (content, time) to insert for a post given to AddPosts().'''
+    if isinstance(post, dict):
+        return (post['content'], post.get('time'))
+    return (post, None)
+
+## A post waiting to be written by the background thread.
+class PendingPost(object):
+    '''Returned by QueuePost(), to wait for the post to be written.
+
+    Attributes:
+      error: the exception that stopped the post's batch being written, or
+        None.
+    '''
+
+    __slots__ = ('_written', 'error')
+
+    def __init__(self):
+        self._written = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        '''Block until the post's batch has been written.
+
+        Returns:
+          True once the batch is written, False if timeout seconds pass
+          first.
+
+        Raises:
+          The exception AddPosts() raised, if the batch failed.
+        '''
+        if not self._written.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def _Done(self, error=None):
+        self.error = error
+        self._written.set()
+
+## Add a post to the database in the next batch.
+def QueuePost(content):
+    '''Queue a post to be added by a background thread.
+
+    Posts queued within BATCH_SECONDS of each other are added together by
+    AddPosts(), so a burst of posts costs a few commits instead of one
+    each.
+
+    Args:
+      content: The text content of the new post.
+
+    Returns:
+      A PendingPost whose wait() returns once the post's batch has been
+      written, or raises the error if it failed.  A batch that fails is
+      also reported on stderr, and is not retried.
+    '''
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = queue.Queue()
+            thread = threading.Thread(target=_WritePosts, args=(_writer,))
+            thread.daemon = True
+            thread.start()
+        pending = PendingPost()
+        _writer.put((content, pending))
+    return pending
+
+## Wait for queued posts to be written.
+def Flush():
+    '''Block until every post queued by QueuePost() has been written.'''
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.join()
+
+def _WritePosts(posts):
+    '''Write the posts from a QueuePost() queue, a batch at a time.'''
+    while True:
+        batch = [posts.get()]
+        deadline = time.time() + BATCH_SECONDS
+        while len(batch) < BATCH_SIZE:
+            wait = deadline - time.time()
+            try:
+                batch.append(posts.get(wait > 0, max(wait, 0)))
+            except queue.Empty:
+                break
+        error = None
+        try:
+            AddPosts([content for (content, pending) in batch], BATCH_SIZE)
+        except Exception as e:
+            sys.stderr.write('Failed to add %d posts:\n' % len(batch))
+            traceback.print_exc()
+            error = e
+        for (content, pending) in batch:
+            pending._Done(error)
+            posts.task_done()
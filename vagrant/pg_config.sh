@@ -3,6 +3,15 @@ apt-get -qqy install postgresql python-psycopg2
 apt-get -qqy install python-flask python-sqlalchemy
 apt-get -qqy install python-pip
 pip install bleach
+pip install "psycopg2-binary>=2.8"
+# asyncpg and the asyncio servers need Python 3.5 or later, and trusty's
+# python3 is 3.4, so build Python 3.6 alongside it, run as python3.6.
+apt-get -qqy install build-essential libssl-dev zlib1g-dev libffi-dev
+wget https://www.python.org/ftp/python/3.6.15/Python-3.6.15.tgz
+tar xzf Python-3.6.15.tgz
+(cd Python-3.6.15 && ./configure && make && make altinstall)
+python3.6 -m pip install asyncpg "psycopg2-binary>=2.8"
+pip install numpy
 pip install oauth2client
 pip install requests
 pip install httplib2
@@ -14,6 +23,8 @@ su postgres -c 'createuser -dRS vagrant'
 su vagrant -c 'createdb'
 su vagrant -c 'createdb forum'
 su vagrant -c 'psql forum -f /vagrant/forum/forum.sql'
+su vagrant -c 'createdb forum_bench'
+su vagrant -c 'psql forum_bench -f /vagrant/forum/forum.sql'
 
 vagrantTip="[35m[1mThe shared directory is located at /vagrant\nTo access your shared files: cd /vagrant(B[m"
 echo -e $vagrantTip > /etc/motd
@@ -0,0 +1,277 @@
+-- Migrate a tournament database created from the original tournament.sql,
+-- before tournaments, the standings table and the match_results table.
+-- Run it once against the database with:
+--   psql tournament -f migrate_baseline.sql
+-- Everything runs in one transaction.  If the matches table holds a rematch
+-- or a second bye, the match_results primary key rejects it and nothing
+-- changes.  A database created from the current tournament.sql needs no
+-- migration.
+
+
+BEGIN;
+
+
+-- Drop the original views, which are recreated on match_results below.
+DROP VIEW possible_pairings;
+DROP VIEW standings;
+DROP VIEW player_byes;
+DROP VIEW player_opponent_wins;
+DROP VIEW player_opponents;
+DROP VIEW player_matches;
+DROP VIEW player_draws;
+DROP VIEW player_wins;
+
+
+-- Create tournaments table.
+-- The existing players and matches all belong to the default tournament.
+CREATE TABLE tournaments (
+	id serial PRIMARY KEY,
+	name text
+);
+INSERT INTO tournaments (name) VALUES ('Tournament');
+
+
+-- Give every player a tournament.
+ALTER TABLE players ADD COLUMN tournament_id integer REFERENCES tournaments (id);
+UPDATE players SET tournament_id = (SELECT min(id) FROM tournaments);
+ALTER TABLE players ALTER COLUMN tournament_id SET NOT NULL;
+CREATE INDEX players_tournament_idx ON players (tournament_id);
+
+
+-- Give every player the default rating.
+-- rating seeds the player within their score group when pairing, and is
+-- updated by ratings.py as each round is closed.
+ALTER TABLE players ADD COLUMN rating double precision NOT NULL DEFAULT 1500;
+
+
+-- Give every match an id for its match_results rows to refer to, and a
+-- tournament.
+ALTER TABLE matches DROP CONSTRAINT matches_pkey;
+ALTER TABLE matches ADD COLUMN id serial PRIMARY KEY;
+ALTER TABLE matches ADD UNIQUE (player1, player2);
+ALTER TABLE matches ADD COLUMN tournament_id integer REFERENCES tournaments (id);
+UPDATE matches SET tournament_id = (SELECT min(id) FROM tournaments);
+ALTER TABLE matches ALTER COLUMN tournament_id SET NOT NULL;
+CREATE INDEX matches_tournament_idx ON matches (tournament_id);
+
+
+-- Create match results table.
+-- Holds one row per player per match, written with the matches row, so a
+-- player's matches and opponents are found with an index scan on player_id
+-- rather than by joining matches on player1 OR player2.
+-- A bye is recorded as a single row with opponent_id = player_id.
+-- The primary key also stops two players being paired, or a player being
+-- given a bye, twice.
+CREATE TABLE match_results (
+	player_id integer NOT NULL REFERENCES players (id),
+	opponent_id integer NOT NULL REFERENCES players (id),
+	match_id integer NOT NULL REFERENCES matches (id),
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	win integer NOT NULL,
+	draw integer NOT NULL,
+	bye integer NOT NULL,
+	PRIMARY KEY (player_id, opponent_id)
+);
+CREATE INDEX match_results_tournament_idx ON match_results (tournament_id);
+CREATE INDEX match_results_match_idx ON match_results (match_id);
+
+
+-- Copy the existing matches into match_results.
+INSERT INTO match_results
+	(player_id, opponent_id, match_id, tournament_id, win, draw, bye)
+	SELECT player1, player2, id, tournament_id,
+	CASE WHEN winner = player1 THEN 1 ELSE 0 END,
+	CASE WHEN winner IS NULL THEN 1 ELSE 0 END,
+	CASE WHEN player1 = player2 THEN 1 ELSE 0 END
+	FROM matches
+	UNION ALL
+	SELECT player2, player1, id, tournament_id,
+	CASE WHEN winner = player2 THEN 1 ELSE 0 END,
+	CASE WHEN winner IS NULL THEN 1 ELSE 0 END,
+	0
+	FROM matches WHERE player1 != player2;
+
+
+-- Create player win count view.
+CREATE VIEW player_wins AS
+	SELECT players.id, players.name, COALESCE(SUM(match_results.win), 0) AS wins
+	FROM players 
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
+	GROUP BY players.id;
+
+
+-- Create player draw count view.
+CREATE VIEW player_draws AS
+	SELECT players.id, players.name, COALESCE(SUM(match_results.draw), 0) AS draws
+	FROM players 
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
+	GROUP BY players.id;
+
+
+-- Create player match count view.
+CREATE VIEW player_matches AS
+	SELECT players.id, players.name, COUNT(match_results.match_id) AS played
+	FROM players 
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
+	GROUP BY players.id;
+
+
+-- Create player opponents view.
+-- Ignore bye rows.
+CREATE VIEW player_opponents AS
+	SELECT players.id, players.name, match_results.opponent_id
+	FROM players 
+	JOIN match_results ON players.id = match_results.player_id
+	WHERE match_results.bye = 0;
+
+
+-- Create player opponent win count view.
+CREATE VIEW player_opponent_wins AS
+	SELECT players.id, players.name, 
+	SUM(CASE WHEN player_wins.wins IS NULL THEN 0 ELSE player_wins.wins END) AS opponent_wins
+	FROM players 
+	LEFT OUTER JOIN player_opponents ON players.id = player_opponents.id
+	LEFT OUTER JOIN player_wins ON player_opponents.opponent_id = player_wins.id
+	GROUP BY players.id;
+
+	
+-- Create player bye count view.
+CREATE VIEW player_byes AS
+	SELECT players.id, players.name, COALESCE(SUM(match_results.bye), 0) AS byes
+	FROM players 
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
+	GROUP BY players.id;
+
+
+-- Create player score view.
+-- A win, including a bye, scores one point and a draw half a point.
+CREATE VIEW player_scores AS
+	SELECT player_wins.id, player_wins.name,
+	(player_wins.wins + player_draws.draws::float / 2) AS score
+	FROM player_wins
+	JOIN player_draws ON player_wins.id = player_draws.id;
+
+
+-- Create player tiebreaks view.
+-- buchholz is the sum of the player's opponents' scores,
+-- median_buchholz leaves out the highest and lowest of them when there are
+-- more than two opponents,
+-- sonneborn_berger is the sum of the scores of the opponents the player
+-- beat, plus half the scores of the opponents the player drew with.
+-- Ignore bye rows.
+CREATE VIEW player_tiebreaks AS
+	SELECT players.id, players.name,
+	COALESCE(SUM(player_scores.score), 0) AS buchholz,
+	CASE WHEN COUNT(player_scores.id) > 2
+		THEN SUM(player_scores.score) - MAX(player_scores.score) - MIN(player_scores.score)
+		ELSE COALESCE(SUM(player_scores.score), 0) END AS median_buchholz,
+	COALESCE(SUM(CASE WHEN match_results.win = 1 THEN player_scores.score
+		WHEN match_results.draw = 1 THEN player_scores.score / 2
+		ELSE 0 END), 0) AS sonneborn_berger
+	FROM players
+	LEFT OUTER JOIN match_results
+	ON players.id = match_results.player_id AND match_results.bye = 0
+	LEFT OUTER JOIN player_scores ON match_results.opponent_id = player_scores.id
+	GROUP BY players.id;
+
+
+-- Create computed player standings view.
+-- Player rank is defined as matches played by player - player wins - player draws / 2
+-- so 0 is the highest rank
+-- Used to rebuild and check the standings table.
+CREATE VIEW computed_standings AS
+	SELECT players.id, players.tournament_id, players.name, 
+	player_wins.wins, player_draws.draws, player_opponent_wins.opponent_wins,
+	player_matches.played, player_byes.byes,
+	(player_matches.played - player_wins.wins - player_draws.draws::float / 2) AS rank,
+	player_scores.score, player_tiebreaks.buchholz,
+	player_tiebreaks.median_buchholz, player_tiebreaks.sonneborn_berger
+	FROM players 
+	JOIN player_wins ON players.id = player_wins.id
+	JOIN player_draws ON players.id = player_draws.id
+	JOIN player_opponent_wins ON players.id = player_opponent_wins.id
+	JOIN player_matches ON players.id = player_matches.id
+	JOIN player_byes ON players.id = player_byes.id
+	JOIN player_scores ON players.id = player_scores.id
+	JOIN player_tiebreaks ON players.id = player_tiebreaks.id;
+
+
+-- Create standings table.
+-- Holds the same columns as the computed_standings view, but is kept
+-- up to date by tournament.py in the same transaction that records a match,
+-- so reading the standings doesn't aggregate the matches table.
+CREATE TABLE standings (
+	id integer PRIMARY KEY REFERENCES players (id),
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	name text,
+	wins integer NOT NULL DEFAULT 0,
+	draws integer NOT NULL DEFAULT 0,
+	opponent_wins integer NOT NULL DEFAULT 0,
+	played integer NOT NULL DEFAULT 0,
+	byes integer NOT NULL DEFAULT 0,
+	rank double precision NOT NULL DEFAULT 0,
+	score double precision NOT NULL DEFAULT 0,
+	buchholz double precision NOT NULL DEFAULT 0,
+	median_buchholz double precision NOT NULL DEFAULT 0,
+	sonneborn_berger double precision NOT NULL DEFAULT 0
+);
+CREATE INDEX standings_rank_idx
+	ON standings (tournament_id, rank, opponent_wins DESC, id);
+
+
+-- Fill the standings table from the existing matches.
+INSERT INTO standings (id, tournament_id, name, wins, draws, opponent_wins,
+		played, byes, rank, score, buchholz, median_buchholz, sonneborn_berger)
+	SELECT id, tournament_id, name, wins, draws, opponent_wins,
+	played, byes, rank, score, buchholz, median_buchholz, sonneborn_berger
+	FROM computed_standings;
+
+
+
+-- Create rounds table.
+-- A round is started with its pairings and closed once every pairing has
+-- a result, numbered from 1 within its tournament.  The latest round's id
+-- and closed flag are the version tournament.py caches the round's
+-- pairings and standings under.
+CREATE TABLE rounds (
+	id serial PRIMARY KEY,
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	number integer NOT NULL,
+	closed boolean NOT NULL DEFAULT false,
+	started timestamp NOT NULL DEFAULT now(),
+	finished timestamp,
+	UNIQUE (tournament_id, number)
+);
+
+
+-- Create round pairings table.
+-- The pairings a round was started with, in the order swissPairings()
+-- returned them.  A bye is paired as player1 = player2.
+CREATE TABLE round_pairings (
+	round_id integer NOT NULL REFERENCES rounds (id),
+	position integer NOT NULL,
+	player1 integer NOT NULL REFERENCES players (id),
+	player2 integer NOT NULL REFERENCES players (id),
+	PRIMARY KEY (round_id, position)
+);
+
+
+-- Create round standings table.
+-- A copy of the standings taken when a round is closed, in standings order,
+-- so the standings after any round can be read back without recomputing.
+CREATE TABLE round_standings (
+	round_id integer NOT NULL REFERENCES rounds (id),
+	position integer NOT NULL,
+	id integer NOT NULL REFERENCES players (id),
+	name text,
+	wins integer NOT NULL,
+	draws integer NOT NULL,
+	opponent_wins integer NOT NULL,
+	played integer NOT NULL,
+	byes integer NOT NULL,
+	rank double precision NOT NULL,
+	PRIMARY KEY (round_id, position)
+);
+
+
+COMMIT;
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# pairing.py -- in-memory Swiss pairing engine for tournament.py
+#
+
+import time
+
+
+# Default number of seconds a pairing search may run for.
+DEFAULT_TIMEOUT = 5.0
+# Number of nodes explored per player looking for a cheaper pairing, once
+# a complete pairing has been found.
+IMPROVE_NODES_PER_PLAYER = 1
+# Number of nodes explored per player looking for a cheaper pairing with
+# other players given the bye, once a complete pairing has been found.
+BYE_NODES_PER_PLAYER = 16
+# How many nodes are explored between checks of the clock.
+_CLOCK_INTERVAL = 256
+
+
+class PairingError(ValueError):
+    """Raised when no complete set of pairings can be made."""
+
+
+class PairingTimeout(PairingError):
+    """Raised when the search runs out of time before finding a pairing."""
+
+    def __init__(self, message, nodes):
+        PairingError.__init__(self, message)
+        self.nodes = nodes
+
+
+class PairingResult(object):
+    """The outcome of a pairing search.
+
+    Attributes:
+      pairs: a list of (id1, name1, id2, name2) tuples, a bye is given as a
+        player who plays himself and comes first in the list.
+      cost: the total rank difference between paired players.
+      nodes: the number of search nodes explored.
+      elapsed: the number of seconds the search took.
+      optimal: True if no pairing with a lower cost exists.
+    """
+
+    def __init__(self, pairs, cost, nodes, elapsed, optimal):
+        self.pairs = pairs
+        self.cost = cost
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.optimal = optimal
+
+    def __repr__(self):
+        return ('<PairingResult pairs=%d cost=%s nodes=%d elapsed=%.3f '
+                'optimal=%s>' % (len(self.pairs), self.cost, self.nodes,
+                                 self.elapsed, self.optimal))
+
+
+def pairKey(id1, id2):
+    """Returns the key used for a pair of players in the played set."""
+    if id1 < id2:
+        return (id1, id2)
+    return (id2, id1)
+
+
+def pairPlayers(players, played, timeout=DEFAULT_TIMEOUT):
+    """Pair the players for the next round, see solvePairings().
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples.
+    """
+    return solvePairings(players, played, timeout).pairs
+
+
+def slideSeed(players):
+    """Reorder each score group so its top half meets its bottom half.
+
+    The search pairs neighbours down the list first, so a group ordered
+    1, 2, 3, 4, 5, 6 by rating is reordered 1, 4, 2, 5, 3, 6, pairing 1 v 4,
+    2 v 5 and 3 v 6.  When a group has an odd number of players, its lowest
+    player is left last, next to the group below.
+
+    Args:
+      players: a list of (id, name, byes, rank) tuples sorted by rank, and
+        by seed within each rank.
+
+    Returns:
+      A new list of the same players, still sorted by rank.
+    """
+    seeded = []
+    start = 0
+    while start < len(players):
+        end = start
+        while end < len(players) and players[end][3] == players[start][3]:
+            end += 1
+        group = players[start:end]
+        half = len(group) // 2
+        for k in range(half):
+            seeded.append(group[k])
+            seeded.append(group[half + k])
+        if len(group) % 2:
+            seeded.append(group[-1])
+        start = end
+    return seeded
+
+
+def solvePairings(players, played, timeout=DEFAULT_TIMEOUT):
+    """Pair the players for the next round of a Swiss tournament.
+
+    A depth first search pairs players down the standings, trying each
+    player's opponents in order of rank difference and skipping rematches,
+    and backtracks when a player is left without an opponent.  So a complete
+    pairing is always found if one exists.  The search then carries on for a
+    limited number of nodes looking for a pairing with a lower total rank
+    difference, pruning any branch that already costs as much as the best
+    pairing found.
+    If there is an odd number of players, one of the players that has not
+    had a bye is given one, the one that leaves the cheapest pairing of the
+    others.  They are tried starting with those whose bye could leave the
+    cheapest pairing, lowest ranking first.  Once a pairing is found,
+    players whose bye can't lead to a cheaper one are skipped, and the
+    others are searched for at most BYE_NODES_PER_PLAYER nodes per player
+    between them.
+
+    Args:
+      players: a list of (id, name, byes, rank) tuples sorted by rank, first
+        place first.
+      played: a set of pairKey() tuples for the players that have already
+        played each other.
+      timeout: the number of seconds to search for, or None for no limit.
+
+    Returns:
+      A PairingResult.
+
+    Raises:
+      PairingError: if no complete set of pairings can be made.
+      PairingTimeout: if the time runs out before any pairing is found.
+    """
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+    search = _Search(played, deadline)
+
+    if len(players) % 2 == 0:
+        pairs = search.run(players)
+        if pairs is None:
+            raise PairingError("Pairing failed.")
+        return PairingResult(pairs, search.best_cost, search.nodes,
+                             time.time() - start, search.complete)
+
+    candidates = [i for i, p in enumerate(players) if p[2] == 0]
+    candidates.reverse()
+    if not candidates:
+        raise PairingError("No players are eligible for a bye.")
+    bounds = _byeLowerBounds([p[3] for p in players])
+    candidates.sort(key=lambda i: bounds[i])
+    best = None
+    best_cost = None
+    limit = None
+    optimal = True
+    for i in candidates:
+        if best_cost is not None:
+            if bounds[i] >= best_cost:
+                # Neither this nor any later candidate can do better.
+                break
+            if search.nodes >= limit or search._outOfTime():
+                optimal = False
+                break
+        pairs = search.run(players[:i] + players[i + 1:], best_cost, limit)
+        optimal = optimal and search.complete
+        if pairs is not None:
+            bye = players[i]
+            pairs.insert(0, (bye[0], bye[1], bye[0], bye[1]))
+            best = pairs
+            best_cost = search.best_cost
+            if limit is None:
+                limit = search.nodes + BYE_NODES_PER_PLAYER * len(players)
+    if best is None:
+        raise PairingError("Pairing failed.")
+    return PairingResult(best, best_cost, search.nodes, time.time() - start,
+                         optimal)
+
+
+def _byeLowerBounds(ranks):
+    """Returns the lowest pairing cost possible with each player's bye.
+
+    That is the cost of pairing neighbours down the standings of the other
+    players, which no pairing of them can beat.
+
+    Args:
+      ranks: the players' ranks, an odd number of them, in order.
+    """
+    n = len(ranks)
+    step = [abs(ranks[k + 1] - ranks[k]) for k in range(n - 1)]
+    # even[k] is the cost of pairs (0, 1), (2, 3), ... before player k, and
+    # odd[k] the cost of pairs (k, k + 1), (k + 2, k + 3), ... for odd k.
+    even = [0] * (n + 1)
+    for k in range(n):
+        even[k + 1] = even[k] + (step[k] if k % 2 == 0 and k < n - 1 else 0)
+    odd = [0] * (n + 2)
+    for k in range(n - 2, -1, -1):
+        odd[k] = odd[k + 1] + (step[k] if k % 2 else 0)
+    bounds = []
+    for i in range(n):
+        if i % 2 == 0:
+            bounds.append(even[i] + odd[i + 1])
+        else:
+            bounds.append(even[i - 1] + abs(ranks[i + 1] - ranks[i - 1]) +
+                          odd[i + 2])
+    return bounds
+
+
+class _Search(object):
+    """Depth first search for a minimum cost pairing of an even player list.
+
+    The node count carries over between runs, so it covers every bye player
+    tried.
+    """
+
+    def __init__(self, played, deadline):
+        self.played = played
+        self.deadline = deadline
+        self.nodes = 0
+        self.best_cost = None
+        self.complete = False
+
+    def run(self, players, bound=None, limit=None):
+        """Search for a pairing of players.
+
+        Args:
+          players: the players to pair, an even number of them.
+          bound: only look for pairings that cost less than this, or None.
+          limit: the node count to stop searching at, or None.
+
+        Returns:
+          A list of (id1, name1, id2, name2) tuples, or None if the players
+          cannot be paired for less than bound.  complete is set if no
+          cheaper pairing exists than the one returned.
+        """
+        played = self.played
+        n = len(players)
+        ids = [p[0] for p in players]
+        ranks = [p[3] for p in players]
+        partner = [-1] * n
+        stack = []
+        cost = 0
+        best = None
+        best_cost = bound
+        improve_nodes = limit
+        self.complete = False
+        # Pairing neighbours down the standings is the cheapest any pairing
+        # can be, so a pairing that costs this much can't be improved.
+        lower_bound = sum(abs(ranks[k + 1] - ranks[k]) for k in range(0, n, 2))
+
+        i = 0
+        j = 1
+        while True:
+            # Find the next opponent for player i, starting from j.
+            while i < n and partner[i] >= 0:
+                i += 1
+                j = i + 1
+            if i == n:
+                if best_cost is None or cost < best_cost:
+                    best = list(partner)
+                    best_cost = cost
+                    improve_nodes = self.nodes + IMPROVE_NODES_PER_PLAYER * n
+                    if limit is not None:
+                        improve_nodes = min(improve_nodes, limit)
+                if best_cost <= lower_bound:
+                    self.complete = True
+                    break
+                i, j, cost = self._backtrack(stack, partner, ranks, cost)
+                if i is None:
+                    self.complete = True
+                    break
+                continue
+
+            found = False
+            while j < n:
+                if partner[j] < 0 and (
+                        (ids[i], ids[j]) if ids[i] < ids[j]
+                        else (ids[j], ids[i])) not in played:
+                    step = abs(ranks[j] - ranks[i])
+                    if best_cost is not None and cost + step >= best_cost:
+                        # Later opponents are further down the standings,
+                        # so they can only cost more.
+                        break
+                    found = True
+                    break
+                j += 1
+
+            if found:
+                partner[i] = j
+                partner[j] = i
+                cost += step
+                stack.append((i, j))
+                self.nodes += 1
+                if self.nodes % _CLOCK_INTERVAL == 0 and self._outOfTime():
+                    if best is None and bound is None:
+                        raise PairingTimeout(
+                            "Pairing timed out after %d nodes." % self.nodes,
+                            self.nodes)
+                    break
+                if improve_nodes is not None and self.nodes >= improve_nodes:
+                    break
+                i += 1
+                j = i + 1
+            else:
+                i, j, cost = self._backtrack(stack, partner, ranks, cost)
+                if i is None:
+                    # Every branch has been searched.
+                    self.complete = True
+                    break
+
+        if best is None:
+            return None
+        self.best_cost = best_cost
+        return [(ids[k], players[k][1], ids[best[k]], players[best[k]][1])
+                for k in range(n) if best[k] > k]
+
+    def _backtrack(self, stack, partner, ranks, cost):
+        """Undo the last pairing made.
+
+        Returns:
+          A tuple (i, j, cost) to carry on searching from, with i None if
+          there is nothing left to undo.
+        """
+        if not stack:
+            return None, None, cost
+        i, j = stack.pop()
+        partner[i] = -1
+        partner[j] = -1
+        return i, j + 1, cost - abs(ranks[j] - ranks[i])
+
+    def _outOfTime(self):
+        return self.deadline is not None and time.time() > self.deadline
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# ratings.py -- Elo rating updates for tournament.py
+#
+# A round is rated in one batch: every match is scored against the ratings
+# the players had at the start of the round, so the order the results were
+# reported in doesn't matter.  NumPy is used when it is installed, the plain
+# Python version gives the same ratings.
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The rating a player is registered with when none is given.
+DEFAULT_RATING = 1500.0
+# The most a player's rating can change in one match.
+K_FACTOR = 32.0
+
+
+def expectedScore(rating, opponent_rating):
+    """Returns the score a player is expected to make against an opponent."""
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def rateRound(ratings, results, k=K_FACTOR):
+    """Work out the players' ratings after a round.
+
+    Args:
+      ratings: a dict of player id to rating at the start of the round, for
+        every player in results.
+      results: a list of (player1, player2, winner) tuples, as taken by
+        tournament.reportMatches().  Byes don't change a rating.
+      k: the K factor.
+
+    Returns:
+      A dict of player id to new rating, for the players who played a match.
+    """
+    results = [(p1, p2, winner) for (p1, p2, winner) in results if p1 != p2]
+    if not results:
+        return {}
+    if numpy is None:
+        return _rateRound(ratings, results, k)
+
+    player1 = numpy.array([p1 for (p1, p2, winner) in results])
+    player2 = numpy.array([p2 for (p1, p2, winner) in results])
+    score1 = numpy.array([0.5 if winner is None else float(winner == p1)
+                          for (p1, p2, winner) in results])
+    rating1 = numpy.array([ratings[p1] for p1 in player1], dtype=float)
+    rating2 = numpy.array([ratings[p2] for p2 in player2], dtype=float)
+    expected1 = 1.0 / (1.0 + 10.0 ** ((rating2 - rating1) / 400.0))
+    change = k * (score1 - expected1)
+    # A player can only be in one match a round, so each id appears once.
+    ids = numpy.concatenate([player1, player2])
+    new = numpy.concatenate([rating1 + change, rating2 - change])
+    return dict(zip(ids.tolist(), new.tolist()))
+
+
+def _rateRound(ratings, results, k):
+    """rateRound() without NumPy."""
+    new = {}
+    for (player1, player2, winner) in results:
+        score1 = 0.5 if winner is None else float(winner == player1)
+        change = k * (score1 - expectedScore(ratings[player1],
+                                             ratings[player2]))
+        new[player1] = ratings[player1] + change
+        new[player2] = ratings[player2] - change
+    return new
@@ -4,54 +4,280 @@
 #
 
 
-import math
-import psycopg2
+import contextlib
+import os
+import threading
+import time
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:
+    # Only needed by the PostgreSQL backend.
+    psycopg2 = None
+
+import pairing
+import ratings
+import tournament_stats
+
+
+# The tournament used when a function isn't given a tournament id.
+DEFAULT_TOURNAMENT = 1
+
+# Tiebreaks that players with the same rank can be ordered by.
+TIEBREAKS = ('opponent_wins', 'buchholz', 'median_buchholz', 'sonneborn_berger')
+DEFAULT_TIEBREAKS = ('opponent_wins',)
+
+# Number of rows iterStandings() fetches from the database at a time.
+STREAM_CHUNK_SIZE = 2000
+
+# Database connection settings, change them with configurePool().
+DSN = "dbname=tournament"
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+# None uses tournament_stats.InstrumentedCursor, which records statement
+# timings when tournament_stats is enabled.
+POOL_CURSOR_FACTORY = None
+# Pooled connections idle for longer than this many seconds are pinged
+# before being handed out again.
+POOL_CHECK_AFTER = 30
+
+_backend = None
+_pool = None
+# Counts the connections free to check out, so connect() waits for one
+# instead of the pool raising PoolError.
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+# (kind, tournament, round) -> (round version, pairings or standings).
+_round_cache = {}
+_round_cache_lock = threading.Lock()
+
+
+class PooledConnection(object):
+    """A database connection checked out of the connection pool.
+
+    Behaves like a psycopg2 connection, except that close() hands the
+    connection back to the pool instead of closing it.  Used as a context
+    manager, the transaction is committed on success, rolled back on error,
+    and the connection is returned to the pool on exit.
+    """
+
+    def __init__(self, pool, slots, conn):
+        self._pool = pool
+        self._slots = slots
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+
+    def close(self):
+        """Return the connection to the pool, discarding uncommitted work."""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            if conn.closed:
+                _last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            else:
+                _last_used[id(conn)] = time.time()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+
+def configurePool(dsn=None, minconn=None, maxconn=None, cursor_factory=None):
+    """Set the connection settings, closing any existing pool.
+
+    Args:
+      dsn: the psycopg2 connection string.
+      minconn: the number of connections kept open in the pool.
+      maxconn: the maximum number of connections the pool will open.
+      cursor_factory: the psycopg2 cursor class pooled connections use.
+    """
+    global DSN, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_CURSOR_FACTORY
+    closePool()
+    if cursor_factory is not None:
+        POOL_CURSOR_FACTORY = cursor_factory
+    if dsn is not None:
+        DSN = dsn
+    if minconn is not None:
+        POOL_MIN_SIZE = minconn
+    if maxconn is not None:
+        POOL_MAX_SIZE = maxconn
+
+
+def closePool():
+    """Close all the connections in the pool."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _pool_slots = None
+        _last_used.clear()
+
+
+def _getPool():
+    """Returns the connection pool and the semaphore guarding its
+    connections, creating them on first use."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN_SIZE, POOL_MAX_SIZE, DSN,
+                cursor_factory=(POOL_CURSOR_FACTORY or
+                                tournament_stats.InstrumentedCursor))
+            _pool_slots = threading.Semaphore(POOL_MAX_SIZE)
+        return _pool, _pool_slots
+
+
+def _isHealthy(conn):
+    """Check a pooled connection is still usable before handing it out."""
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.time() - last_used < POOL_CHECK_AFTER:
+        return True
+    try:
+        # Ping outside of a transaction, so it costs a single round trip.
+        conn.autocommit = True
+        c = conn.cursor()
+        c.execute("SELECT 1;")
+        c.close()
+        conn.autocommit = False
+    except psycopg2.Error:
+        return False
+    return True
 
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    The connection is taken from a connection pool, calling close() on it
+    returns it to the pool.  When all POOL_MAX_SIZE connections are in use,
+    waits for one to be returned.  Broken connections are discarded and
+    replaced.
+    """
+    start = time.time() if tournament_stats.enabled else None
+    pool, slots = _getPool()
+    slots.acquire()
+    try:
+        for attempt in range(POOL_MAX_SIZE + 1):
+            conn = pool.getconn()
+            if _isHealthy(conn):
+                if start is not None:
+                    tournament_stats.recordConnection(time.time() - start)
+                return PooledConnection(pool, slots, conn)
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("No usable database connection.")
+    except Exception:
+        slots.release()
+        raise
+
+
+@contextlib.contextmanager
+def getCursor():
+    """Context manager giving a cursor on a pooled connection.
+
+    The transaction is committed when the block exits normally, and rolled
+    back if it raises.
+    """
+    with connect() as conn:
+        c = conn.cursor()
+        try:
+            yield c
+        finally:
+            c.close()
+
+
+def setBackend(backend):
+    """Set the storage backend used by the module functions.
+
+    Args:
+      backend: a PostgresBackend, a tournament_memory.MemoryBackend, or any
+        object with the same methods.
+    """
+    global _backend
+    _backend = backend
+    with _round_cache_lock:
+        _round_cache.clear()
+
 
+def getBackend():
+    """Returns the storage backend used by the module functions."""
+    global _backend
+    if _backend is None:
+        if os.environ.get('TOURNAMENT_BACKEND') == 'memory':
+            import tournament_memory
+            _backend = tournament_memory.MemoryBackend()
+        else:
+            _backend = PostgresBackend()
+    return _backend
 
-def deleteMatches():
-    """Remove all the match records from the database."""
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM matches;")
-    conn.commit()
-    conn.close()
 
+@tournament_stats.timed
+def createTournament(name):
+    """Adds a tournament to the database.
+
+    Args:
+      name: the tournament's name.
+
+    Returns:
+      The new tournament's id.
+    """
+    return getBackend().createTournament(name)
+
+
+@tournament_stats.timed
+def deleteTournament(tournament):
+    """Remove a tournament, with all its players and matches."""
+    getBackend().deleteTournament(tournament)
 
-def deletePlayers():
-    """Remove all the player records from the database."""
-    conn = connect()
-    c = conn.cursor()
-    c.execute("DELETE FROM players;")
-    conn.commit()
-    conn.close()
 
+@tournament_stats.timed
+def deleteMatches(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the match records of a tournament from the database."""
+    getBackend().deleteMatches(tournament)
 
-def countPlayers():
+
+@tournament_stats.timed
+def deletePlayers(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the player records of a tournament from the database."""
+    getBackend().deletePlayers(tournament)
+
+
+@tournament_stats.timed
+def countPlayers(tournament=DEFAULT_TOURNAMENT):
     """Returns the number of players currently registered."""
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(id) FROM players;")
-    row = c.fetchone()
-    conn.close()
-    return row[0]
+    return getBackend().countPlayers(tournament)
 
 
-def countMatches():
+@tournament_stats.timed
+def countMatches(tournament=DEFAULT_TOURNAMENT):
     """Returns the number of matches played."""
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(player1) FROM matches;")
-    row = c.fetchone()
-    conn.close()
-    return row[0]
+    return getBackend().countMatches(tournament)
 
 
-def registerPlayer(name):
+@tournament_stats.timed
+def registerPlayer(name, tournament=DEFAULT_TOURNAMENT, rating=None):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -59,15 +285,58 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+      tournament: the id of the tournament the player is entering.
+      rating: the player's rating, ratings.DEFAULT_RATING if not given.
+
+    Returns:
+      The new player's id.
+    """
+    return registerPlayers([name], tournament, [rating])[0]
+
+
+@tournament_stats.timed
+def registerPlayers(names, tournament=DEFAULT_TOURNAMENT, initial_ratings=None):
+    """Adds many players to the tournament database in one statement.
+
+    Args:
+      names: an iterable of the players' full names.
+      tournament: the id of the tournament the players are entering.
+      initial_ratings: an iterable of the players' ratings to start with, in
+        the same order as names.  A rating of None, or no initial_ratings at
+        all, gives the player ratings.DEFAULT_RATING.
+
+    Returns:
+      A list of the new players' ids.
+    """
+    names = list(names)
+    if not names:
+        return []
+    if initial_ratings is None:
+        initial_ratings = [None] * len(names)
+    initial_ratings = [_defaultRating(rating) for rating in initial_ratings]
+    if len(initial_ratings) != len(names):
+        raise ValueError("Every player registered should have a rating.")
+    return getBackend().registerPlayers(names, tournament, initial_ratings)
+
+
+def _defaultRating(rating):
+    if rating is None:
+        return ratings.DEFAULT_RATING
+    return float(rating)
+
+
+@tournament_stats.timed
+def playerRatings(tournament=DEFAULT_TOURNAMENT):
+    """Returns the players' ratings.
+
+    Returns:
+      A list of (id, name, rating) tuples, highest rating first.
     """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("INSERT INTO Players (name) VALUES (%s);", (name,))
-    conn.commit()
-    conn.close()
+    return getBackend().playerRatings(tournament)
 
 
-def playerStandings():
+@tournament_stats.timed
+def playerStandings(tournament=DEFAULT_TOURNAMENT, tiebreaks=DEFAULT_TIEBREAKS):
     """Returns a list of the players and their win records.
 
     The list is sorted by rank ascending and opponent match wins descending.
@@ -75,6 +344,11 @@ def playerStandings():
     The first entry in the list should be the player in first place,
     or a player tied for first place if there is currently a tie.
 
+    Args:
+      tournament: the id of the tournament.
+      tiebreaks: the tiebreaks used to order players with the same rank,
+        highest first, from TIEBREAKS.
+
     Returns:
       A list of tuples, each of which contains
         (id, name, wins, draws, played, byes, opponent_wins, rank):
@@ -87,33 +361,260 @@ def playerStandings():
         opponent_wins: the number of matches the players opponents have won
         rank: the ranking of the player = played - wins - draws/2
     """
-    conn = connect()
-    c = conn.cursor()
-    sql = """SELECT id, name, wins, draws, opponent_wins, played, byes, rank
-                FROM standings ORDER BY rank, opponent_wins DESC;"""
-    c.execute(sql)
-    standings = c.fetchall()
-    conn.close()
-    return standings
+    return getBackend().playerStandings(tournament, checkTiebreaks(tiebreaks))
+
+
+@tournament_stats.timed
+def iterStandings(tournament=DEFAULT_TOURNAMENT, tiebreaks=DEFAULT_TIEBREAKS,
+                  chunk_size=STREAM_CHUNK_SIZE):
+    """Returns an iterator over the rows of playerStandings().
+
+    The rows are read through a server side cursor, chunk_size at a time,
+    so memory use doesn't grow with the number of players.  The connection
+    is held until the iterator is exhausted or closed.
+
+    Args:
+      tournament: the id of the tournament.
+      tiebreaks: the tiebreaks used to order players, as for playerStandings().
+      chunk_size: the number of rows fetched from the database at a time.
+    """
+    return getBackend().iterStandings(tournament, checkTiebreaks(tiebreaks),
+                                      chunk_size)
+
+
+@tournament_stats.timed
+def standingsPage(tournament=DEFAULT_TOURNAMENT, limit=100, after=None,
+                  offset=0, tiebreaks=DEFAULT_TIEBREAKS):
+    """Returns one page of the standings.
+
+    Pages are best read with the cursor returned with the previous page,
+    which finds where the page starts from the standings index however
+    deep into the standings it is.  offset skips rows after that, and on
+    its own reads the whole standings up to the page.
+
+    Args:
+      tournament: the id of the tournament.
+      limit: the most rows to return.
+      after: the cursor returned with the previous page, or None to start
+        from first place.
+      offset: the number of rows to skip.
+      tiebreaks: the tiebreaks used to order players, as for playerStandings().
+        A cursor is only good for the tiebreaks it was made with.
+
+    Returns:
+      A tuple (rows, cursor):
+        rows: a list of rows as returned by playerStandings().
+        cursor: the cursor of the page after this one, or None if this is
+          the last page.
+    """
+    if limit < 1 or offset < 0:
+        raise ValueError("The limit should be positive and the offset should "
+                         "not be negative.")
+    tiebreaks = checkTiebreaks(tiebreaks)
+    if after is not None:
+        after = tuple(after)
+        if len(after) != len(tiebreaks) + 2:
+            raise ValueError("The cursor doesn't match the tiebreaks.")
+    return getBackend().standingsPage(tournament, tiebreaks, limit, after,
+                                      offset)
 
 
-def reportMatch(player1, player2, winner=None):
+@tournament_stats.timed
+def playerTiebreaks(tournament=DEFAULT_TOURNAMENT, tiebreaks=DEFAULT_TIEBREAKS):
+    """Returns the players' scores and tiebreaks, in standings order.
+
+    Args:
+      tournament: the id of the tournament.
+      tiebreaks: the tiebreaks used to order players, as for playerStandings().
+
+    Returns:
+      A list of tuples, each of which contains
+        (id, score, opponent_wins, buchholz, median_buchholz, sonneborn_berger):
+        id: the player's unique id
+        score: wins + draws/2
+        opponent_wins: the number of matches the players opponents have won
+        buchholz: the sum of the player's opponents' scores
+        median_buchholz: buchholz without the highest and lowest opponent
+          scores, when the player has had more than two opponents
+        sonneborn_berger: the sum of the scores of the opponents the player
+          beat, plus half the scores of the opponents the player drew with
+    """
+    return getBackend().playerTiebreaks(tournament, checkTiebreaks(tiebreaks))
+
+
+def checkTiebreaks(tiebreaks):
+    """Check a tiebreak order only names tiebreaks from TIEBREAKS.
+
+    Returns:
+      The tiebreaks as a tuple.
+    """
+    tiebreaks = tuple(tiebreaks)
+    for tiebreak in tiebreaks:
+        if tiebreak not in TIEBREAKS:
+            raise ValueError("Unknown tiebreak %r, use one of %s."
+                             % (tiebreak, ', '.join(TIEBREAKS)))
+    return tiebreaks
+
+
+@tournament_stats.timed
+def reportMatch(player1, player2, winner=None, tournament=DEFAULT_TOURNAMENT):
     """Records the outcome of a single match between two players.
 
     Args:
       player1:  the id number of the player 1
       player2:  the id number of the player 2
       winner:   the id number of the player who won, or None for a draw
+      tournament: the id of the tournament the match was played in
+    """
+    reportMatches([(player1, player2, winner)], tournament)
+
+
+@tournament_stats.timed
+def reportMatches(results, tournament=DEFAULT_TOURNAMENT):
+    """Records the outcomes of a round of matches in one transaction.
+
+    The whole round is checked before anything is written, and if any match
+    can't be recorded none of them are.
+
+    Args:
+      results: an iterable of (player1, player2, winner) tuples, as taken by
+        reportMatch().  A bye is given as player1 = player2 = winner.
+      tournament: the id of the tournament the matches were played in.
+
+    Raises:
+      ValueError: if a player appears twice in the round or isn't in the
+        tournament, a winner didn't play in the match, or two players have
+        already played each other.
+    """
+    results = [tuple(result) for result in results]
+    if not results:
+        return
+    players = checkRound(results)
+    getBackend().reportMatches(results, players, tournament)
+
+
+def checkRound(results):
+    """Check a round of results can be recorded, without using the database.
+
+    Returns:
+      The set of ids of the players in the round.
+
+    Raises:
+      ValueError: if a player appears twice in the round, or a winner didn't
+        play in the match.
+    """
+    seen = set()
+    for (player1, player2, winner) in results:
+        if player1 == player2:
+            if winner != player1:
+                raise ValueError("A bye must be won by player %s." % player1)
+        elif winner not in (player1, player2, None):
+            raise ValueError("Player %s did not play in match %s v %s."
+                             % (winner, player1, player2))
+        for player in set([player1, player2]):
+            if player in seen:
+                raise ValueError("Player %s appears twice in the round."
+                                 % player)
+            seen.add(player)
+    return seen
+
+
+def roundTotals(results):
+    """Returns what a round of results adds to each player's totals.
+
+    Returns:
+      A dict of player id to a (played, wins, draws, byes) tuple.
+    """
+    totals = {}
+    for (player1, player2, winner) in results:
+        for player in set([player1, player2]):
+            totals[player] = (1, int(winner == player), int(winner is None),
+                              int(player1 == player2))
+    return totals
+
+
+# The statements that record a round of results, shared with
+# tournament_async.py.  Each driver formats in its own way of passing the
+# rows, so both write the same match results and standings.
+
+# Held until the transaction ends, so concurrent submissions for the same
+# tournament are recorded one after another instead of deadlocking on the
+# standings rows they both update.
+LOCK_TOURNAMENT_SQL = "SELECT pg_advisory_xact_lock({tournament});"
+
+# {matches} gives (tournament_id, player1, player2, winner) rows.
+RECORD_MATCHES_SQL = """
+    WITH m AS (INSERT INTO matches (tournament_id, player1, player2, winner)
+                {matches} RETURNING *)
+    INSERT INTO match_results
+        (player_id, opponent_id, match_id, tournament_id, win, draw, bye)
+        SELECT player1, player2, id, tournament_id,
+            CASE WHEN winner = player1 THEN 1 ELSE 0 END,
+            CASE WHEN winner IS NULL THEN 1 ELSE 0 END,
+            CASE WHEN player1 = player2 THEN 1 ELSE 0 END
+        FROM m
+        UNION ALL
+        SELECT player2, player1, id, tournament_id,
+            CASE WHEN winner = player2 THEN 1 ELSE 0 END,
+            CASE WHEN winner IS NULL THEN 1 ELSE 0 END,
+            0
+        FROM m WHERE player1 != player2;"""
+
+# {totals} gives the (id, played, wins, draws, byes) rows of roundTotals().
+UPDATE_TOTALS_SQL = """
+    UPDATE standings SET played = standings.played + d.played,
+        wins = standings.wins + d.wins,
+        draws = standings.draws + d.draws,
+        byes = standings.byes + d.byes,
+        rank = standings.rank + d.played - d.wins - d.draws / 2.0,
+        score = standings.score + d.wins + d.draws / 2.0
+    FROM {totals} AS d (id, played, wins, draws, byes)
+    WHERE standings.id = d.id;"""
+
+# The opponent tiebreaks change for the round's players, who have a new
+# opponent, and for all their earlier opponents, whose opponent's score may
+# have changed.  Recompute just those players' from their match results.
+# {players} is an array of the round's player ids.
+UPDATE_TIEBREAKS_SQL = """
+    UPDATE standings SET opponent_wins = t.opponent_wins,
+        buchholz = t.buchholz, median_buchholz = t.median_buchholz,
+        sonneborn_berger = t.sonneborn_berger
+    FROM (SELECT r.player_id AS id, SUM(o.wins) AS opponent_wins,
+            SUM(o.score) AS buchholz,
+            CASE WHEN COUNT(*) > 2
+                THEN SUM(o.score) - MAX(o.score) - MIN(o.score)
+                ELSE SUM(o.score) END AS median_buchholz,
+            SUM(CASE WHEN r.win = 1 THEN o.score
+                WHEN r.draw = 1 THEN o.score / 2
+                ELSE 0 END) AS sonneborn_berger
+          FROM match_results r
+          JOIN standings o ON o.id = r.opponent_id
+          WHERE r.bye = 0 AND r.player_id IN
+            (SELECT opponent_id FROM match_results
+                WHERE player_id = ANY({players}) AND bye = 0)
+          GROUP BY r.player_id) t
+    WHERE standings.id = t.id;"""
+
+
+@tournament_stats.timed
+def rebuildStandings(tournament=DEFAULT_TOURNAMENT):
+    """Recompute a tournament's standings from its match results."""
+    getBackend().rebuildStandings(tournament)
+
+
+@tournament_stats.timed
+def checkStandings(tournament=DEFAULT_TOURNAMENT):
+    """Compare the kept standings with the standings computed from results.
+
+    Returns:
+      A list of the ids of the players whose standings are wrong.
     """
-    conn = connect()
-    c = conn.cursor()
-    sql = "INSERT INTO matches (player1,player2,winner) VALUES (%s,%s,%s);"
-    c.execute(sql, (player1, player2, winner))
-    conn.commit()
-    conn.close()
+    return getBackend().checkStandings(tournament)
 
 
-def swissPairings():
+@tournament_stats.timed
+def swissPairings(tournament=DEFAULT_TOURNAMENT,
+                  timeout=pairing.DEFAULT_TIMEOUT):
     """Returns a list of pairs of players for the next round of a match.
 
     Each player appears in only one pairing.
@@ -126,6 +627,13 @@ def swissPairings():
     If the lowest rank cannot be given a bye because it stops a complete set
     of pairings to be made, then the next lowest rank without a previous bye
     is attempted, and so on.
+    Among the complete sets of pairings, the search prefers the one with the
+    smallest total rank difference between paired players.
+
+    Args:
+      tournament: the id of the tournament.
+      timeout: the number of seconds to search for pairings, or None for
+        no limit.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -134,71 +642,571 @@ def swissPairings():
         id2: the second player's unique id
         name2: the second player's name
     """
-    # Create list for pairings.
-    pairs = []
-
-    player_count = countPlayers()
-
-    # If odd number of players, get a list of possible bye players,
-    # from which to award a bye.
-    if player_count % 2 != 0:
-        possible_bye_players = possibleByePlayers()
-
-    # Get a list of possible pairings from the possible_pairings view,
-    # sorted by rank.
-    possible_pairs = possiblePairings()
-
-    # Need to loop because 1st pairing attempt may fail when byes are involved.
-    # May need to try setting different players as the bye player to get a
-    # complete set of pairings.
-    while len(pairs) < int(math.ceil(float(player_count)/2)):
-        # clear list of pairings
-        del pairs[:]
- 
-        # add lowest ranked possible bye player, if we have an odd number of players
-        if player_count % 2 != 0:
-            if len(possible_bye_players) > 0:
-                bye_player = possible_bye_players.pop()
-                pairs.append((bye_player[0],bye_player[1],bye_player[0],bye_player[1]))
-            else:
-                raise ValueError("No players are eligible for a bye.")
-
-        # add pairs to list, only adding each player once
-        for (id1, name1, id2, name2) in possible_pairs:
-            if any(id1 in (p[0], p[2]) or id2 in (p[0], p[2]) for p in pairs):
-                continue
-            pairs.append((id1, name1, id2, name2))
-    
-        if (len(pairs) < int(math.ceil(float(player_count)/2))
-            and player_count % 2 == 0):
-            raise ValueError("Pairing failed.")
-           
+    return swissPairingResult(tournament, timeout).pairs
+
+
+@tournament_stats.timed
+def swissPairingResult(tournament=DEFAULT_TOURNAMENT,
+                       timeout=pairing.DEFAULT_TIMEOUT):
+    """Pair the next round as swissPairings() does, with search statistics.
+
+    Players with the same rank are seeded by rating, and the top half of
+    each score group is paired against the bottom half.
+
+    Returns:
+      A pairing.PairingResult, giving the pairs as well as the total rank
+      difference, the number of search nodes explored and the time taken.
+    """
+    players, played = loadPairingData(tournament)
+    return pairing.solvePairings(pairing.slideSeed(players), played, timeout)
+
+
+@tournament_stats.timed
+def startRound(tournament=DEFAULT_TOURNAMENT, timeout=pairing.DEFAULT_TIMEOUT):
+    """Pair the next round of a tournament and record its pairings.
+
+    Results are reported for the round with reportMatch() or reportMatches()
+    as usual, and the round is finished with closeRound().
+
+    Args:
+      tournament: the id of the tournament.
+      timeout: the number of seconds to search for pairings, as for
+        swissPairings().
+
+    Returns:
+      The round's pairings, as returned by swissPairings().
+
+    Raises:
+      ValueError: if the tournament's last round hasn't been closed.
+      pairing.PairingError: if the round can't be paired.
+    """
+    backend = getBackend()
+    version = backend.roundVersion(tournament)
+    if version is not None and not version[2]:
+        raise ValueError("Round %s of tournament %s hasn't been closed."
+                         % (version[1], tournament))
+    pairs = swissPairingResult(tournament, timeout).pairs
+    backend.startRound(tournament, pairs)
     return pairs
 
 
-def possibleByePlayers():
+@tournament_stats.timed
+def closeRound(tournament=DEFAULT_TOURNAMENT, rate=True):
+    """Finish a tournament's current round and snapshot its standings.
+
+    Args:
+      tournament: the id of the tournament.
+      rate: update the players' ratings from the round's results, in one
+        batch with ratings.rateRound().
+
+    Returns:
+      The number of the round closed.
+
+    Raises:
+      ValueError: if the tournament has no open round, or a pairing of the
+        round has no result reported.
+    """
+    return getBackend().closeRound(tournament,
+                                   ratings.rateRound if rate else None)
+
+
+@tournament_stats.timed
+def currentRound(tournament=DEFAULT_TOURNAMENT):
+    """Returns a tuple (number, closed) for the tournament's latest round.
+
+    Returns None if no round has been started.
+    """
+    version = getBackend().roundVersion(tournament)
+    if version is None:
+        return None
+    return version[1], version[2]
+
+
+@tournament_stats.timed
+def roundPairings(tournament=DEFAULT_TOURNAMENT, round=None):
+    """Returns the pairings a round was started with.
+
+    The pairings are cached, so reading them again costs a single lookup of
+    the tournament's latest round until a round is started or closed.
+
+    Args:
+      tournament: the id of the tournament.
+      round: the round number, by default the latest round.
+
+    Returns:
+      A tuple of (id1, name1, id2, name2) tuples, as from swissPairings().
+      The tuple is shared with other callers.
+    """
+    def load(version):
+        started = 0 if version is None else version[1]
+        number = started if round is None else round
+        if number < 1 or number > started:
+            raise ValueError("Round %s of tournament %s hasn't been started."
+                             % (round or 1, tournament))
+        return tuple(getBackend().roundPairings(tournament, number))
+    return _roundCached('pairings', tournament, round, load)
+
+
+@tournament_stats.timed
+def roundStandings(tournament=DEFAULT_TOURNAMENT, round=None):
+    """Returns the standings as they were when a round was closed.
+
+    Like roundPairings(), the standings are cached until the tournament's
+    rounds change.
+
+    Args:
+      tournament: the id of the tournament.
+      round: the round number, by default the latest closed round.
+
+    Returns:
+      A tuple of the rows playerStandings() returned when the round closed.
+      The tuple is shared with other callers.
+    """
+    def load(version):
+        closed = 0
+        if version is not None:
+            closed = version[1] if version[2] else version[1] - 1
+        number = closed if round is None else round
+        if number < 1 or number > closed:
+            raise ValueError("Round %s of tournament %s hasn't been closed."
+                             % (round or 1, tournament))
+        return tuple(getBackend().roundStandings(tournament, number))
+    return _roundCached('standings', tournament, round, load)
+
+
+def _roundCached(kind, tournament, round, load):
+    """Returns a cached round value, calling load(version) if it is stale.
+
+    Every start or close of a round changes the tournament's round version,
+    so a cached value is good for as long as the version is the same.
+    """
+    version = getBackend().roundVersion(tournament)
+    key = (kind, tournament, round)
+    with _round_cache_lock:
+        cached = _round_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    value = load(version)
+    with _round_cache_lock:
+        _round_cache[key] = (version, value)
+    return value
+
+
+@tournament_stats.timed
+def possibleByePlayers(tournament=DEFAULT_TOURNAMENT):
     """Get the list of players that have not had a bye.
 
     Returns:
       A list of tuples of players (id, name) ordered by rank.
     """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM standings WHERE byes = 0 ORDER BY rank;")
-    possible_bye_players = c.fetchall()
-    conn.close()
-    return possible_bye_players
+    players, played = loadPairingData(tournament)
+    return [(id, name) for (id, name, byes, rank) in players if byes == 0]
 
 
-def possiblePairings():
+@tournament_stats.timed
+def possiblePairings(tournament=DEFAULT_TOURNAMENT):
     """Get the list of possible pairings for a round.
 
     Returns:
       A list of tuples of player pairings (id1, name1, id2, name2) ordered by rank.
     """
-    conn = connect()
-    c = conn.cursor()
-    c.execute("SELECT id1, name1, id2, name2 FROM possible_pairings	ORDER BY rank1, rank2;")
-    possible_pairs = c.fetchall()
-    conn.close()
-    return possible_pairs
+    players, played = loadPairingData(tournament)
+    return [(id1, name1, id2, name2)
+            for (id1, name1, byes1, rank1) in players
+            for (id2, name2, byes2, rank2) in players
+            if id1 != id2 and pairing.pairKey(id1, id2) not in played]
+
+
+@tournament_stats.timed
+def loadPairingData(tournament=DEFAULT_TOURNAMENT):
+    """Load everything the pairing engine needs in one go.
+
+    Returns:
+      A tuple (players, played):
+        players: a list of (id, name, byes, rank) tuples ordered by rank,
+          then rating.
+        played: a set of pairing.pairKey() tuples of players that have met.
+    """
+    return getBackend().loadPairingData(tournament)
+
+
+def _executeValues(c, sql, rows, fetch=False):
+    """Run sql for all rows in one statement with execute_values().
+
+    The statement is recorded by tournament_stats under sql, rather than
+    with the rows written into it.
+    """
+    with tournament_stats.statement(sql):
+        return psycopg2.extras.execute_values(c, sql, rows,
+                                              page_size=len(rows), fetch=fetch)
+
+
+def _standingsOrder(tiebreaks, prefix=''):
+    """Returns the ORDER BY list for standings ordered with tiebreaks.
+
+    tiebreaks must have been checked against TIEBREAKS, so they are safe to
+    use as column names.
+    """
+    return ', '.join(['%srank' % prefix] +
+                     ['%s%s DESC' % (prefix, tiebreak)
+                      for tiebreak in tiebreaks] +
+                     ['%sid' % prefix])
+
+
+class PostgresBackend(object):
+    """Stores tournaments in the PostgreSQL database set up by tournament.sql.
+
+    Connections come from the module's connection pool.
+    """
+
+    def createTournament(self, name):
+        with getCursor() as c:
+            c.execute("INSERT INTO tournaments (name) VALUES (%s) RETURNING id;",
+                      (name,))
+            return c.fetchone()[0]
+
+    def deleteTournament(self, tournament):
+        with getCursor() as c:
+            self._deleteRounds(c, tournament)
+            c.execute("DELETE FROM match_results WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM matches WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM standings WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM players WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM tournaments WHERE id = %s;", (tournament,))
+
+    def deleteMatches(self, tournament):
+        with getCursor() as c:
+            self._deleteRounds(c, tournament)
+            c.execute("DELETE FROM match_results WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM matches WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("""UPDATE standings SET wins = 0, draws = 0,
+                            opponent_wins = 0, played = 0, byes = 0, rank = 0,
+                            score = 0, buchholz = 0, median_buchholz = 0,
+                            sonneborn_berger = 0
+                            WHERE tournament_id = %s;""", (tournament,))
+
+    def deletePlayers(self, tournament):
+        with getCursor() as c:
+            self._deleteRounds(c, tournament)
+            c.execute("DELETE FROM standings WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("DELETE FROM players WHERE tournament_id = %s;",
+                      (tournament,))
+
+    def _deleteRounds(self, c, tournament):
+        for table in ('round_standings', 'round_pairings'):
+            c.execute("""DELETE FROM %s WHERE round_id IN
+                            (SELECT id FROM rounds WHERE tournament_id = %%s);"""
+                      % table, (tournament,))
+        c.execute("DELETE FROM rounds WHERE tournament_id = %s;", (tournament,))
+
+    def countPlayers(self, tournament):
+        with getCursor() as c:
+            c.execute("SELECT COUNT(id) FROM players WHERE tournament_id = %s;",
+                      (tournament,))
+            return c.fetchone()[0]
+
+    def countMatches(self, tournament):
+        with getCursor() as c:
+            c.execute("""SELECT COUNT(player1) FROM matches
+                            WHERE tournament_id = %s;""", (tournament,))
+            return c.fetchone()[0]
+
+    def registerPlayers(self, names, tournament, initial_ratings):
+        rows = list(zip([tournament] * len(names), names, initial_ratings))
+        sql = """WITH player AS (INSERT INTO players
+                                        (tournament_id, name, rating)
+                                    VALUES %s
+                                    RETURNING tournament_id, id, name)
+                 INSERT INTO standings (tournament_id, id, name)
+                    SELECT tournament_id, id, name FROM player
+                    RETURNING id;"""
+        with getCursor() as c:
+            ids = _executeValues(c, sql, rows, fetch=True)
+        return sorted(row[0] for row in ids)
+
+    def playerRatings(self, tournament):
+        with getCursor() as c:
+            c.execute("""SELECT id, name, rating FROM players
+                            WHERE tournament_id = %s
+                            ORDER BY rating DESC, id;""", (tournament,))
+            return c.fetchall()
+
+    def playerStandings(self, tournament, tiebreaks):
+        sql = """SELECT id, name, wins, draws, opponent_wins, played, byes, rank
+                    FROM standings WHERE tournament_id = %%s
+                    ORDER BY %s;""" % _standingsOrder(tiebreaks)
+        with getCursor() as c:
+            c.execute(sql, (tournament,))
+            return c.fetchall()
+
+    def iterStandings(self, tournament, tiebreaks, chunk_size):
+        sql = """SELECT id, name, wins, draws, opponent_wins, played, byes, rank
+                    FROM standings WHERE tournament_id = %%s
+                    ORDER BY %s;""" % _standingsOrder(tiebreaks)
+        with connect() as conn:
+            # A named cursor keeps the result on the server and fetches
+            # itersize rows per round trip as it is iterated.
+            c = conn.cursor('standings_stream')
+            c.itersize = chunk_size
+            try:
+                c.execute(sql, (tournament,))
+                for row in c:
+                    yield row
+            finally:
+                c.close()
+
+    def standingsPage(self, tournament, tiebreaks, limit, after, offset):
+        columns = ('rank',) + tiebreaks + ('id',)
+        where = ""
+        params = [tournament]
+        if after is not None:
+            # Rows after the cursor in (rank, tiebreaks DESC, id) order: equal
+            # on the first k columns and past the cursor on the next one.
+            terms = []
+            for k, column in enumerate(columns):
+                op = '<' if column in tiebreaks else '>'
+                terms.append('(%s)' % ' AND '.join(
+                    ['s.%s = %%s' % c for c in columns[:k]] +
+                    ['s.%s %s %%s' % (column, op)]))
+                params.extend(after[:k + 1])
+            where = "AND (%s)" % ' OR '.join(terms)
+        sql = """SELECT s.id, s.name, s.wins, s.draws, s.opponent_wins,
+                    s.played, s.byes, s.rank%s
+                    FROM standings s WHERE s.tournament_id = %%s %s
+                    ORDER BY %s LIMIT %%s OFFSET %%s;""" % (
+            ''.join(', s.%s' % tiebreak for tiebreak in tiebreaks), where,
+            _standingsOrder(tiebreaks, 's.'))
+        params.extend([limit + 1, offset])
+        with getCursor() as c:
+            c.execute(sql, params)
+            rows = c.fetchall()
+        cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            cursor = (last[7],) + tuple(last[8:]) + (last[0],)
+        return [row[:8] for row in rows[:limit]], cursor
+
+    def playerTiebreaks(self, tournament, tiebreaks):
+        sql = """SELECT id, score, opponent_wins, buchholz, median_buchholz,
+                    sonneborn_berger
+                    FROM standings WHERE tournament_id = %%s
+                    ORDER BY %s;""" % _standingsOrder(tiebreaks)
+        with getCursor() as c:
+            c.execute(sql, (tournament,))
+            return c.fetchall()
+
+    def reportMatches(self, results, players, tournament):
+        with getCursor() as c:
+            c.execute(LOCK_TOURNAMENT_SQL.format(tournament="%s"), (tournament,))
+            c.execute("""SELECT COUNT(id) FROM players
+                            WHERE tournament_id = %s AND id = ANY(%s);""",
+                      (tournament, list(players)))
+            if c.fetchone()[0] != len(players):
+                raise ValueError("Players in the round are not registered in "
+                                 "tournament %s." % tournament)
+            rematches = _executeValues(
+                c, """SELECT r.player_id, r.opponent_id FROM match_results r
+                        JOIN (VALUES %s) AS m (player1, player2)
+                        ON r.player_id = m.player1
+                        AND r.opponent_id = m.player2;""",
+                [(p1, p2) for (p1, p2, winner) in results], fetch=True)
+            if rematches:
+                raise ValueError("Players %s and %s have already played."
+                                 % rematches[0])
+            self._recordMatches(c, results, tournament)
+
+    def _recordMatches(self, c, results, tournament):
+        """Insert a round of matches and bring the standings table up to date.
+
+        Only the rows of the round's players and of their opponents are
+        touched.  Each step is a single statement however many matches there
+        are.
+        """
+        totals = roundTotals(results)
+        _executeValues(c, RECORD_MATCHES_SQL.format(matches="VALUES %s"),
+                       [(tournament,) + result for result in results])
+        _executeValues(c, UPDATE_TOTALS_SQL.format(totals="(VALUES %s)"),
+                       [(player,) + row for (player, row) in totals.items()])
+        c.execute(UPDATE_TIEBREAKS_SQL.format(players="%s"), (list(totals),))
+
+    def rebuildStandings(self, tournament):
+        with getCursor() as c:
+            c.execute("DELETE FROM standings WHERE tournament_id = %s;",
+                      (tournament,))
+            c.execute("""INSERT INTO standings (tournament_id, id, name, wins,
+                                draws, opponent_wins, played, byes, rank,
+                                score, buchholz, median_buchholz,
+                                sonneborn_berger)
+                            SELECT tournament_id, id, name, wins, draws,
+                                opponent_wins, played, byes, rank,
+                                score, buchholz, median_buchholz,
+                                sonneborn_berger
+                            FROM computed_standings WHERE tournament_id = %s;""",
+                      (tournament,))
+
+    def checkStandings(self, tournament):
+        sql = """SELECT COALESCE(s.id, v.id)
+                    FROM (SELECT * FROM standings WHERE tournament_id = %(t)s) s
+                    FULL OUTER JOIN
+                        (SELECT * FROM computed_standings
+                            WHERE tournament_id = %(t)s) v
+                    ON s.id = v.id
+                    WHERE (s.wins, s.draws, s.opponent_wins, s.played, s.byes,
+                           s.rank, s.score, s.buchholz, s.median_buchholz,
+                           s.sonneborn_berger)
+                        IS DISTINCT FROM
+                        (v.wins, v.draws, v.opponent_wins, v.played, v.byes,
+                         v.rank, v.score, v.buchholz, v.median_buchholz,
+                         v.sonneborn_berger)
+                    ORDER BY 1;"""
+        with getCursor() as c:
+            c.execute(sql, {'t': tournament})
+            return [row[0] for row in c.fetchall()]
+
+    def roundVersion(self, tournament):
+        with getCursor() as c:
+            return self._latestRound(c, tournament)
+
+    def _latestRound(self, c, tournament):
+        c.execute("""SELECT id, number, closed FROM rounds
+                        WHERE tournament_id = %s
+                        ORDER BY number DESC LIMIT 1;""", (tournament,))
+        return c.fetchone()
+
+    def startRound(self, tournament, pairs):
+        with getCursor() as c:
+            c.execute(LOCK_TOURNAMENT_SQL.format(tournament="%s"), (tournament,))
+            latest = self._latestRound(c, tournament)
+            if latest is not None and not latest[2]:
+                raise ValueError("Round %s of tournament %s hasn't been closed."
+                                 % (latest[1], tournament))
+            number = 1 if latest is None else latest[1] + 1
+            c.execute("""INSERT INTO rounds (tournament_id, number)
+                            VALUES (%s, %s) RETURNING id;""",
+                      (tournament, number))
+            round_id = c.fetchone()[0]
+            if pairs:
+                _executeValues(
+                    c, """INSERT INTO round_pairings
+                            (round_id, position, player1, player2) VALUES %s;""",
+                    [(round_id, position, id1, id2) for
+                     (position, (id1, name1, id2, name2)) in enumerate(pairs)])
+        return number
+
+    def closeRound(self, tournament, rate):
+        with getCursor() as c:
+            c.execute(LOCK_TOURNAMENT_SQL.format(tournament="%s"), (tournament,))
+            latest = self._latestRound(c, tournament)
+            if latest is None or latest[2]:
+                raise ValueError("Tournament %s has no open round." % tournament)
+            round_id, number = latest[0], latest[1]
+            # A bye's result row has opponent_id = player_id, so it matches
+            # the bye's pairing like any other.
+            c.execute("""SELECT p.player1, p.player2 FROM round_pairings p
+                            LEFT JOIN match_results r
+                            ON r.player_id = p.player1
+                            AND r.opponent_id = p.player2
+                            WHERE p.round_id = %s AND r.player_id IS NULL
+                            ORDER BY p.position;""", (round_id,))
+            missing = c.fetchall()
+            if missing:
+                raise ValueError("Round %s has no result for %s." % (
+                    number, ', '.join('%s v %s' % pair for pair in missing)))
+            c.execute("""INSERT INTO round_standings (round_id, position, id,
+                                name, wins, draws, opponent_wins, played, byes,
+                                rank)
+                            SELECT %(round)s, row_number() OVER
+                                (ORDER BY rank, opponent_wins DESC, id),
+                                id, name, wins, draws, opponent_wins, played,
+                                byes, rank
+                            FROM standings WHERE tournament_id = %(t)s;""",
+                      {'round': round_id, 't': tournament})
+            if rate is not None:
+                self._rateRound(c, round_id, rate)
+            c.execute("""UPDATE rounds SET closed = true, finished = now()
+                            WHERE id = %s;""", (round_id,))
+        return number
+
+    def _rateRound(self, c, round_id, rate):
+        """Update the ratings of a round's players in one statement."""
+        c.execute("""SELECT m.player1, m.player2, m.winner, a.rating, b.rating
+                        FROM round_pairings p
+                        JOIN match_results r ON r.player_id = p.player1
+                            AND r.opponent_id = p.player2
+                        JOIN matches m ON m.id = r.match_id
+                        JOIN players a ON a.id = m.player1
+                        JOIN players b ON b.id = m.player2
+                        WHERE p.round_id = %s;""", (round_id,))
+        rows = c.fetchall()
+        current = {}
+        for (player1, player2, winner, rating1, rating2) in rows:
+            current[player1] = rating1
+            current[player2] = rating2
+        new = rate(current, [row[:3] for row in rows])
+        if new:
+            _executeValues(c, """UPDATE players SET rating = d.rating
+                                    FROM (VALUES %s) AS d (id, rating)
+                                    WHERE players.id = d.id;""",
+                           list(new.items()))
+
+    def roundPairings(self, tournament, number):
+        with getCursor() as c:
+            c.execute("""SELECT p.player1, a.name, p.player2, b.name
+                            FROM rounds r
+                            JOIN round_pairings p ON p.round_id = r.id
+                            JOIN players a ON a.id = p.player1
+                            JOIN players b ON b.id = p.player2
+                            WHERE r.tournament_id = %s AND r.number = %s
+                            ORDER BY p.position;""", (tournament, number))
+            return c.fetchall()
+
+    def roundStandings(self, tournament, number):
+        with getCursor() as c:
+            c.execute("""SELECT s.id, s.name, s.wins, s.draws, s.opponent_wins,
+                                s.played, s.byes, s.rank
+                            FROM rounds r
+                            JOIN round_standings s ON s.round_id = r.id
+                            WHERE r.tournament_id = %s AND r.number = %s
+                            ORDER BY s.position;""", (tournament, number))
+            return c.fetchall()
+
+    def loadPairingData(self, tournament):
+        with getCursor() as c:
+            c.execute("""SELECT s.id, s.name, s.byes, s.rank FROM standings s
+                            JOIN players p ON p.id = s.id
+                            WHERE s.tournament_id = %s
+                            ORDER BY s.rank, p.rating DESC,
+                                s.opponent_wins DESC, s.id;""",
+                      (tournament,))
+            players = c.fetchall()
+            c.execute("""SELECT player_id, opponent_id FROM match_results
+                            WHERE tournament_id = %s
+                            AND player_id < opponent_id;""", (tournament,))
+            played = set(c.fetchall())
+        return players, played
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the tournament database.")
+    parser.add_argument('command', choices=['rebuild', 'check'],
+                        help="rebuild or check the standings table")
+    parser.add_argument('--tournament', type=int, default=DEFAULT_TOURNAMENT,
+                        help="the id of the tournament")
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        rebuildStandings(args.tournament)
+        print("Standings rebuilt.")
+    else:
+        wrong = checkStandings(args.tournament)
+        if wrong:
+            raise SystemExit("Standings are wrong for players: %s"
+                             % ', '.join(str(i) for i in wrong))
+        print("Standings are consistent.")
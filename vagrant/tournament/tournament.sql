@@ -7,11 +7,29 @@ CREATE DATABASE tournament;
 \c tournament;
 
 
+-- Create tournaments table.
+-- Every player, match and standings row belongs to a tournament, and each
+-- table is indexed on tournament_id first, so reading one event's standings
+-- or pairing data only touches that event's rows however many other events
+-- are in the database.
+CREATE TABLE tournaments (
+	id serial PRIMARY KEY,
+	name text
+);
+-- The default tournament, used by tournament.py when no id is given.
+INSERT INTO tournaments (name) VALUES ('Tournament');
+
+
 -- Create players table.
+-- rating seeds the player within their score group when pairing, and is
+-- updated by ratings.py as each round is closed.
 CREATE TABLE players (
 	id serial PRIMARY KEY,
-	name text
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	name text,
+	rating double precision NOT NULL DEFAULT 1500
 );
+CREATE INDEX players_tournament_idx ON players (tournament_id);
 
 
 -- Create matches table.
@@ -19,48 +37,138 @@ CREATE TABLE players (
 -- A bye can be recorded for a player by inserting a row with columns player1 = player2 = winner = player
 -- A draw can be recorded for a match by setting the column winner = null
 CREATE TABLE matches (
+	id serial PRIMARY KEY,
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
 	player1 integer REFERENCES players (id),
 	player2 integer REFERENCES players (id),
 	winner integer REFERENCES players (id),
-	PRIMARY KEY (player1, player2)
+	UNIQUE (player1, player2)
+);
+CREATE INDEX matches_tournament_idx ON matches (tournament_id);
+
+
+-- Create match results table.
+-- Holds one row per player per match, written with the matches row, so a
+-- player's matches and opponents are found with an index scan on player_id
+-- rather than by joining matches on player1 OR player2.
+-- A bye is recorded as a single row with opponent_id = player_id.
+-- The primary key also stops two players being paired, or a player being
+-- given a bye, twice.
+CREATE TABLE match_results (
+	player_id integer NOT NULL REFERENCES players (id),
+	opponent_id integer NOT NULL REFERENCES players (id),
+	match_id integer NOT NULL REFERENCES matches (id),
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	win integer NOT NULL,
+	draw integer NOT NULL,
+	bye integer NOT NULL,
+	PRIMARY KEY (player_id, opponent_id)
+);
+CREATE INDEX match_results_tournament_idx ON match_results (tournament_id);
+CREATE INDEX match_results_match_idx ON match_results (match_id);
+
+
+-- Create standings table.
+-- Holds the same columns as the computed_standings view below, but is kept
+-- up to date by tournament.py in the same transaction that records a match,
+-- so reading the standings doesn't aggregate the matches table.
+-- tournament.py rebuild recomputes it from the match_results table.
+CREATE TABLE standings (
+	id integer PRIMARY KEY REFERENCES players (id),
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	name text,
+	wins integer NOT NULL DEFAULT 0,
+	draws integer NOT NULL DEFAULT 0,
+	opponent_wins integer NOT NULL DEFAULT 0,
+	played integer NOT NULL DEFAULT 0,
+	byes integer NOT NULL DEFAULT 0,
+	rank double precision NOT NULL DEFAULT 0,
+	score double precision NOT NULL DEFAULT 0,
+	buchholz double precision NOT NULL DEFAULT 0,
+	median_buchholz double precision NOT NULL DEFAULT 0,
+	sonneborn_berger double precision NOT NULL DEFAULT 0
+);
+CREATE INDEX standings_rank_idx
+	ON standings (tournament_id, rank, opponent_wins DESC, id);
+
+
+-- Create rounds table.
+-- A round is started with its pairings and closed once every pairing has
+-- a result, numbered from 1 within its tournament.  The latest round's id
+-- and closed flag are the version tournament.py caches the round's
+-- pairings and standings under.
+CREATE TABLE rounds (
+	id serial PRIMARY KEY,
+	tournament_id integer NOT NULL REFERENCES tournaments (id),
+	number integer NOT NULL,
+	closed boolean NOT NULL DEFAULT false,
+	started timestamp NOT NULL DEFAULT now(),
+	finished timestamp,
+	UNIQUE (tournament_id, number)
+);
+
+
+-- Create round pairings table.
+-- The pairings a round was started with, in the order swissPairings()
+-- returned them.  A bye is paired as player1 = player2.
+CREATE TABLE round_pairings (
+	round_id integer NOT NULL REFERENCES rounds (id),
+	position integer NOT NULL,
+	player1 integer NOT NULL REFERENCES players (id),
+	player2 integer NOT NULL REFERENCES players (id),
+	PRIMARY KEY (round_id, position)
+);
+
+
+-- Create round standings table.
+-- A copy of the standings taken when a round is closed, in standings order,
+-- so the standings after any round can be read back without recomputing.
+CREATE TABLE round_standings (
+	round_id integer NOT NULL REFERENCES rounds (id),
+	position integer NOT NULL,
+	id integer NOT NULL REFERENCES players (id),
+	name text,
+	wins integer NOT NULL,
+	draws integer NOT NULL,
+	opponent_wins integer NOT NULL,
+	played integer NOT NULL,
+	byes integer NOT NULL,
+	rank double precision NOT NULL,
+	PRIMARY KEY (round_id, position)
 );
 
 
 -- Create player win count view.
 CREATE VIEW player_wins AS
-	SELECT players.id, players.name, COUNT(matches.winner) AS wins
+	SELECT players.id, players.name, COALESCE(SUM(match_results.win), 0) AS wins
 	FROM players 
-	LEFT OUTER JOIN matches ON players.id = matches.winner
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
 	GROUP BY players.id;
 
 
 -- Create player draw count view.
--- A draw is recorded in the matches tables by setting winner = null
 CREATE VIEW player_draws AS
-	SELECT players.id, players.name, COUNT(matches.player1) AS draws
+	SELECT players.id, players.name, COALESCE(SUM(match_results.draw), 0) AS draws
 	FROM players 
-	LEFT OUTER JOIN matches 
-	ON (players.id = matches.player1 OR players.id = matches.player2) AND matches.winner IS NULL
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
 	GROUP BY players.id;
 
 
 -- Create player match count view.
 CREATE VIEW player_matches AS
-	SELECT players.id, players.name, COUNT(matches.player1 + matches.player2) AS played
+	SELECT players.id, players.name, COUNT(match_results.match_id) AS played
 	FROM players 
-	LEFT OUTER JOIN matches ON players.id = matches.player1 OR players.id = matches.player2
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
 	GROUP BY players.id;
 
 
 -- Create player opponents view.
 -- Ignore bye rows.
 CREATE VIEW player_opponents AS
-	SELECT players.id, players.name, 
-	CASE WHEN players.id = matches.player1 THEN matches.player2 ELSE matches.player1 END AS opponent_id
+	SELECT players.id, players.name, match_results.opponent_id
 	FROM players 
-	JOIN matches 
-	ON players.id = matches.player1 OR players.id = matches.player2
-	WHERE matches.player1 != matches.player2;
+	JOIN match_results ON players.id = match_results.player_id
+	WHERE match_results.bye = 0;
 
 
 -- Create player opponent win count view.
@@ -74,39 +182,61 @@ CREATE VIEW player_opponent_wins AS
 
 	
 -- Create player bye count view.
--- A player bye is recorded in the matches table as player = player1 = player2 = winner.
 CREATE VIEW player_byes AS
-	SELECT players.id, players.name, COUNT(matches.player1) AS byes
+	SELECT players.id, players.name, COALESCE(SUM(match_results.bye), 0) AS byes
 	FROM players 
-	LEFT OUTER JOIN matches ON players.id = matches.player1 AND players.id = matches.player2
+	LEFT OUTER JOIN match_results ON players.id = match_results.player_id
 	GROUP BY players.id;
 
 
--- Create player standings view.
+-- Create player score view.
+-- A win, including a bye, scores one point and a draw half a point.
+CREATE VIEW player_scores AS
+	SELECT player_wins.id, player_wins.name,
+	(player_wins.wins + player_draws.draws::float / 2) AS score
+	FROM player_wins
+	JOIN player_draws ON player_wins.id = player_draws.id;
+
+
+-- Create player tiebreaks view.
+-- buchholz is the sum of the player's opponents' scores,
+-- median_buchholz leaves out the highest and lowest of them when there are
+-- more than two opponents,
+-- sonneborn_berger is the sum of the scores of the opponents the player
+-- beat, plus half the scores of the opponents the player drew with.
+-- Ignore bye rows.
+CREATE VIEW player_tiebreaks AS
+	SELECT players.id, players.name,
+	COALESCE(SUM(player_scores.score), 0) AS buchholz,
+	CASE WHEN COUNT(player_scores.id) > 2
+		THEN SUM(player_scores.score) - MAX(player_scores.score) - MIN(player_scores.score)
+		ELSE COALESCE(SUM(player_scores.score), 0) END AS median_buchholz,
+	COALESCE(SUM(CASE WHEN match_results.win = 1 THEN player_scores.score
+		WHEN match_results.draw = 1 THEN player_scores.score / 2
+		ELSE 0 END), 0) AS sonneborn_berger
+	FROM players
+	LEFT OUTER JOIN match_results
+	ON players.id = match_results.player_id AND match_results.bye = 0
+	LEFT OUTER JOIN player_scores ON match_results.opponent_id = player_scores.id
+	GROUP BY players.id;
+
+
+-- Create computed player standings view.
 -- Player rank is defined as matches played by player - player wins - player draws / 2
 -- so 0 is the highest rank
-CREATE VIEW standings AS
-	SELECT players.id, players.name, 
+-- Used to rebuild and check the standings table.
+CREATE VIEW computed_standings AS
+	SELECT players.id, players.tournament_id, players.name, 
 	player_wins.wins, player_draws.draws, player_opponent_wins.opponent_wins,
 	player_matches.played, player_byes.byes,
-	(player_matches.played - player_wins.wins - player_draws.draws::float / 2) AS rank
+	(player_matches.played - player_wins.wins - player_draws.draws::float / 2) AS rank,
+	player_scores.score, player_tiebreaks.buchholz,
+	player_tiebreaks.median_buchholz, player_tiebreaks.sonneborn_berger
 	FROM players 
 	JOIN player_wins ON players.id = player_wins.id
 	JOIN player_draws ON players.id = player_draws.id
 	JOIN player_opponent_wins ON players.id = player_opponent_wins.id
 	JOIN player_matches ON players.id = player_matches.id
-	JOIN player_byes ON players.id = player_byes.id;
-
-
--- Create possible pairings view.
--- Only return pairings that have not already played each other.
-CREATE VIEW possible_pairings AS
-	SELECT a.id AS id1, a.name AS name1, a.rank AS rank1,
-	b.id AS id2, b.name AS name2, b.rank AS rank2 
-	FROM standings a 
-	CROSS JOIN standings b 
-	WHERE a.id != b.id
-	AND b.id NOT IN (SELECT matches.player2 FROM matches WHERE matches.player1 = a.id)
-	AND b.id NOT IN (SELECT matches.player1 FROM matches WHERE matches.player2 = a.id);
-
-
+	JOIN player_byes ON players.id = player_byes.id
+	JOIN player_scores ON players.id = player_scores.id
+	JOIN player_tiebreaks ON players.id = player_tiebreaks.id;
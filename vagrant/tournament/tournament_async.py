@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio version of the tournament.py API
+#
+# Runs the same statements as tournament.py's PostgreSQL backend through an
+# asyncpg connection pool, so many results can be submitted at once without
+# a thread per submission.  Needs Python 3.5+ and asyncpg, which the VM has
+# as python3.6:
+#
+#   import asyncio, tournament_async
+#   async def main():
+#       await tournament_async.report_match(1, 2, 1)
+#       print(await tournament_async.player_standings())
+#   asyncio.get_event_loop().run_until_complete(main())
+#
+
+import asyncio
+
+import asyncpg
+
+import pairing
+import tournament
+from tournament import DEFAULT_TOURNAMENT, DEFAULT_TIEBREAKS
+
+
+# Database connection settings, change them with configure_pool().
+DSN = "postgresql:///tournament"
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+
+_pool = None
+# Made by _get_pool_lock(), as before Python 3.10 a lock belongs to the
+# event loop current when it is made, which need not be the one it runs in.
+_pool_lock = None
+
+
+def configure_pool(dsn=None, min_size=None, max_size=None):
+    """Set the connection settings used when the pool is next created.
+
+    Call close_pool() first to replace a pool that is already open.
+
+    Args:
+      dsn: the asyncpg connection string.
+      min_size: the number of connections kept open in the pool.
+      max_size: the maximum number of connections the pool will open.
+    """
+    global DSN, POOL_MIN_SIZE, POOL_MAX_SIZE
+    if dsn is not None:
+        DSN = dsn
+    if min_size is not None:
+        POOL_MIN_SIZE = min_size
+    if max_size is not None:
+        POOL_MAX_SIZE = max_size
+
+
+def _get_pool_lock():
+    """Returns the lock guarding the pool, making it on first use."""
+    global _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    return _pool_lock
+
+
+async def get_pool():
+    """Returns the connection pool, creating it on first use."""
+    global _pool
+    async with _get_pool_lock():
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DSN, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE)
+        return _pool
+
+
+async def close_pool():
+    """Close all the connections in the pool."""
+    global _pool
+    async with _get_pool_lock():
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+async def create_tournament(name):
+    """Adds a tournament to the database, see tournament.createTournament()."""
+    pool = await get_pool()
+    return await pool.fetchval(
+        "INSERT INTO tournaments (name) VALUES ($1) RETURNING id;", name)
+
+
+async def delete_tournament(tournament_id):
+    """Remove a tournament, with all its players and matches."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _delete_rounds(conn, tournament_id)
+            for table in ('match_results', 'matches', 'standings', 'players'):
+                await conn.execute(
+                    "DELETE FROM %s WHERE tournament_id = $1;" % table,
+                    tournament_id)
+            await conn.execute("DELETE FROM tournaments WHERE id = $1;",
+                               tournament_id)
+
+
+async def delete_matches(tournament_id=DEFAULT_TOURNAMENT):
+    """Remove all the match records of a tournament."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _delete_rounds(conn, tournament_id)
+            await conn.execute(
+                "DELETE FROM match_results WHERE tournament_id = $1;",
+                tournament_id)
+            await conn.execute("DELETE FROM matches WHERE tournament_id = $1;",
+                               tournament_id)
+            await conn.execute(
+                """UPDATE standings SET wins = 0, draws = 0,
+                    opponent_wins = 0, played = 0, byes = 0, rank = 0,
+                    score = 0, buchholz = 0, median_buchholz = 0,
+                    sonneborn_berger = 0
+                    WHERE tournament_id = $1;""", tournament_id)
+
+
+async def delete_players(tournament_id=DEFAULT_TOURNAMENT):
+    """Remove all the player records of a tournament."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await _delete_rounds(conn, tournament_id)
+            await conn.execute(
+                "DELETE FROM standings WHERE tournament_id = $1;",
+                tournament_id)
+            await conn.execute("DELETE FROM players WHERE tournament_id = $1;",
+                               tournament_id)
+
+
+async def _delete_rounds(conn, tournament_id):
+    for table in ('round_standings', 'round_pairings'):
+        await conn.execute(
+            """DELETE FROM %s WHERE round_id IN
+                (SELECT id FROM rounds WHERE tournament_id = $1);""" % table,
+            tournament_id)
+    await conn.execute("DELETE FROM rounds WHERE tournament_id = $1;",
+                       tournament_id)
+
+
+async def count_players(tournament_id=DEFAULT_TOURNAMENT):
+    """Returns the number of players currently registered."""
+    pool = await get_pool()
+    return await pool.fetchval(
+        "SELECT COUNT(id) FROM players WHERE tournament_id = $1;",
+        tournament_id)
+
+
+async def count_matches(tournament_id=DEFAULT_TOURNAMENT):
+    """Returns the number of matches played."""
+    pool = await get_pool()
+    return await pool.fetchval(
+        "SELECT COUNT(player1) FROM matches WHERE tournament_id = $1;",
+        tournament_id)
+
+
+async def register_player(name, tournament_id=DEFAULT_TOURNAMENT):
+    """Adds a player to the tournament, see tournament.registerPlayer().
+
+    Returns:
+      The new player's id.
+    """
+    return (await register_players([name], tournament_id))[0]
+
+
+async def register_players(names, tournament_id=DEFAULT_TOURNAMENT):
+    """Adds many players to the tournament in one statement.
+
+    Returns:
+      A list of the new players' ids.
+    """
+    names = list(names)
+    if not names:
+        return []
+    pool = await get_pool()
+    rows = await pool.fetch(
+        """WITH player AS (INSERT INTO players (tournament_id, name)
+                            SELECT $1, unnest($2::text[])
+                            RETURNING tournament_id, id, name)
+           INSERT INTO standings (tournament_id, id, name)
+              SELECT tournament_id, id, name FROM player
+              RETURNING id;""", tournament_id, names)
+    return sorted(row[0] for row in rows)
+
+
+async def player_standings(tournament_id=DEFAULT_TOURNAMENT,
+                           tiebreaks=DEFAULT_TIEBREAKS):
+    """Returns the standings, see tournament.playerStandings().
+
+    Returns:
+      A list of (id, name, wins, draws, opponent_wins, played, byes, rank)
+      tuples, first place first.
+    """
+    # checkTiebreaks() limits tiebreaks to column names from TIEBREAKS.
+    sql = """SELECT id, name, wins, draws, opponent_wins, played, byes, rank
+                FROM standings WHERE tournament_id = $1
+                ORDER BY rank, %s id;""" % ''.join(
+        '%s DESC, ' % tiebreak
+        for tiebreak in tournament.checkTiebreaks(tiebreaks))
+    pool = await get_pool()
+    return [tuple(row) for row in await pool.fetch(sql, tournament_id)]
+
+
+async def report_match(player1, player2, winner=None,
+                       tournament_id=DEFAULT_TOURNAMENT):
+    """Records the outcome of a single match, see tournament.reportMatch()."""
+    await report_matches([(player1, player2, winner)], tournament_id)
+
+
+async def report_matches(results, tournament_id=DEFAULT_TOURNAMENT):
+    """Records the outcomes of a round of matches in one transaction.
+
+    Checks and records the round exactly as tournament.reportMatches() does.
+    Submissions for the same tournament are written one at a time, waiting
+    on the database rather than blocking the event loop; submissions for
+    different tournaments run in parallel.
+
+    Raises:
+      ValueError: if a player appears twice in the round or isn't in the
+        tournament, a winner didn't play in the match, or two players have
+        already played each other.
+    """
+    results = [tuple(result) for result in results]
+    if not results:
+        return
+    players = tournament.checkRound(results)
+    totals = tournament.roundTotals(results)
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                tournament.LOCK_TOURNAMENT_SQL.format(tournament="$1"),
+                tournament_id)
+            count = await conn.fetchval(
+                """SELECT COUNT(id) FROM players
+                    WHERE tournament_id = $1 AND id = ANY($2::integer[]);""",
+                tournament_id, list(players))
+            if count != len(players):
+                raise ValueError("Players in the round are not registered in "
+                                 "tournament %s." % tournament_id)
+            player1s, player2s, winners = (list(column)
+                                           for column in zip(*results))
+            # The arrays are unnested side by side in a select list, as
+            # unnest() of several arrays at once needs PostgreSQL 9.4.
+            rematch = await conn.fetchrow(
+                """SELECT r.player_id, r.opponent_id FROM match_results r
+                    JOIN (SELECT unnest($1::integer[]) AS player1,
+                                 unnest($2::integer[]) AS player2) AS m
+                    ON r.player_id = m.player1 AND r.opponent_id = m.player2
+                    LIMIT 1;""", player1s, player2s)
+            if rematch is not None:
+                raise ValueError("Players %s and %s have already played."
+                                 % tuple(rematch))
+            await conn.execute(
+                tournament.RECORD_MATCHES_SQL.format(
+                    matches="SELECT $1::integer, unnest($2::integer[]), "
+                            "unnest($3::integer[]), unnest($4::integer[])"),
+                tournament_id, player1s, player2s, winners)
+            ids = list(totals)
+            columns = [list(column) for column in zip(*totals.values())]
+            await conn.execute(
+                tournament.UPDATE_TOTALS_SQL.format(
+                    totals="(SELECT unnest($1::integer[]), "
+                           "unnest($2::integer[]), unnest($3::integer[]), "
+                           "unnest($4::integer[]), unnest($5::integer[]))"),
+                ids, *columns)
+            await conn.execute(
+                tournament.UPDATE_TIEBREAKS_SQL.format(
+                    players="$1::integer[]"), ids)
+
+
+async def swiss_pairings(tournament_id=DEFAULT_TOURNAMENT,
+                         timeout=pairing.DEFAULT_TIMEOUT):
+    """Returns the pairs for the next round, see tournament.swissPairings().
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples.
+    """
+    return (await swiss_pairing_result(tournament_id, timeout)).pairs
+
+
+async def swiss_pairing_result(tournament_id=DEFAULT_TOURNAMENT,
+                               timeout=pairing.DEFAULT_TIMEOUT):
+    """Pair the next round as swiss_pairings() does, with search statistics.
+
+    The search runs in the loop's default executor, so other submissions
+    are still served while a large field is being paired.
+
+    Returns:
+      A pairing.PairingResult.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            players = [tuple(row) for row in await conn.fetch(
+                """SELECT s.id, s.name, s.byes, s.rank FROM standings s
+                    JOIN players p ON p.id = s.id
+                    WHERE s.tournament_id = $1
+                    ORDER BY s.rank, p.rating DESC, s.opponent_wins DESC,
+                        s.id;""", tournament_id)]
+            played = set(tuple(row) for row in await conn.fetch(
+                """SELECT player_id, opponent_id FROM match_results
+                    WHERE tournament_id = $1 AND player_id < opponent_id;""",
+                tournament_id))
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, pairing.solvePairings,
+                                      pairing.slideSeed(players), played,
+                                      timeout)
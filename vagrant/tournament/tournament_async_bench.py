@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#
+# tournament_async_bench.py -- compare result submission throughput of
+# tournament.py and tournament_async.py
+#
+# Pairs a round of a fresh tournament and has every table submit its result
+# at once, first through tournament.reportMatch() from a pool of threads and
+# then through tournament_async.report_match() from one event loop.  Reports
+# submissions per second and submit latency percentiles as JSON:
+#
+#   python3.6 tournament_async_bench.py --players 512 --concurrency 1 16 256
+#
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import platform
+import random
+import sys
+import time
+
+import tournament
+import tournament_async
+from tournament_bench import percentile, playMatch
+
+
+def _summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'submits': len(latencies),
+        'elapsed_s': elapsed,
+        'submits_per_s': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p90_ms': 1000 * percentile(latencies, 90),
+        'p99_ms': 1000 * percentile(latencies, 99),
+        'max_ms': 1000 * latencies[-1],
+    }
+
+
+def _newRound(players, draw_rate):
+    """Create a tournament and pair its first round with tournament.py.
+
+    Returns:
+      A tuple (tournament id, list of (player1, player2, winner) results).
+    """
+    t = tournament.createTournament("Submit benchmark")
+    tournament.registerPlayers(["Player%05d" % x for x in range(players)], t)
+    results = [playMatch(id1, id2, draw_rate)
+               for (id1, name1, id2, name2) in tournament.swissPairings(t)]
+    return t, results
+
+
+def benchSync(players, concurrency, draw_rate):
+    """Submit a round with tournament.reportMatch() from threads."""
+    t, results = _newRound(players, draw_rate)
+    try:
+        def submit(result):
+            start = time.time()
+            tournament.reportMatch(result[0], result[1], result[2], t)
+            return time.time() - start
+
+        # Threads beyond POOL_MAX_SIZE wait in connect() for a connection,
+        # as tasks beyond the asyncpg pool's size wait in acquire().
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(submit, results))
+        return _summary(latencies, time.time() - start)
+    finally:
+        tournament.deleteTournament(t)
+
+
+async def benchAsync(players, concurrency, draw_rate):
+    """Submit a round with tournament_async.report_match() from tasks."""
+    t, results = _newRound(players, draw_rate)
+    try:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def submit(result):
+            async with semaphore:
+                start = time.time()
+                await tournament_async.report_match(
+                    result[0], result[1], result[2], t)
+                return time.time() - start
+
+        await tournament_async.get_pool()
+        start = time.time()
+        latencies = await asyncio.gather(*[submit(r) for r in results])
+        return _summary(latencies, time.time() - start)
+    finally:
+        tournament.deleteTournament(t)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare result submission throughput of tournament.py "
+                    "and tournament_async.py.")
+    parser.add_argument('--players', type=int, default=512,
+                        help="players in each benchmark tournament")
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 16, 256],
+                        help="numbers of submissions in flight at once")
+    parser.add_argument('--connections', type=int, default=10,
+                        help="database connections each module may open")
+    parser.add_argument('--draw-rate', type=float, default=0.1,
+                        help="chance of a match being drawn")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="random seed, for repeatable runs")
+    parser.add_argument('--output', default=None,
+                        help="file to write the JSON results to")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    tournament.configurePool(maxconn=args.connections)
+    tournament_async.configure_pool(max_size=args.connections)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runs = []
+    try:
+        for concurrency in args.concurrency:
+            runs.append({
+                'concurrency': concurrency,
+                'sync': benchSync(args.players, concurrency, args.draw_rate),
+                'async': loop.run_until_complete(
+                    benchAsync(args.players, concurrency, args.draw_rate)),
+            })
+    finally:
+        loop.run_until_complete(tournament_async.close_pool())
+        tournament.closePool()
+
+    text = json.dumps({
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': {
+            'players': args.players,
+            'connections': args.connections,
+            'draw_rate': args.draw_rate,
+            'seed': args.seed,
+        },
+        'runs': runs,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
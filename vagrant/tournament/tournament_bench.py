@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- benchmark tournament.py with simulated tournaments
+#
+# Plays random tournaments through the public tournament.py functions and
+# reports per call latency percentiles, database queries per call and how
+# often pairing fails, as JSON so runs can be compared between versions.
+#
+#   python tournament_bench.py --players 16 256 4096 --tournaments 3 \
+#       --output bench.json
+#
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import pairing
+import tournament
+import tournament_stats
+
+
+# The calls timed, in the order they are reported.
+CALLS = ['registerPlayers', 'swissPairings', 'reportMatch', 'reportMatches',
+         'playerStandings']
+
+
+class Recorder(object):
+    """Collects the latency and query count of each call made."""
+
+    def __init__(self):
+        self.times = dict((call, []) for call in CALLS)
+        self.queries = dict((call, 0) for call in CALLS)
+
+    def call(self, name, function, *args):
+        queries = tournament_stats.queryCount()
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.times[name].append(time.time() - start)
+            self.queries[name] += tournament_stats.queryCount() - queries
+
+    def summary(self):
+        """Returns the latency percentiles and query counts of each call."""
+        calls = {}
+        for name in CALLS:
+            times = sorted(self.times[name])
+            if not times:
+                continue
+            calls[name] = {
+                'count': len(times),
+                'mean_ms': 1000 * sum(times) / len(times),
+                'p50_ms': 1000 * percentile(times, 50),
+                'p90_ms': 1000 * percentile(times, 90),
+                'p99_ms': 1000 * percentile(times, 99),
+                'max_ms': 1000 * times[-1],
+                'queries': self.queries[name],
+                'queries_per_call': float(self.queries[name]) / len(times),
+            }
+        return calls
+
+
+def percentile(values, percent):
+    """Returns the nearest rank percentile of a sorted list of values."""
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def playTournament(recorder, stats, players, rounds, draw_rate, batch,
+                   timeout):
+    """Play one random tournament through the tournament module.
+
+    Args:
+      recorder: the Recorder timing the calls.
+      stats: a dict of pairing counts to add to.
+      players: the number of players.
+      rounds: the number of rounds to play.
+      draw_rate: the chance of a match being drawn.
+      batch: report each round with reportMatches() rather than reportMatch().
+      timeout: the pairing search timeout in seconds.
+    """
+    t = tournament.createTournament("Benchmark %d" % players)
+    try:
+        recorder.call('registerPlayers', tournament.registerPlayers,
+                      ["Player%05d" % x for x in range(players)], t)
+        for x in range(rounds):
+            stats['rounds'] += 1
+            try:
+                result = recorder.call('swissPairings',
+                                       tournament.swissPairingResult, t,
+                                       timeout)
+            except pairing.PairingTimeout:
+                stats['timeouts'] += 1
+                stats['failures'] += 1
+                return
+            except pairing.PairingError:
+                stats['failures'] += 1
+                return
+            stats['nodes'].append(result.nodes)
+            results = [playMatch(id1, id2, draw_rate)
+                       for (id1, name1, id2, name2) in result.pairs]
+            if batch:
+                recorder.call('reportMatches', tournament.reportMatches,
+                              results, t)
+            else:
+                for (id1, id2, winner) in results:
+                    recorder.call('reportMatch', tournament.reportMatch,
+                                  id1, id2, winner, t)
+            recorder.call('playerStandings', tournament.playerStandings, t)
+    finally:
+        tournament.deleteTournament(t)
+
+
+def playMatch(id1, id2, draw_rate):
+    """Returns a random (player1, player2, winner) result for a pairing."""
+    if id1 == id2:
+        return (id1, id2, id1)
+    if random.random() < draw_rate:
+        return (id1, id2, None)
+    return (id1, id2, random.choice((id1, id2)))
+
+
+def benchmark(sizes, tournaments, rounds, draw_rate, odd_rate, batch,
+              timeout):
+    """Benchmark tournaments of each size.
+
+    Returns:
+      A list of dicts, one per size, of call and pairing statistics.
+    """
+    report = []
+    for players in sizes:
+        recorder = Recorder()
+        stats = {'rounds': 0, 'failures': 0, 'timeouts': 0, 'nodes': []}
+        played = rounds or int(math.ceil(math.log(players, 2)))
+        for x in range(tournaments):
+            count = players
+            if random.random() < odd_rate:
+                # An odd field means a bye every round.
+                count += 1
+            playTournament(recorder, stats, count, played, draw_rate, batch,
+                           timeout)
+        nodes = sorted(stats['nodes'])
+        report.append({
+            'players': players,
+            'tournaments': tournaments,
+            'rounds': played,
+            'calls': recorder.summary(),
+            'pairing': {
+                'rounds': stats['rounds'],
+                'failures': stats['failures'],
+                'timeouts': stats['timeouts'],
+                'failure_rate': (float(stats['failures']) / stats['rounds']
+                                 if stats['rounds'] else 0.0),
+                'nodes_p50': percentile(nodes, 50) if nodes else None,
+                'nodes_max': nodes[-1] if nodes else None,
+            },
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark tournament.py with simulated tournaments.")
+    parser.add_argument('--players', type=int, nargs='+',
+                        default=[16, 64, 256, 1024],
+                        help="player counts to benchmark, 16 to 50000")
+    parser.add_argument('--tournaments', type=int, default=3,
+                        help="tournaments to play at each player count")
+    parser.add_argument('--rounds', type=int, default=None,
+                        help="rounds per tournament, default log2(players)")
+    parser.add_argument('--draw-rate', type=float, default=0.1,
+                        help="chance of a match being drawn")
+    parser.add_argument('--odd-rate', type=float, default=0.5,
+                        help="chance of an odd field, giving a bye a round")
+    parser.add_argument('--per-match', action='store_true',
+                        help="report matches one at a time with reportMatch()")
+    parser.add_argument('--timeout', type=float,
+                        default=pairing.DEFAULT_TIMEOUT,
+                        help="pairing search timeout in seconds")
+    parser.add_argument('--backend', choices=['postgres', 'memory'],
+                        default='postgres', help="storage backend to use")
+    parser.add_argument('--stats', action='store_true',
+                        help="include tournament_stats timings of every "
+                             "function and statement")
+    parser.add_argument('--explain', action='store_true',
+                        help="with --stats, capture EXPLAIN ANALYZE plans")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="random seed, for repeatable runs")
+    parser.add_argument('--label', default=None,
+                        help="label stored with the results, e.g. a version")
+    parser.add_argument('--output', default=None,
+                        help="file to write the JSON results to")
+    args = parser.parse_args(argv)
+
+    for players in args.players:
+        if players < 2 or players > 50000:
+            parser.error("Player counts should be between 2 and 50000.")
+
+    random.seed(args.seed)
+    if args.backend == 'memory':
+        import tournament_memory
+        tournament.setBackend(tournament_memory.MemoryBackend())
+    # Statement counts come from tournament_stats, so it is always on.
+    tournament_stats.enable(explain_plans=args.stats and args.explain)
+
+    results = {
+        'label': args.label,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'settings': {
+            'tournaments': args.tournaments,
+            'rounds': args.rounds,
+            'draw_rate': args.draw_rate,
+            'odd_rate': args.odd_rate,
+            'batch': not args.per_match,
+            'timeout': args.timeout,
+            'seed': args.seed,
+        },
+        'sizes': benchmark(args.players, args.tournaments, args.rounds,
+                           args.draw_rate, args.odd_rate, not args.per_match,
+                           args.timeout),
+    }
+    if args.stats:
+        results['stats'] = tournament_stats.snapshot()
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
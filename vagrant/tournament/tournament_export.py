@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# tournament_export.py -- export tournament standings as CSV or JSON Lines
+#
+# Streams the standings through tournament.iterStandings(), so the export
+# uses the same memory for a club night as for an open with 50000 players:
+#
+#   python tournament_export.py --tournament 3 --format jsonl \
+#       --output standings.jsonl
+#
+
+import argparse
+import collections
+import csv
+import json
+import sys
+
+import tournament
+
+
+# The columns of a playerStandings() row.
+COLUMNS = ('id', 'name', 'wins', 'draws', 'opponent_wins', 'played', 'byes',
+           'rank')
+FORMATS = ('csv', 'jsonl')
+
+
+def writeCsv(f, rows):
+    """Write standings rows to a file as CSV, with a header line.
+
+    Returns:
+      The number of rows written.
+    """
+    writer = csv.writer(f)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def writeJsonLines(f, rows):
+    """Write standings rows to a file as JSON objects, one per line.
+
+    Returns:
+      The number of rows written.
+    """
+    count = 0
+    for row in rows:
+        f.write(json.dumps(collections.OrderedDict(zip(COLUMNS, row))) + '\n')
+        count += 1
+    return count
+
+
+def exportStandings(f, format='csv',
+                    tournament_id=tournament.DEFAULT_TOURNAMENT,
+                    tiebreaks=tournament.DEFAULT_TIEBREAKS,
+                    chunk_size=tournament.STREAM_CHUNK_SIZE):
+    """Write a tournament's standings to a file.
+
+    Args:
+      f: the file to write to.
+      format: one of FORMATS.
+      tournament_id: the id of the tournament.
+      tiebreaks: the tiebreaks used to order players, as for playerStandings().
+      chunk_size: the number of rows read from the database at a time.
+
+    Returns:
+      The number of rows written.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown format %r, use one of %s."
+                         % (format, ', '.join(FORMATS)))
+    rows = tournament.iterStandings(tournament_id, tiebreaks, chunk_size)
+    if format == 'csv':
+        return writeCsv(f, rows)
+    return writeJsonLines(f, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export tournament standings as CSV or JSON Lines.")
+    parser.add_argument('--tournament', type=int,
+                        default=tournament.DEFAULT_TOURNAMENT,
+                        help="the id of the tournament")
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help="the file format to write")
+    parser.add_argument('--tiebreaks', nargs='*', choices=tournament.TIEBREAKS,
+                        default=list(tournament.DEFAULT_TIEBREAKS),
+                        help="tiebreaks ordering players with the same rank")
+    parser.add_argument('--chunk-size', type=int,
+                        default=tournament.STREAM_CHUNK_SIZE,
+                        help="rows read from the database at a time")
+    parser.add_argument('--output', default=None,
+                        help="file to write to, standard output by default")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            exportStandings(f, args.format, args.tournament, args.tiebreaks,
+                            args.chunk_size)
+    else:
+        exportStandings(sys.stdout, args.format, args.tournament,
+                        args.tiebreaks, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory storage backend for tournament.py
+#
+# Keeps tournaments in dicts and lists instead of PostgreSQL, giving the same
+# standings and pairings as the SQL schema.  Use it for tests and for
+# simulating many tournaments quickly:
+#
+#   import tournament, tournament_memory
+#   tournament.setBackend(tournament_memory.MemoryBackend())
+#
+
+import bisect
+
+import pairing
+
+
+class _Player(object):
+    """A player's registration and running totals."""
+
+    __slots__ = ('id', 'tournament', 'name', 'rating', 'wins', 'draws', 'played',
+                 'byes', 'opponent_wins', 'buchholz', 'median_buchholz',
+                 'sonneborn_berger', 'opponents', 'points')
+
+    def __init__(self, id, tournament, name, rating):
+        self.id = id
+        self.tournament = tournament
+        self.name = name
+        self.rating = rating
+        self.reset()
+
+    def reset(self):
+        self.wins = 0
+        self.draws = 0
+        self.played = 0
+        self.byes = 0
+        self.opponent_wins = 0
+        self.buchholz = 0
+        self.median_buchholz = 0
+        self.sonneborn_berger = 0
+        # Ids of the players played, not counting byes, and the points the
+        # player scored against each of them.
+        self.opponents = []
+        self.points = []
+
+    @property
+    def rank(self):
+        return self.played - self.wins - self.draws / 2.0
+
+    @property
+    def score(self):
+        return self.wins + self.draws / 2.0
+
+    def totals(self):
+        return (self.wins, self.draws, self.opponent_wins, self.played,
+                self.byes, self.rank, self.score, self.buchholz,
+                self.median_buchholz, self.sonneborn_berger)
+
+
+class _Tournament(object):
+    """A tournament's players and match results."""
+
+    def __init__(self, name):
+        self.name = name
+        self.players = {}
+        # (player1, player2, winner) tuples in the order they were reported.
+        self.matches = []
+        # pairing.pairKey() tuples of the players that have met.
+        self.played = set()
+        self.rounds = []
+
+
+class _Round(object):
+    """A round's pairings, and its standings once it has been closed."""
+
+    def __init__(self, id, number, pairs):
+        self.id = id
+        self.number = number
+        self.pairs = pairs
+        self.standings = None
+
+    @property
+    def closed(self):
+        return self.standings is not None
+
+
+class MemoryBackend(object):
+    """Stores tournaments in memory, for use with tournament.setBackend().
+
+    Ids are handed out from one sequence per kind, like the serial columns
+    of the SQL schema, and the default tournament exists from the start.
+    """
+
+    def __init__(self):
+        self._tournaments = {}
+        self._players = {}
+        self._next_tournament = 1
+        self._next_player = 1
+        self._next_round = 1
+        self.createTournament('Tournament')
+
+    def _get(self, tournament):
+        try:
+            return self._tournaments[tournament]
+        except KeyError:
+            raise ValueError("There is no tournament %s." % tournament)
+
+    def createTournament(self, name):
+        tournament = self._next_tournament
+        self._next_tournament += 1
+        self._tournaments[tournament] = _Tournament(name)
+        return tournament
+
+    def deleteTournament(self, tournament):
+        t = self._tournaments.pop(tournament, None)
+        if t is not None:
+            for player in t.players:
+                del self._players[player]
+
+    def deleteMatches(self, tournament):
+        t = self._get(tournament)
+        del t.matches[:]
+        del t.rounds[:]
+        t.played.clear()
+        for player in t.players.values():
+            player.reset()
+
+    def deletePlayers(self, tournament):
+        t = self._get(tournament)
+        if t.matches:
+            raise ValueError("Players with recorded matches can't be deleted.")
+        del t.rounds[:]
+        for player in t.players:
+            del self._players[player]
+        t.players.clear()
+
+    def countPlayers(self, tournament):
+        return len(self._get(tournament).players)
+
+    def countMatches(self, tournament):
+        return len(self._get(tournament).matches)
+
+    def registerPlayers(self, names, tournament, initial_ratings):
+        t = self._get(tournament)
+        ids = []
+        for (name, rating) in zip(names, initial_ratings):
+            player = _Player(self._next_player, tournament, name, rating)
+            self._next_player += 1
+            t.players[player.id] = player
+            self._players[player.id] = player
+            ids.append(player.id)
+        return ids
+
+    def playerRatings(self, tournament):
+        players = sorted(self._get(tournament).players.values(),
+                         key=lambda p: (-p.rating, p.id))
+        return [(p.id, p.name, p.rating) for p in players]
+
+    def playerStandings(self, tournament, tiebreaks=('opponent_wins',)):
+        return [_standingsRow(p) for p in self._ranked(tournament, tiebreaks)]
+
+    def iterStandings(self, tournament, tiebreaks, chunk_size):
+        for p in self._ranked(tournament, tiebreaks):
+            yield _standingsRow(p)
+
+    def standingsPage(self, tournament, tiebreaks, limit, after, offset):
+        ranked = self._ranked(tournament, tiebreaks)
+        start = 0
+        if after is not None:
+            # The cursor is (rank, tiebreaks..., id), the sort key negates
+            # the tiebreaks.
+            key = ((after[0],) + tuple(-value for value in after[1:-1])
+                   + (after[-1],))
+            keys = [_sortKey(p, tiebreaks) for p in ranked]
+            start = bisect.bisect_right(keys, key)
+        page = ranked[start + offset:start + offset + limit + 1]
+        cursor = None
+        if len(page) > limit:
+            last = page[limit - 1]
+            cursor = ((last.rank,) + tuple(getattr(last, t) for t in tiebreaks)
+                      + (last.id,))
+        return [_standingsRow(p) for p in page[:limit]], cursor
+
+    def playerTiebreaks(self, tournament, tiebreaks):
+        return [(p.id, p.score, p.opponent_wins, p.buchholz,
+                 p.median_buchholz, p.sonneborn_berger)
+                for p in self._ranked(tournament, tiebreaks)]
+
+    def _ranked(self, tournament, tiebreaks=('opponent_wins',)):
+        """Returns the tournament's players in standings order."""
+        return sorted(self._get(tournament).players.values(),
+                      key=lambda p: _sortKey(p, tiebreaks))
+
+    def reportMatches(self, results, players, tournament):
+        t = self._get(tournament)
+        for player in players:
+            if player not in t.players:
+                raise ValueError("Players in the round are not registered in "
+                                 "tournament %s." % tournament)
+        for (player1, player2, winner) in results:
+            if player1 == player2:
+                rematch = t.players[player1].byes > 0
+            else:
+                rematch = pairing.pairKey(player1, player2) in t.played
+            if rematch:
+                raise ValueError("Players %s and %s have already played."
+                                 % (player1, player2))
+        for (player1, player2, winner) in results:
+            t.matches.append((player1, player2, winner))
+            if player1 != player2:
+                t.played.add(pairing.pairKey(player1, player2))
+        self._record(t, results)
+
+    def _record(self, t, results):
+        """Bring the players' totals up to date with a round of results.
+
+        Follows the same steps as the SQL backend, so only the round's
+        players and their opponents are touched.
+        """
+        players = t.players
+        for (player1, player2, winner) in results:
+            p1 = players[player1]
+            if player1 == player2:
+                p1.played += 1
+                p1.wins += 1
+                p1.byes += 1
+                continue
+            p2 = players[player2]
+            p1.played += 1
+            p2.played += 1
+            if winner is None:
+                p1.draws += 1
+                p2.draws += 1
+            else:
+                players[winner].wins += 1
+            p1.opponents.append(player2)
+            p2.opponents.append(player1)
+            p1.points.append(_points(player1, winner))
+            p2.points.append(_points(player2, winner))
+        # The opponent tiebreaks change for everyone who has played one of
+        # the round's players.
+        affected = set()
+        for (player1, player2, winner) in results:
+            affected.update(players[player1].opponents)
+            affected.update(players[player2].opponents)
+        for player in affected:
+            _updateTiebreaks(players[player], players)
+
+    def _computed(self, t):
+        """Recompute every player's totals from the tournament's matches.
+
+        Returns:
+          A dict of player id to the same totals as _Player.totals().
+        """
+        wins = dict((player, 0) for player in t.players)
+        draws = dict(wins)
+        played = dict(wins)
+        byes = dict(wins)
+        opponents = dict((player, []) for player in t.players)
+        for (player1, player2, winner) in t.matches:
+            for player in set([player1, player2]):
+                played[player] += 1
+                if winner is None:
+                    draws[player] += 1
+            if winner is not None:
+                wins[winner] += 1
+            if player1 == player2:
+                byes[player1] += 1
+            else:
+                opponents[player1].append((player2, _points(player1, winner)))
+                opponents[player2].append((player1, _points(player2, winner)))
+        computed = {}
+        for player in t.players:
+            score = dict((o, wins[o] + draws[o] / 2.0)
+                         for (o, points) in opponents[player])
+            scores = [score[o] for (o, points) in opponents[player]]
+            if len(scores) > 2:
+                median = sum(scores) - max(scores) - min(scores)
+            else:
+                median = sum(scores)
+            computed[player] = (
+                wins[player], draws[player],
+                sum(wins[o] for (o, points) in opponents[player]),
+                played[player], byes[player],
+                played[player] - wins[player] - draws[player] / 2.0,
+                wins[player] + draws[player] / 2.0, sum(scores), median,
+                sum(score[o] * points for (o, points) in opponents[player]))
+        return computed
+
+    def rebuildStandings(self, tournament):
+        t = self._get(tournament)
+        for player in t.players.values():
+            player.reset()
+        for result in t.matches:
+            self._record(t, [result])
+
+    def checkStandings(self, tournament):
+        t = self._get(tournament)
+        computed = self._computed(t)
+        return sorted(player for (player, p) in t.players.items()
+                      if p.totals() != computed[player])
+
+    def roundVersion(self, tournament):
+        rounds = self._get(tournament).rounds
+        if not rounds:
+            return None
+        latest = rounds[-1]
+        return (latest.id, latest.number, latest.closed)
+
+    def startRound(self, tournament, pairs):
+        t = self._get(tournament)
+        if t.rounds and not t.rounds[-1].closed:
+            raise ValueError("Round %s of tournament %s hasn't been closed."
+                             % (t.rounds[-1].number, tournament))
+        t.rounds.append(_Round(self._next_round, len(t.rounds) + 1,
+                               list(pairs)))
+        self._next_round += 1
+        return t.rounds[-1].number
+
+    def closeRound(self, tournament, rate):
+        t = self._get(tournament)
+        if not t.rounds or t.rounds[-1].closed:
+            raise ValueError("Tournament %s has no open round." % tournament)
+        current = t.rounds[-1]
+        missing = []
+        for (id1, name1, id2, name2) in current.pairs:
+            if id1 == id2:
+                # A player only ever gets one bye.
+                played = t.players[id1].byes > 0
+            else:
+                played = pairing.pairKey(id1, id2) in t.played
+            if not played:
+                missing.append((id1, id2))
+        if missing:
+            raise ValueError("Round %s has no result for %s." % (
+                current.number, ', '.join('%s v %s' % pair for pair in missing)))
+        current.standings = self.playerStandings(tournament)
+        if rate is not None:
+            self._rateRound(t, current, rate)
+        return current.number
+
+    def _rateRound(self, t, current, rate):
+        paired = set(pairing.pairKey(id1, id2)
+                     for (id1, name1, id2, name2) in current.pairs)
+        results = [result for result in t.matches
+                   if pairing.pairKey(result[0], result[1]) in paired]
+        ratings = {}
+        for (player1, player2, winner) in results:
+            ratings[player1] = t.players[player1].rating
+            ratings[player2] = t.players[player2].rating
+        for (player, rating) in rate(ratings, results).items():
+            t.players[player].rating = rating
+
+    def roundPairings(self, tournament, number):
+        return list(self._get(tournament).rounds[number - 1].pairs)
+
+    def roundStandings(self, tournament, number):
+        return list(self._get(tournament).rounds[number - 1].standings)
+
+    def loadPairingData(self, tournament):
+        players = sorted(self._get(tournament).players.values(),
+                         key=lambda p: (p.rank, -p.rating, -p.opponent_wins,
+                                        p.id))
+        players = [(p.id, p.name, p.byes, p.rank) for p in players]
+        return players, self._get(tournament).played
+
+
+def _standingsRow(player):
+    """Returns a player's row of playerStandings()."""
+    return (player.id, player.name, player.wins, player.draws,
+            player.opponent_wins, player.played, player.byes, player.rank)
+
+
+def _sortKey(player, tiebreaks):
+    """Returns the key that sorts players into standings order."""
+    return ((player.rank,) + tuple(-getattr(player, t) for t in tiebreaks)
+            + (player.id,))
+
+
+def _points(player, winner):
+    """Returns the points a player scored in a match."""
+    if winner is None:
+        return 0.5
+    return int(winner == player)
+
+
+def _updateTiebreaks(player, players):
+    """Recompute a player's opponent tiebreaks from their opponents' totals."""
+    scores = [players[o].score for o in player.opponents]
+    player.opponent_wins = sum(players[o].wins for o in player.opponents)
+    player.buchholz = sum(scores)
+    if len(scores) > 2:
+        player.median_buchholz = player.buchholz - max(scores) - min(scores)
+    else:
+        player.median_buchholz = player.buchholz
+    player.sonneborn_berger = sum(
+        score * points for (score, points) in zip(scores, player.points))
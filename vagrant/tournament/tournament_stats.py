@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# tournament_stats.py -- timing and query statistics for tournament.py
+#
+# Off by default.  Once enabled, records how long each tournament.py call
+# takes, how long each SQL statement takes and how many rows it touched,
+# and how long it takes to get a connection from the pool:
+#
+#   import tournament, tournament_stats
+#   tournament_stats.enable()
+#   tournament.swissPairings()
+#   print(tournament_stats.snapshot())
+#
+# enable(explain_plans=True) also captures an EXPLAIN ANALYZE plan for each
+# statement the first time it runs.  Disabled, the only cost is a flag
+# check per call and per statement.
+#
+
+import contextlib
+import functools
+import threading
+import time
+
+try:
+    import psycopg2.extensions
+except ImportError:
+    # Only needed to count SQL statements.
+    psycopg2 = None
+
+
+enabled = False
+explain = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_functions = {}
+_statements = {}
+_plans = {}
+
+
+class _Timing(object):
+    """Running totals for one function or statement."""
+
+    __slots__ = ('calls', 'seconds', 'max', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, seconds, rows=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        if rows > 0:
+            self.rows += rows
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'total_ms': 1000 * self.seconds,
+            'mean_ms': 1000 * self.seconds / self.calls if self.calls else 0.0,
+            'max_ms': 1000 * self.max,
+            'rows': self.rows,
+        }
+
+
+_connections = _Timing()
+
+
+def enable(explain_plans=False):
+    """Start recording statistics.
+
+    Args:
+      explain_plans: also capture the EXPLAIN ANALYZE plan of each statement
+        the first time it runs.  Each statement is then run twice the first
+        time, the plan inside a savepoint that is rolled back.
+    """
+    global enabled, explain
+    enabled = True
+    explain = explain_plans
+
+
+def disable():
+    """Stop recording statistics, keeping those recorded so far."""
+    global enabled, explain
+    enabled = False
+    explain = False
+
+
+def reset():
+    """Forget all the statistics recorded so far."""
+    global _connections
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+        _plans.clear()
+        _connections = _Timing()
+
+
+def snapshot():
+    """Returns the statistics recorded so far.
+
+    Returns:
+      A dict with keys:
+        functions: a dict of tournament.py function name to its calls,
+          total_ms, mean_ms and max_ms.
+        statements: a dict of SQL statement to the same, plus the number of
+          rows the statement returned or changed.
+        connections: the calls, total_ms, mean_ms and max_ms of getting a
+          connection from the pool.
+        plans: a dict of SQL statement to its EXPLAIN ANALYZE plan.
+    """
+    with _lock:
+        return {
+            'functions': dict((name, timing.summary())
+                              for (name, timing) in _functions.items()),
+            'statements': dict((sql, timing.summary())
+                               for (sql, timing) in _statements.items()),
+            'connections': _connections.summary(),
+            'plans': dict(_plans),
+        }
+
+
+def queryCount():
+    """Returns the number of SQL statements recorded so far."""
+    with _lock:
+        return sum(timing.calls for timing in _statements.values())
+
+
+def timed(function):
+    """Decorator recording the time taken by each call of a function."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _record(_functions, name, time.time() - start)
+    return wrapper
+
+
+def recordConnection(seconds):
+    """Record the time taken to get a connection from the pool."""
+    with _lock:
+        _connections.add(seconds)
+
+
+@contextlib.contextmanager
+def statement(sql):
+    """Record the statements run in the block under sql.
+
+    psycopg2.extras.execute_values() runs its statement with the rows
+    written into it, so this keeps a batch under its template instead of
+    one entry per batch.
+    """
+    _local.statement = sql
+    try:
+        yield
+    finally:
+        _local.statement = None
+
+
+def _record(table, key, seconds, rows=0):
+    with _lock:
+        timing = table.get(key)
+        if timing is None:
+            timing = table[key] = _Timing()
+        timing.add(seconds, rows)
+
+
+def _statementKey(sql):
+    """Returns a statement with its whitespace collapsed, as a str."""
+    if bytes is not str and isinstance(sql, bytes):
+        sql = sql.decode('utf-8')
+    return ' '.join(sql.split())
+
+
+if psycopg2 is not None:
+    class InstrumentedCursor(psycopg2.extensions.cursor):
+        """A psycopg2 cursor that records its statements when enabled."""
+
+        def execute(self, query, vars=None):
+            if not enabled:
+                return psycopg2.extensions.cursor.execute(self, query, vars)
+            key = _statementKey(getattr(_local, 'statement', None) or query)
+            if explain and key not in _plans:
+                self._explain(key, query, vars)
+            start = time.time()
+            try:
+                return psycopg2.extensions.cursor.execute(self, query, vars)
+            finally:
+                _record(_statements, key, time.time() - start, self.rowcount)
+
+        def _explain(self, key, query, vars):
+            # A named cursor's statement can't be explained, and outside a
+            # transaction there is no savepoint to roll the plan back to.
+            if self.name is not None or self.connection.autocommit:
+                return
+            if bytes is not str and isinstance(query, bytes):
+                query = query.decode('utf-8')
+            execute = psycopg2.extensions.cursor.execute
+            execute(self, "SAVEPOINT stats_explain;")
+            try:
+                execute(self, "EXPLAIN ANALYZE " + query, vars)
+                plan = '\n'.join(row[0] for row in self.fetchall())
+            finally:
+                execute(self, "ROLLBACK TO SAVEPOINT stats_explain;")
+                execute(self, "RELEASE SAVEPOINT stats_explain;")
+            with _lock:
+                _plans[key] = plan
+else:
+    InstrumentedCursor = None
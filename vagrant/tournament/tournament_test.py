@@ -3,8 +3,12 @@
 # Test cases for tournament.py
 
 import math
+import sys
 from random import randint
 from tournament import *
+import pairing
+import tournament_memory
+import tournament_stats
 
 def testDeleteMatches():
     deleteMatches()
@@ -178,14 +182,269 @@ def testOpponentWins():
     print "11. After 1 match, the player standings shows that each player has a win or an opponent win."
 
 
+def test3PlayerTournament():
+    testTournament(3)
+    print "12. After a 3 player simulated tournament, player wins and matches are correct."
+
+
 def test4PlayerTournament():
     testTournament(4)
-    print "12. After a 4 player simulated tournament, player wins and matches are correct."
+    print "13. After a 4 player simulated tournament, player wins and matches are correct."
 
 
 def test5PlayerTournament():
     testTournament(5)
-    print "13. After a 5 player simulated tournament, player wins and matches are correct."
+    print "14. After a 5 player simulated tournament, player wins and matches are correct."
+
+
+def testConnectionPool():
+    conn = connect()
+    raw = conn._conn
+    conn.close()
+    conn = connect()
+    if conn._conn is not raw:
+        raise ValueError("A closed connection should be reused from the pool.")
+    conn.close()
+    with getCursor() as c:
+        c.execute("SELECT 1;")
+        if c.fetchone()[0] != 1:
+            raise ValueError("getCursor() should give a working cursor.")
+    print "15. Connections are returned to the pool and reused."
+
+
+def testLargePairing():
+    players = [(x, "Player%05d" % x, 0, 0) for x in range(10001)]
+    played = set()
+    for x in range(0, 10000, 2):
+        played.add(pairing.pairKey(x, x + 1))
+    pairings = pairing.pairPlayers(players, played)
+    ids = [i for (id1, name1, id2, name2) in pairings for i in (id1, id2)]
+    if len(pairings) != 5001 or len(set(ids)) != 10001:
+        raise ValueError("Each of 10001 players should be paired exactly once.")
+    for (id1, name1, id2, name2) in pairings:
+        if pairing.pairKey(id1, id2) in played:
+            raise ValueError("Players should not be paired for a rematch.")
+    print "16. A 10001 player round is paired without rematches."
+
+
+def testPairingBacktracks():
+    # Pairing down the standings gives 1-2, leaving 3 and 4 who have met.
+    players = [(x, "Player%d" % x, 0, 0) for x in range(1, 5)]
+    result = pairing.solvePairings(players, set([pairing.pairKey(3, 4)]))
+    for (id1, name1, id2, name2) in result.pairs:
+        if pairing.pairKey(id1, id2) == (3, 4):
+            raise ValueError("Players should not be paired for a rematch.")
+    if len(result.pairs) != 2 or result.nodes < 3:
+        raise ValueError("The pairing search should backtrack to pair all players.")
+    print "17. Pairing backtracks when pairing down the standings fails."
+
+
+def testStandingsTable():
+    testTournament(7)
+    if checkStandings():
+        raise ValueError("The standings table should match the matches played.")
+    standings = playerStandings()
+    rebuildStandings()
+    if playerStandings() != standings:
+        raise ValueError("Rebuilding the standings table should not change it.")
+    print "18. The standings table is kept up to date as matches are reported."
+
+
+def testBatchReporting():
+    deleteMatches()
+    deletePlayers()
+    [id1, id2, id3, id4, id5] = registerPlayers(
+        ["Kirk", "Spock", "McCoy", "Scotty", "Uhura"])
+    if countPlayers() != 5:
+        raise ValueError("registerPlayers() should register every player.")
+    reportMatches([(id1, id2, id1), (id3, id4, None), (id5, id5, id5)])
+    if countMatches() != 3:
+        raise ValueError("reportMatches() should record the whole round.")
+    try:
+        reportMatches([(id1, id3, id1), (id2, id1, id2)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A player should not appear twice in a round.")
+    try:
+        reportMatches([(id1, id3, id1), (id4, id2, id4), (id5, id5, id5)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A round with a second bye should be rejected.")
+    if countMatches() != 3 or checkStandings():
+        raise ValueError("A rejected round should not record any matches.")
+    print "19. A round of results can be reported in one transaction."
+
+
+def testMultipleTournaments():
+    deleteMatches()
+    deletePlayers()
+    other = createTournament("Other Tournament")
+    registerPlayers(["Kirk", "Spock"])
+    [id1, id2, id3] = registerPlayers(["Picard", "Riker", "Data"], other)
+    if countPlayers() != 2 or countPlayers(other) != 3:
+        raise ValueError("Players should only be counted in their tournament.")
+    reportMatches([(id1, id2, id1), (id3, id3, id3)], other)
+    if countMatches() != 0 or countMatches(other) != 2:
+        raise ValueError("Matches should only be counted in their tournament.")
+    if [row[0] for row in playerStandings(other)][0] not in (id1, id3):
+        raise ValueError("Standings should only show the tournament's players.")
+    try:
+        reportMatch(id1, id3, id1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Players should only play in their own tournament.")
+    deleteTournament(other)
+    if countPlayers() != 2:
+        raise ValueError("Deleting a tournament should leave others alone.")
+    print "20. Tournaments are kept apart from each other."
+
+
+def testTiebreaks():
+    deleteMatches()
+    deletePlayers()
+    [a, b, c, d] = registerPlayers(["Kirk", "Spock", "McCoy", "Scotty"])
+    reportMatches([(a, b, a), (c, d, None)])
+    reportMatches([(a, c, None), (b, d, b)])
+    standings = playerStandings(tiebreaks=['sonneborn_berger'])
+    if [row[0] for row in standings] != [a, c, b, d]:
+        raise ValueError("Players with the same rank should be ordered by "
+                         "the chosen tiebreak.")
+    tiebreaks = dict((row[0], row[1:]) for row in playerTiebreaks())
+    if (tiebreaks[a] != (1.5, 1, 2, 2, 1.5) or
+            tiebreaks[c] != (1, 1, 2, 2, 1) or
+            tiebreaks[d] != (0.5, 1, 2, 2, 0.5)):
+        raise ValueError("Tiebreaks should be kept up to date as matches "
+                         "are reported.")
+    if checkStandings():
+        raise ValueError("Tiebreaks should match those computed from results.")
+    print "21. Standings can be ordered by Buchholz and Sonneborn-Berger tiebreaks."
+
+
+def testRounds():
+    deleteMatches()
+    deletePlayers()
+    [a, b, c, d] = registerPlayers(["Kirk", "Spock", "McCoy", "Scotty"])
+    if currentRound() is not None:
+        raise ValueError("No round should be started before startRound().")
+    pairs = startRound()
+    if len(pairs) != 2 or currentRound() != (1, False):
+        raise ValueError("startRound() should pair and open round 1.")
+    if roundPairings() != tuple(pairs) or roundPairings() is not roundPairings():
+        raise ValueError("A round's pairings should be read back from cache.")
+    try:
+        startRound()
+        raise ValueError("A round can't start before the last is closed.")
+    except ValueError as e:
+        if "hasn't been closed" not in str(e):
+            raise
+    (id1, name1, id2, name2) = pairs[0]
+    reportMatch(id1, id2, id1)
+    try:
+        closeRound()
+        raise ValueError("A round with missing results can't be closed.")
+    except ValueError as e:
+        if "no result" not in str(e):
+            raise
+    (id3, name3, id4, name4) = pairs[1]
+    reportMatch(id3, id4)
+    if closeRound() != 1 or currentRound() != (1, True):
+        raise ValueError("closeRound() should close round 1.")
+    if list(roundStandings()) != playerStandings():
+        raise ValueError("A closed round should snapshot the standings.")
+    startRound()
+    if roundStandings() != roundStandings(round=1) or len(roundPairings(round=1)) != 2:
+        raise ValueError("Earlier rounds should still be readable.")
+    deleteMatches()
+    if currentRound() is not None:
+        raise ValueError("Deleting the matches should delete the rounds.")
+    print "22. Rounds are started, closed and read back from cache."
+
+
+def testStreamingStandings():
+    deleteMatches()
+    deletePlayers()
+    simTournament(["Player%02d" % x for x in range(25)])
+    standings = playerStandings()
+    if list(iterStandings(chunk_size=4)) != standings:
+        raise ValueError("iterStandings() should give the same rows as "
+                         "playerStandings().")
+    for tiebreaks in [DEFAULT_TIEBREAKS, ['buchholz', 'sonneborn_berger']]:
+        pages = []
+        cursor = None
+        while True:
+            rows, cursor = standingsPage(limit=7, after=cursor,
+                                         tiebreaks=tiebreaks)
+            pages.extend(rows)
+            if cursor is None:
+                break
+        if pages != playerStandings(tiebreaks=tiebreaks):
+            raise ValueError("Paging through the standings should give every "
+                             "row once, in order.")
+    rows, cursor = standingsPage(limit=5, offset=20)
+    if rows != standings[20:] or cursor is not None:
+        raise ValueError("An offset page should skip the earlier rows.")
+    print "23. Standings can be streamed and read a page at a time."
+
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    [a, b, c, d] = registerPlayers(["Kirk", "Spock", "McCoy", "Scotty"],
+                                   initial_ratings=[1400, 2000, 1700, None])
+    pairs = set((id1, id2) for (id1, name1, id2, name2) in startRound())
+    if pairs != set([(b, d), (c, a)]):
+        raise ValueError("Round 1 should pair the top half of the field by "
+                         "rating against the bottom half.")
+    reportMatches([(b, d, d), (c, a, c)])
+    closeRound()
+    rated = dict((id, rating) for (id, name, rating) in playerRatings())
+    if not (rated[a] < 1400 and rated[b] < 2000 and rated[c] > 1700 and
+            rated[d] > 1500):
+        raise ValueError("Closing a round should update the ratings.")
+    if abs(sum(rated.values()) - 6600) > 1e-6:
+        raise ValueError("Rating points should only move between opponents.")
+    print "24. Players are seeded by rating, and rated as rounds close."
+
+
+def testStats():
+    tournament_stats.reset()
+    countPlayers()
+    if tournament_stats.snapshot()['functions']:
+        raise ValueError("Nothing should be recorded until stats are enabled.")
+    tournament_stats.enable()
+    try:
+        countPlayers()
+        countPlayers()
+        swissPairings()
+    finally:
+        tournament_stats.disable()
+    functions = tournament_stats.snapshot()['functions']
+    if (functions['countPlayers']['calls'] != 2 or
+            functions['loadPairingData']['calls'] != 1):
+        raise ValueError("Each call should be recorded once stats are enabled.")
+    tournament_stats.reset()
+    print "25. Calls can be timed with tournament_stats."
+
+
+def testByeChoice():
+    # After two rounds of five players, 3 and 5 are 2-0 and 2 and 5 have had
+    # byes.  Giving the bye to 1 would force 3-2 and 5-4, but giving it to 4
+    # lets the leaders meet, and 2 play 1.
+    players = [(3, "Player3", 0, 0), (5, "Player5", 1, 0),
+               (2, "Player2", 1, 1), (4, "Player4", 0, 1),
+               (1, "Player1", 0, 2)]
+    played = set(pairing.pairKey(a, b)
+                 for (a, b) in [(1, 3), (2, 4), (3, 4), (1, 5)])
+    result = pairing.solvePairings(players, played)
+    if result.pairs[0][0] != 4 or result.pairs[0][2] != 4:
+        raise ValueError("The bye should go to the player who leaves the "
+                         "cheapest pairing of the rest.")
+    if result.cost != 1 or (3, "Player3", 5, "Player5") not in result.pairs:
+        raise ValueError("The 2-0 players should be paired together.")
+    print "26. The bye is given where it leaves the cheapest pairing."
 
 
 def testTournament(player_count):
@@ -274,6 +533,9 @@ def justKeepTesting():
 
 
 if __name__ == '__main__':
+    # Run against the in-memory backend with: tournament_test.py memory
+    if sys.argv[1:] == ['memory']:
+        setBackend(tournament_memory.MemoryBackend())
     testDeleteMatches()
     testDelete()
     testCount()
@@ -288,6 +550,19 @@ if __name__ == '__main__':
     test3PlayerTournament()
     test4PlayerTournament()
     test5PlayerTournament()
+    if isinstance(getBackend(), PostgresBackend):
+        testConnectionPool()
+    testLargePairing()
+    testPairingBacktracks()
+    testStandingsTable()
+    testBatchReporting()
+    testMultipleTournaments()
+    testTiebreaks()
+    testRounds()
+    testStreamingStandings()
+    testRatings()
+    testStats()
+    testByeChoice()
     print "Success!  All tests pass!"
 
 